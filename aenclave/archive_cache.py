@@ -0,0 +1,140 @@
+# menclave/aenclave/archive_cache.py
+
+"""An on-disk cache of prebuilt zip archives of songs.
+
+People download the same albums and playlists over and over, so the first
+download of a selection is teed into the cache while it streams, and later
+downloads are served straight from the cached file (with Range support) with
+no archive building at all.
+
+Archives are keyed by a hash of the ordered song ids, checksums and archive
+names.  The cache has a size budget, AENCLAVE_ARCHIVE_CACHE_SIZE, and the
+least recently used archives are evicted to stay under it.  Archives are also
+dropped as soon as one of their songs is edited or deleted.
+"""
+
+import datetime
+import hashlib
+import logging
+import os
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import Sum
+
+from menclave.aenclave.models import CachedArchive
+
+# Don't bother updating last_access more often than this.  It only needs to
+# be good enough for LRU eviction.
+ACCESS_RESOLUTION = datetime.timedelta(0, 60)
+
+def cache_dir():
+    return getattr(settings, 'AENCLAVE_ARCHIVE_CACHE_DIR',
+                   os.path.join(settings.MEDIA_ROOT, 'aenclave/archive-cache'))
+
+def cache_budget():
+    """The size budget of the cache in bytes.  Zero disables the cache."""
+    return getattr(settings, 'AENCLAVE_ARCHIVE_CACHE_SIZE', 0)
+
+def is_cacheable(size):
+    """Archives bigger than a quarter of the budget would evict too much."""
+    budget = cache_budget()
+    return budget > 0 and size <= budget // 4
+
+def archive_key(members):
+    """Hash a list of (song, arcname) tuples into a cache key."""
+    h = hashlib.sha1()
+    for (song, arcname) in members:
+        h.update('%d:%s:%s\n' % (song.pk, song.filechecksum, arcname))
+    return h.hexdigest()
+
+def archive_path(key):
+    return os.path.join(cache_dir(), key + '.zip')
+
+def lookup(key):
+    """Return the path of the cached archive for key, or None on a miss."""
+    try:
+        archive = CachedArchive.objects.get(key=key)
+    except CachedArchive.DoesNotExist:
+        return None
+    path = archive_path(key)
+    if not os.path.exists(path):
+        # Somebody cleaned up the cache directory behind our back.
+        archive.delete()
+        return None
+    now = datetime.datetime.now()
+    if now - archive.last_access > ACCESS_RESOLUTION:
+        CachedArchive.objects.filter(pk=archive.pk).update(last_access=now)
+    return path
+
+def tee(stream, key, songs):
+    """Yield the chunks of stream while also writing them into the cache.
+
+    The archive is written to a temp file and only renamed into place and
+    registered once the whole thing has been sent.  If the client goes away
+    part way through, the generator is closed and the temp file removed.
+    """
+    directory = cache_dir()
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp_path = '%s.tmp-%d-%s' % (archive_path(key), os.getpid(), id(stream))
+    f = open(tmp_path, 'wb')
+    complete = False
+    try:
+        for chunk in stream:
+            f.write(chunk)
+            yield chunk
+        complete = True
+    finally:
+        f.close()
+        if complete:
+            try:
+                _register(tmp_path, key, songs)
+            except Exception:
+                # The download itself succeeded, so don't let a cache failure
+                # break the response.
+                logging.exception('Unable to cache archive %s.', key)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _register(tmp_path, key, songs):
+    size = os.path.getsize(tmp_path)
+    os.rename(tmp_path, archive_path(key))
+    archive = CachedArchive(key=key, size=size,
+                            last_access=datetime.datetime.now())
+    try:
+        archive.save()
+    except IntegrityError:
+        # Two people downloaded the same thing at once; the other one won.
+        return
+    archive.songs.add(*[song.pk for song in songs])
+    evict()
+
+def _remove(archives):
+    for archive in archives:
+        path = archive_path(archive.key)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        archive.delete()
+
+def evict():
+    """Evict the least recently used archives until we're under budget."""
+    budget = cache_budget()
+    total = CachedArchive.objects.aggregate(total=Sum('size'))['total'] or 0
+    if total <= budget:
+        return
+    victims = []
+    for archive in CachedArchive.objects.order_by('last_access'):
+        if total <= budget:
+            break
+        victims.append(archive)
+        total -= archive.size
+    _remove(victims)
+
+def invalidate_songs(song_ids):
+    """Drop every cached archive that contains any of these songs."""
+    if song_ids:
+        _remove(CachedArchive.objects.filter(songs__in=list(song_ids))
+                .distinct())
@@ -0,0 +1,266 @@
+# menclave/aenclave/artwork.py
+
+"""Album art embedded in song files.
+
+The art is pulled out of the ID3 APIC frames of MP3s and the covr atom of
+M4As when a song is ingested, or by the extract_art command for songs that
+were added before.  Images are stored by their md5, like the songs, so every
+track of an album that embeds the same cover shares one file, and the
+thumbnails are made once, when an image is first stored:
+
+    aenclave/art/ab/abcd....png         -- the image as it was embedded
+    aenclave/art/ab/abcd...-150.jpg     -- a 150 pixel JPEG thumbnail
+
+Since the names change whenever the image does, the art view tells browsers
+to cache them for a long time, and rendering a song list never touches an
+image.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from StringIO import StringIO
+
+from mutagen.id3 import ID3, ID3NoHeaderError
+from mutagen.mp4 import MP4, MP4Cover
+
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+from menclave.aenclave import download
+
+try:
+    from PIL import Image
+except ImportError:
+    try:
+        import Image
+    except ImportError:
+        # Without PIL we store the art, but can't make thumbnails of it.
+        Image = None
+
+ART_ROOT = 'aenclave/art'
+
+# The ID3 picture type of a front cover.
+FRONT_COVER = 3
+
+# Browsers may cache art for this many seconds, since its URLs never change.
+CACHE_SECONDS = 365 * 24 * 60 * 60
+
+# The image types we store, by their extension, and the first bytes of each.
+# Files often give the wrong mime type, so the data is trusted over it.
+IMAGE_TYPES = {'.jpg': 'image/jpeg',
+               '.png': 'image/png',
+               '.gif': 'image/gif',
+               '.bmp': 'image/bmp'}
+_MAGIC = (('\xff\xd8', '.jpg'),
+          ('\x89PNG', '.png'),
+          ('GIF8', '.gif'),
+          ('BM', '.bmp'))
+
+def art_sizes():
+    """The thumbnail sizes to make, in pixels along the longest side."""
+    return getattr(settings, 'AENCLAVE_ART_SIZES', (32, 150, 300))
+
+#-------------------------------- Extraction ---------------------------------#
+
+def read_artwork(path):
+    """Return the embedded art of the song file at path, or None.
+
+    Returns a tuple of the image data and its mime type.  MP3s may embed
+    several pictures, so we prefer the front cover.
+    """
+    # Mutagen doesn't like unicode
+    path_latin1 = path.encode('latin1')
+    ext = path.lower()[len(path)-3:]
+    if ext == 'mp3':
+        try:
+            tags = ID3(path_latin1)
+        except ID3NoHeaderError:
+            return None
+        pictures = tags.getall('APIC')
+        if not pictures:
+            return None
+        pictures.sort(key=lambda picture: picture.type != FRONT_COVER)
+        return (pictures[0].data, pictures[0].mime)
+    elif ext == 'm4a':
+        audio = MP4(path_latin1)
+        covers = (audio.tags or {}).get('covr')
+        if not covers:
+            return None
+        if covers[0].imageformat == MP4Cover.FORMAT_PNG:
+            return (str(covers[0]), 'image/png')
+        return (str(covers[0]), 'image/jpeg')
+    return None
+
+#--------------------------------- Storage -----------------------------------#
+
+def image_extension(data, mime):
+    """Return the extension to store an image under, or None if unknown."""
+    for (magic, ext) in _MAGIC:
+        if data.startswith(magic):
+            return ext
+    mime = mime.lower().replace('image/jpg', 'image/jpeg')
+    for (ext, image_type) in IMAGE_TYPES.iteritems():
+        if image_type == mime:
+            return ext
+    return None
+
+def art_path(digest, size=None, ext='.jpg'):
+    """Return the path of a stored image relative to MEDIA_ROOT.
+
+    size is None for the image as it was embedded.
+    """
+    if size is not None:
+        name = '%s-%d.jpg' % (digest, size)
+    else:
+        name = digest + ext
+    return os.path.join(ART_ROOT, digest[:2], name)
+
+def _write_atomically(path, data):
+    # Another worker may be storing the same image, so write it under a
+    # temporary name and rename it into place.
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+    (fd, temp_path) = tempfile.mkstemp(dir=directory, suffix='.part')
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+    os.rename(temp_path, path)
+
+def make_thumbnail(data, size):
+    """Return data shrunk to fit in a size by size square, as a JPEG."""
+    image = Image.open(StringIO(data))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image.thumbnail((size, size), Image.ANTIALIAS)
+    output = StringIO()
+    image.save(output, 'JPEG', quality=85)
+    return output.getvalue()
+
+def make_thumbnails(digest, data):
+    """Make any missing thumbnails of an image.  Does nothing without PIL."""
+    if Image is None:
+        return
+    for size in art_sizes():
+        path = os.path.join(settings.MEDIA_ROOT, art_path(digest, size))
+        if not os.path.exists(path):
+            _write_atomically(path, make_thumbnail(data, size))
+
+def store_artwork(data, mime):
+    """Store an image and its thumbnails, unless it's already stored.
+
+    Returns the image's path relative to MEDIA_ROOT, for Song.album_art, or
+    '' if it isn't an image type we know.
+    """
+    ext = image_extension(data, mime)
+    if ext is None:
+        return ''
+    digest = hashlib.md5(data).hexdigest()
+    name = art_path(digest, ext=ext)
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    if not os.path.exists(path):
+        make_thumbnails(digest, data)
+        _write_atomically(path, data)
+    return name
+
+def extract_artwork(path):
+    """Read and store the embedded art of a song file.
+
+    Returns the stored image's name, or '' if the file has no art.
+    """
+    art = read_artwork(path)
+    if art is None:
+        return ''
+    return store_artwork(*art)
+
+def annotate_artwork(song):
+    """Fill in a song's album_art from its file.  Doesn't save the song.
+
+    Broken art is logged and skipped; it's not worth failing an upload over.
+    """
+    try:
+        song.album_art = extract_artwork(song.audio.path) or None
+    except Exception:
+        logging.exception('Could not read the art of %s', song.audio.name)
+
+def art_url(song, size):
+    """Return the URL of a song's art thumbnail, or '' if it has none.
+
+    This only looks at the song's album_art name, so it's cheap to call for
+    every song in a list.
+    """
+    if not song.album_art:
+        return ''
+    digest = os.path.splitext(os.path.basename(song.album_art.name))[0]
+    return reverse('aenclave-art', args=(digest, size))
+
+#----------------------------------- View ------------------------------------#
+
+def art(request, digest, size):
+    """Serve a thumbnail.  Thumbnails rarely change, so they're cached long.
+
+    Thumbnails that are missing, say because AENCLAVE_ART_SIZES changed, are
+    made from the original the first time they are asked for.  The ETag and
+    Last-Modified date follow the thumbnail file, so a remade one is sent
+    again.
+    """
+    size = int(size)
+    if size not in art_sizes():
+        raise Http404
+    path = os.path.join(settings.MEDIA_ROOT, art_path(digest, size))
+    if not os.path.exists(path):
+        original = None
+        for ext in IMAGE_TYPES:
+            candidate = os.path.join(settings.MEDIA_ROOT,
+                                     art_path(digest, ext=ext))
+            if os.path.exists(candidate):
+                original = candidate
+        if original is None:
+            raise Http404
+        if Image is None:
+            # We can't shrink it, so send the whole thing.
+            path = original
+        else:
+            f = open(original, 'rb')
+            try:
+                make_thumbnails(digest, f.read())
+            finally:
+                f.close()
+
+    stat = os.stat(path)
+    etag = download.file_etag(path, '%s-%d' % (digest, size), stat)
+    meta = request.META
+    if 'HTTP_IF_NONE_MATCH' in meta:
+        not_modified = download._etag_matches(meta['HTTP_IF_NONE_MATCH'], etag)
+    else:
+        not_modified = not was_modified_since(
+            meta.get('HTTP_IF_MODIFIED_SINCE'), int(stat.st_mtime),
+            stat.st_size)
+    if not_modified:
+        response = HttpResponseNotModified()
+    else:
+        content_type = IMAGE_TYPES.get(os.path.splitext(path)[1],
+                                       'image/jpeg')
+        response = download._sendfile_response(path, content_type)
+        if response is None:
+            f = open(path, 'rb')
+            try:
+                response = HttpResponse(f.read(), content_type=content_type)
+            finally:
+                f.close()
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = 'public, max-age=%d' % CACHE_SECONDS
+    response['Expires'] = http_date(time.time() + CACHE_SECONDS)
+    return response
@@ -1,9 +1,15 @@
+import datetime
+import json
+
+from django.conf import settings
 from django.template import RequestContext
 from django.views.generic.list_detail import object_detail
 
 from menclave.aenclave.models import Song
+from menclave.aenclave.json_response import render_json_response
 from menclave.aenclave.utils import get_song_list
 from menclave.aenclave.html import render_html_template
+from menclave.aenclave import history
 
 
 #--------------------------------- Browsing ----------------------------------#
@@ -56,10 +62,44 @@ def view_artist(request, artist_name):
                                  'song_list': songs},
                                 context_instance=RequestContext(request))
 
+# The song page counts plays over this many days.
+RECENT_PLAY_DAYS = 30
+
 def view_song(request, object_id):
+    since = datetime.date.today() - datetime.timedelta(RECENT_PLAY_DAYS)
+    recent_plays = history.play_counts(since, [int(object_id)])
     return object_detail(object_id=object_id,
                          queryset=Song.objects,
-                         template_name='song_detail.html')
+                         template_name='song_detail.html',
+                         extra_context={
+                             'recent_plays': recent_plays.get(int(object_id), 0),
+                             'recent_play_days': RECENT_PLAY_DAYS})
+
+#-------------------------------- Hot Songs ----------------------------------#
+
+# Never list more hot songs than this, whatever the request asks for.
+MAX_HOT_SONGS = 500
+
+def _hot_count(request):
+    default = getattr(settings, 'AENCLAVE_HOT_SONGS', 100)
+    try:
+        count = int(request.GET.get('count', default))
+    except ValueError:
+        count = default
+    return max(1, min(count, MAX_HOT_SONGS))
+
+def browse_hot(request):
+    songs = Song.annotate_favorited(Song.hottest(_hot_count(request)),
+                                    request.user)
+    return render_html_template('aenclave/list_songs.html', request,
+                                {'song_list': songs, 'title': 'Hot Songs'},
+                                context_instance=RequestContext(request))
+
+def json_hot(request):
+    songs = [{'id': song.id, 'title': song.title, 'artist': song.artist,
+              'album': song.album, 'score': song.adjusted_score()}
+             for song in Song.hottest(_hot_count(request))]
+    return render_json_response(json.dumps(songs))
 
 def list_songs(request):
     songs = get_song_list(request.REQUEST)
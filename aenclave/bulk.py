@@ -0,0 +1,88 @@
+# menclave/aenclave/bulk.py
+
+"""Helpers for writing many rows with a few queries.
+
+The ORM saves one row per query and writes every column, which is far too
+slow for maintenance commands that touch the whole library.  These helpers go
+straight to the cursor, so they skip save() and the model signals.
+"""
+
+from django.db import connection, transaction
+
+def _column(model, field_name):
+    return connection.ops.quote_name(model._meta.get_field(field_name).column)
+
+def update_rows(model, fields, rows):
+    """Update only the given fields of many rows with executemany.
+
+    rows is a list of tuples of the new field values followed by the primary
+    key, like [(checksum, size, pk), ...].  Returns the number of rows.
+    """
+    if not rows:
+        return 0
+    qn = connection.ops.quote_name
+    assignments = ', '.join('%s = %%s' % _column(model, name)
+                            for name in fields)
+    sql = 'UPDATE %s SET %s WHERE %s = %%s' % (qn(model._meta.db_table),
+                                              assignments,
+                                              qn(model._meta.pk.column))
+    cursor = connection.cursor()
+    cursor.executemany(sql, rows)
+    transaction.commit_unless_managed()
+    return len(rows)
+
+def increment_rows(model, field, rows):
+    """Add to one numeric field of many rows with executemany.
+
+    rows is a list of (amount, pk) tuples.  The addition happens in the
+    database, so concurrent increments aren't lost.  Returns the number of
+    rows.
+    """
+    if not rows:
+        return 0
+    qn = connection.ops.quote_name
+    column = _column(model, field)
+    sql = 'UPDATE %s SET %s = %s + %%s WHERE %s = %%s' % (
+            qn(model._meta.db_table), column, column,
+            qn(model._meta.pk.column))
+    cursor = connection.cursor()
+    cursor.executemany(sql, rows)
+    transaction.commit_unless_managed()
+    return len(rows)
+
+def insert_rows(model, fields, rows):
+    """Insert many rows with executemany.
+
+    rows is a list of tuples of the field values, in the order of fields.
+    Fields that aren't given get their database defaults, so give every
+    field without one.  Returns the number of rows.
+    """
+    if not rows:
+        return 0
+    qn = connection.ops.quote_name
+    columns = ', '.join(_column(model, name) for name in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (qn(model._meta.db_table),
+                                               columns, placeholders)
+    cursor = connection.cursor()
+    cursor.executemany(sql, rows)
+    transaction.commit_unless_managed()
+    return len(rows)
+
+def delete_rows(model, pks, chunk_size=500):
+    """Delete rows by primary key without loading them.
+
+    Nothing is cascaded, so only use this on tables that no other table
+    refers to.  Returns the number of primary keys given.
+    """
+    pks = list(pks)
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    for i in xrange(0, len(pks), chunk_size):
+        chunk = pks[i:i+chunk_size]
+        sql = 'DELETE FROM %s WHERE %s IN (%s)' % (
+                qn(model._meta.db_table), qn(model._meta.pk.column),
+                ', '.join(['%s'] * len(chunk)))
+        cursor.execute(sql, chunk)
+    transaction.commit_unless_managed()
+    return len(pks)
@@ -18,14 +18,12 @@ def get_bundles(_MENCLAVE_ROOT):
              "jquery.tablednd_0_5.js",
              "controls.js",
              "channels.js",
-             "fancyupload.js",
+             "chunkupload.js",
              "fileprogress.js",
              "filter.js",
+             "jobs.js",
              "playlist.js",
              "songlist.js",
-             "swfupload.js",
-             "swfupload.cookies.js",
-             "swfupload.queue.js",
              "tablesort.js",
              "upload.js",
          )},
@@ -2,6 +2,9 @@
 
 """Channel related views and functions."""
 
+import json
+
+from django.contrib.auth.decorators import user_passes_test
 from django.http import HttpResponseRedirect, Http404
 from django.core.urlresolvers import reverse
 from django.template import RequestContext
@@ -14,11 +17,12 @@ from menclave.aenclave.xml import (simple_xml_response, xml_error,
                                    render_xml_to_response)
 from menclave.aenclave.html import html_error
 from menclave.aenclave.json_response import (render_json_response, json_error,
-                                             json_channel_info)
+                                             json_success, json_channel_info)
 from menclave.aenclave.recommendations import good_recommendations
 from menclave.aenclave.html import render_html_template
 from menclave.aenclave.control import ControlError
-from menclave.aenclave.models import Channel, Song, PlayHistory
+from menclave.aenclave.models import Channel, PlaylistEntry, Song
+from menclave.aenclave import history
 
 import urlparse
 
@@ -85,6 +89,69 @@ def xml_update(request):
     else:
         return simple_xml_response('reload')  # old timestamp
 
+#------------------------------ Player Metrics -------------------------------#
+
+def _histogram_rows(histograms, prefix):
+    """Flatten the histograms whose names start with prefix into table rows."""
+    rows = []
+    for name in sorted(histograms):
+        if name.startswith(prefix):
+            row = dict(histograms[name])
+            row['name'] = name[len(prefix):]
+            rows.append(row)
+    return rows
+
+@user_passes_test(lambda u: u.is_staff)
+def player_metrics(request, channel_id=1):
+    try: channel = Channel.objects.get(pk=channel_id)
+    except Channel.DoesNotExist: raise Http404
+    try:
+        metrics = channel.controller().get_metrics()
+    except ControlError, e:
+        msg = "Error while connecting to player: %s" % e.message
+        return html_error(request, msg)
+    histograms = metrics['histograms']
+    counters = metrics['counters']
+    calls = _histogram_rows(histograms, 'latency.')
+    for row in calls:
+        row['errors'] = counters.get('errors.' + row['name'], 0)
+    other = [row for row in _histogram_rows(histograms, '')
+             if not row['name'].startswith('latency.')]
+    return render_html_template('aenclave/player_metrics.html', request,
+                                {'channel': channel,
+                                 'metrics': metrics,
+                                 'calls': calls,
+                                 'histograms': other,
+                                 'counters': sorted(counters.items()),
+                                 'gauges': sorted(metrics['gauges'].items())},
+                                context_instance=RequestContext(request))
+
+@user_passes_test(lambda u: u.is_staff)
+def json_player_metrics(request, channel_id=1):
+    """Serve the player metrics as JSON.
+
+    POST action=reset clears them, and POST trace_sample_rate=<float> changes
+    the fraction of player calls that get traced to the player log.
+    """
+    try: channel = Channel.objects.get(pk=channel_id)
+    except Channel.DoesNotExist: raise Http404
+    ctrl = channel.controller()
+    form = request.POST
+    try:
+        if form.get('action') == 'reset':
+            ctrl.reset_metrics()
+            return json_success('Metrics reset.')
+        if 'trace_sample_rate' in form:
+            try: rate = float(form['trace_sample_rate'])
+            except ValueError:
+                return json_error('invalid trace_sample_rate')
+            ctrl.set_trace_sample_rate(rate)
+            return json_success('Trace sample rate set to %r.' % rate)
+        metrics = ctrl.get_metrics()
+    except ControlError, err:
+        return json_error(str(err))
+    return render_json_response(json.dumps(metrics))
+
 #---------------------------------- Control ----------------------------------#
 
 # @permission_required_json('aenclave.can_control')
@@ -134,7 +201,10 @@ def queue_to_front(request):
     form = request.REQUEST
     songs = get_song_list(form)
     if len(songs) != 1:
-        raise json_error("Can only queue one song to front")
+        if 'getupdate' in form:
+            return json_error("Can only queue one song to front")
+        else:
+            return html_error(request, "Can only queue one song to front")
 
     song = songs[0]
     channel = Channel.default()
@@ -149,8 +219,7 @@ def queue_to_front(request):
         else:
             return html_error(request, str(err))
 
-    history_entry = PlayHistory(song=song)
-    history_entry.save()
+    history.record_queued([song], request.user, channel)
 
     if 'getupdate' in form:
         # Send back an updated playlist status.
@@ -163,8 +232,13 @@ def queue_to_front(request):
 # @permission_required('aenclave.can_queue', 'Queue Song')
 def queue_songs(request):
     form = request.REQUEST
-    # Get the selected songs.
-    songs = get_song_list(form)
+    # Get the selected songs, or a whole playlist's.
+    if 'playlist' in form:
+        entries = PlaylistEntry.objects.filter(
+                playlist=get_integer(form, 'playlist', 0)).select_related('song')
+        songs = [entry.song for entry in entries]
+    else:
+        songs = get_song_list(form)
     # Queue the songs.
     channel = Channel.default()
     ctrl = channel.controller()
@@ -179,9 +253,7 @@ def queue_songs(request):
             return json_error(str(err))
         else:
             return html_error(request, str(err))
-    for song in songs:
-        history_entry = PlayHistory(song=song)
-        history_entry.save()
+    history.record_queued(songs, request.user, channel)
     if 'getupdate' in form:
         # Send back an updated playlist status.
         return _json_control_update(request, channel)
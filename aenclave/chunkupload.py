@@ -0,0 +1,191 @@
+# menclave/aenclave/chunkupload.py
+
+"""Resumable uploads that are sent in chunks.
+
+A client starts an upload with the file's name and size, PUTs the chunks,
+possibly several at once and in any order, and then finishes the upload,
+which stages the song for ingestion.  If the connection drops, the client
+starts the upload again with the same key and only sends the chunks that the
+server doesn't have.  A client that retries the finish may race with itself,
+so finishing first claims the upload, and only the request that claimed it
+goes on.
+
+Each chunk is streamed straight from the request into its place in a staging
+file, and its md5 is computed on the way through.  The md5 of the whole file
+is computed by the ingest job, since the chunks can arrive in any order.
+"""
+
+import datetime
+import hashlib
+import os
+import uuid
+
+from django.conf import settings
+from django.db import IntegrityError
+
+from menclave.aenclave.models import Upload, UploadChunk
+from menclave.aenclave import processing
+
+# Read request bodies in pieces of this size.
+READ_SIZE = 64 * 1024
+
+class ChunkError(Exception):
+    pass
+
+def staging_dir():
+    return getattr(settings, 'AENCLAVE_UPLOAD_STAGING_DIR',
+                   os.path.join(settings.MEDIA_ROOT, 'aenclave/uploads'))
+
+def staging_path(upload):
+    return os.path.join(staging_dir(), upload.token + '.part')
+
+def chunk_size():
+    return getattr(settings, 'AENCLAVE_UPLOAD_CHUNK_SIZE', 4 * 1024 * 1024)
+
+def max_size():
+    return getattr(settings, 'AENCLAVE_UPLOAD_MAX_SIZE', 500 * 1024 * 1024)
+
+def expiry():
+    """How long an upload can sit idle before we throw it away."""
+    return datetime.timedelta(
+            0, getattr(settings, 'AENCLAVE_UPLOAD_EXPIRY', 24 * 60 * 60))
+
+#--------------------------------- Starting ---------------------------------#
+
+def start_upload(filename, size, client_key, owner=None):
+    """Start an upload, or find the unfinished one with the same key.
+
+    Returns the upload and a list of the chunk numbers already received.
+    """
+    if not processing.valid_song(filename):
+        raise processing.BadContent(filename)
+    if size <= 0 or size > max_size():
+        raise ChunkError('Files must be between 1 byte and %d MB.' %
+                         (max_size() // (1024 * 1024)))
+    if owner is not None and not owner.is_authenticated():
+        owner = None
+    expire_uploads()
+
+    if client_key:
+        existing = Upload.objects.filter(client_key=client_key, owner=owner,
+                                         filename=filename, size=size,
+                                         status='receiving')
+        for upload in existing[:1]:
+            if os.path.exists(staging_path(upload)):
+                touch(upload)
+                received = list(UploadChunk.objects.filter(upload=upload)
+                                .values_list('number', flat=True))
+                return (upload, received)
+            upload.delete()
+
+    upload = Upload(token=uuid.uuid4().hex, client_key=client_key[:255],
+                    owner=owner, filename=filename, size=size,
+                    chunk_size=chunk_size(),
+                    last_activity=datetime.datetime.now())
+    directory = staging_dir()
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    # Make a sparse file of the right size for the chunks to be written into.
+    f = open(staging_path(upload), 'wb')
+    try:
+        f.truncate(size)
+    finally:
+        f.close()
+    upload.save()
+    return (upload, [])
+
+def touch(upload):
+    Upload.objects.filter(pk=upload.pk).update(
+            last_activity=datetime.datetime.now())
+
+def expire_uploads():
+    """Throw away uploads that haven't been touched in a while."""
+    cutoff = datetime.datetime.now() - expiry()
+    for upload in Upload.objects.filter(last_activity__lt=cutoff):
+        discard_upload(upload)
+
+def discard_upload(upload):
+    path = staging_path(upload)
+    if os.path.exists(path):
+        os.remove(path)
+    upload.delete()
+
+#--------------------------------- Chunks -----------------------------------#
+
+def write_chunk(upload, number, stream, length, checksum=None):
+    """Copy a chunk from stream into the staging file.
+
+    length is the number of bytes to read from the stream, which must be
+    the whole chunk.  If checksum is given, it must match the md5 of the
+    chunk.  Sending the same chunk twice is harmless.
+    """
+    if not 0 <= number < upload.chunk_count():
+        raise ChunkError('There is no chunk %d.' % number)
+    if length != upload.chunk_length(number):
+        raise ChunkError('Chunk %d must be %d bytes.' %
+                         (number, upload.chunk_length(number)))
+    path = staging_path(upload)
+    if not os.path.exists(path):
+        raise ChunkError('This upload has expired.')
+
+    m = hashlib.md5()
+    f = open(path, 'r+b')
+    try:
+        f.seek(number * upload.chunk_size)
+        remaining = length
+        while remaining > 0:
+            data = stream.read(min(READ_SIZE, remaining))
+            if not data:
+                raise ChunkError('Chunk %d was cut short.' % number)
+            m.update(data)
+            f.write(data)
+            remaining -= len(data)
+    finally:
+        f.close()
+
+    digest = m.hexdigest()
+    if checksum and checksum.lower() != digest:
+        raise ChunkError('Chunk %d was corrupted.' % number)
+    UploadChunk.objects.filter(upload=upload, number=number).delete()
+    try:
+        UploadChunk(upload=upload, number=number, checksum=digest).save()
+    except IntegrityError:
+        # A retry of this chunk raced with the original, which got there
+        # first with the same bytes.
+        pass
+    touch(upload)
+    return digest
+
+#-------------------------------- Finishing ---------------------------------#
+
+def missing_chunks(upload):
+    received = set(UploadChunk.objects.filter(upload=upload)
+                   .values_list('number', flat=True))
+    return [n for n in xrange(upload.chunk_count()) if n not in received]
+
+def claim(upload):
+    """Atomically mark an upload as finishing.  Returns False if we lost."""
+    count = Upload.objects.filter(pk=upload.pk, status='receiving').update(
+            status='finishing')
+    return count == 1
+
+def finish_upload(upload):
+    """Move a complete upload into the library and queue its ingest job.
+
+    Returns the song and its ingest job, like processing.stage_song.
+    """
+    missing = missing_chunks(upload)
+    if missing:
+        raise ChunkError('Missing %d chunks.' % len(missing))
+    if not claim(upload):
+        raise ChunkError('This upload is already finished.')
+    try:
+        (song, job) = processing.stage_song_file(upload.filename,
+                                                 staging_path(upload),
+                                                 upload.owner)
+    except:
+        # Let the client try again.
+        Upload.objects.filter(pk=upload.pk).update(status='receiving')
+        raise
+    upload.delete()
+    return (song, job)
@@ -115,6 +115,21 @@ class Controller(object):
         """Return a snapshot of the current channel state."""
         return WrappedSnapshot(rpc_retval)
 
+    @delegate_rpc
+    def get_metrics(self, rpc_retval=None):
+        """Return the player's metrics snapshot dict."""
+        return rpc_retval
+
+    @delegate_rpc
+    def reset_metrics(self, rpc_retval=None):
+        """Clear the player's counters and histograms."""
+        pass
+
+    @delegate_rpc
+    def set_trace_sample_rate(self, sample_rate, rpc_retval=None):
+        """Set the fraction of player calls that are traced to the log."""
+        pass
+
     #--------------------------- PLAYBACK CONTROL ----------------------------#
 
     @delegate_rpc
@@ -0,0 +1,391 @@
+# menclave/aenclave/cooccurrence.py
+
+"""An incremental model of which songs go together.
+
+Songs that were queued in the same listening session, or that sit in the
+same playlist, are related.  Every such pair of songs has a weight in the
+CoOccurrence table, with the lower song id first, so the table is a sparse
+song by song matrix.  Like the old clusters, a session or playlist of n songs
+adds 100/n to the weight of each of its pairs.
+
+update() only looks at what's new: the play history after a watermark, and
+the playlists modified since their last snapshot.  A changed playlist has
+its old snapshot's weights subtracted and its new songs' weights added, so
+most of its pairs cancel out.  Sessions and playlists bigger than
+MAX_GROUP_SIZE are skipped; queuing a whole library says little about which
+songs go together, and would add a quadratic number of pairs.
+
+Reading every pair of a handful of songs is still too slow for a page load,
+so each song also keeps its top NEIGHBORS partners and their weights in
+SongNeighbors, refreshed whenever its pairs change.  recommend() merges those
+short lists in memory.
+
+Recommendation feedback scales a pair's feedback multiplier rather than its
+weight, which must stay a sum of what was added for the subtractions to
+cancel out.  Neighbors are ranked by weight times feedback.
+
+recommendations.make_clusters still rebuilds the old Cluster table from
+scratch, for comparison offline.
+"""
+
+import datetime
+import heapq
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+
+from menclave.aenclave.models import (CoOccurrence, PlayHistory, Playlist,
+                                      PlaylistEntry, PlaylistSnapshot, Song,
+                                      SongNeighbors, Watermark)
+from menclave.aenclave import bulk
+from menclave.aenclave import history
+from menclave.aenclave import jobs
+
+# Sessions and playlists with more songs than this are ignored.
+MAX_GROUP_SIZE = 250
+
+# The watermark name for the last PlayHistory id counted.
+HISTORY_WATERMARK = 'cooccurrence-history'
+
+# Apply the pending weight changes after this many pairs, to bound memory.
+FLUSH_PAIRS = 50000
+
+# Query this many songs' pairs at once.
+QUERY_CHUNK = 500
+
+# Weights this close to zero are left over from subtracting playlists.
+EPSILON = 1e-6
+
+def neighbor_count():
+    """How many of each song's neighbors to keep for recommendations."""
+    return getattr(settings, 'AENCLAVE_NEIGHBORS', 50)
+
+def _chunks(items, size):
+    items = list(items)
+    for i in xrange(0, len(items), size):
+        yield items[i:i+size]
+
+#--------------------------------- Weights ----------------------------------#
+
+def add_group(deltas, song_ids, sign=1):
+    """Add (or with sign=-1, subtract) a group's pair weights to deltas."""
+    song_ids = sorted(set(song_ids))
+    n = len(song_ids)
+    if n < 2 or n > MAX_GROUP_SIZE:
+        return
+    weight = sign * 100.0 / n
+    for i in xrange(n):
+        a = song_ids[i]
+        for b in song_ids[i+1:]:
+            deltas[(a, b)] = deltas.get((a, b), 0.0) + weight
+
+def apply_deltas(deltas):
+    """Add weight changes to the CoOccurrence table, keyed by (a, b) pairs.
+
+    Existing pairs are updated in place and new ones inserted.  Negative
+    changes to pairs that don't exist are dropped, since they were either
+    never counted or belonged to a deleted song, and pairs that fall to zero
+    are deleted.  Then the neighbors of every song involved are refreshed.
+    """
+    deltas = dict((pair, delta) for (pair, delta) in deltas.iteritems()
+                  if abs(delta) > EPSILON)
+    if not deltas:
+        return
+    existing = {}
+    for chunk in _chunks(set(a for (a, b) in deltas), QUERY_CHUNK):
+        rows = (CoOccurrence.objects.filter(song_a__in=chunk)
+                .values_list('id', 'song_a', 'song_b'))
+        for (pk, a, b) in rows.iterator():
+            if (a, b) in deltas:
+                existing[(a, b)] = pk
+
+    increments = []
+    new_pairs = []
+    for (pair, delta) in deltas.iteritems():
+        if pair in existing:
+            increments.append((delta, existing[pair]))
+        elif delta > 0:
+            new_pairs.append(pair)
+    bulk.increment_rows(CoOccurrence, 'weight', increments)
+
+    # Don't insert pairs with songs that have been deleted.
+    song_ids = set()
+    for (a, b) in new_pairs:
+        song_ids.add(a)
+        song_ids.add(b)
+    live = set()
+    for chunk in _chunks(song_ids, QUERY_CHUNK):
+        live.update(Song.objects.filter(pk__in=chunk)
+                    .values_list('id', flat=True))
+    bulk.insert_rows(CoOccurrence,
+                     ('song_a', 'song_b', 'weight', 'feedback'),
+                     [(a, b, deltas[(a, b)], 1.0) for (a, b) in new_pairs
+                      if a in live and b in live])
+
+    for chunk in _chunks([pk for (delta, pk) in increments if delta < 0],
+                         QUERY_CHUNK):
+        CoOccurrence.objects.filter(pk__in=chunk,
+                                    weight__lte=EPSILON).delete()
+
+    touched = set()
+    for (a, b) in deltas:
+        touched.add(a)
+        touched.add(b)
+    refresh_neighbors(touched)
+
+#--------------------------------- History ----------------------------------#
+
+def history_sessions(after_id, cutoff):
+    """Yield (last PlayHistory id, song ids) for each session after after_id.
+
+    Sessions that may still be going, because their last song was queued
+    after cutoff, aren't yielded.
+    """
+    gap = history.session_gap()
+    rows = (PlayHistory.objects.filter(pk__gt=after_id).order_by('id')
+            .values_list('id', 'song', 'queued_time'))
+    session = []
+    last_id = last_time = None
+    for (pk, song_id, queued_time) in rows.iterator():
+        if session and queued_time - last_time > gap:
+            yield (last_id, session)
+            session = []
+        session.append(song_id)
+        last_id = pk
+        last_time = queued_time
+    if session and last_time <= cutoff:
+        yield (last_id, session)
+
+@transaction.commit_on_success
+def _flush_history(deltas, watermark):
+    apply_deltas(deltas)
+    Watermark.set(HISTORY_WATERMARK, watermark)
+
+def update_history():
+    """Count the finished sessions since the watermark.  Returns how many."""
+    watermark = Watermark.get(HISTORY_WATERMARK)
+    cutoff = datetime.datetime.now() - history.session_gap()
+    deltas = {}
+    sessions = 0
+    for (last_id, song_ids) in history_sessions(watermark, cutoff):
+        add_group(deltas, song_ids)
+        watermark = last_id
+        sessions += 1
+        if len(deltas) >= FLUSH_PAIRS:
+            _flush_history(deltas, watermark)
+            deltas = {}
+    _flush_history(deltas, watermark)
+    return sessions
+
+#-------------------------------- Playlists ---------------------------------#
+
+def _parse_ids(text):
+    return [int(song_id) for song_id in text.split()]
+
+@transaction.commit_on_success
+def update_playlists():
+    """Count the playlists changed since their snapshots.  Returns how many."""
+    snapshots = dict((snapshot.playlist_id, snapshot) for snapshot
+                     in PlaylistSnapshot.objects.all().iterator())
+    modified = dict(Playlist.objects.values_list('id', 'last_modified'))
+    changed = [pk for (pk, last_modified) in modified.iteritems()
+               if pk not in snapshots or
+               last_modified > snapshots[pk].date_taken]
+    deleted = [pk for pk in snapshots if pk not in modified]
+
+    deltas = {}
+    for pk in deleted:
+        add_group(deltas, _parse_ids(snapshots[pk].song_ids), -1)
+    for chunk in _chunks(deleted, QUERY_CHUNK):
+        PlaylistSnapshot.objects.filter(playlist_id__in=chunk).delete()
+
+    for chunk in _chunks(changed, QUERY_CHUNK):
+        # Take the time before reading the songs, so that an edit made while
+        # we read them is picked up next time.
+        now = datetime.datetime.now()
+        songs = {}
+        entries = (PlaylistEntry.objects.filter(playlist__in=chunk)
+                   .order_by().values_list('playlist', 'song'))
+        for (playlist_id, song_id) in entries.iterator():
+            songs.setdefault(playlist_id, []).append(song_id)
+        for pk in chunk:
+            new_ids = sorted(set(songs.get(pk, [])))
+            snapshot = snapshots.get(pk)
+            if snapshot is not None:
+                old_ids = _parse_ids(snapshot.song_ids)
+            else:
+                snapshot = PlaylistSnapshot(playlist_id=pk)
+                old_ids = []
+            if old_ids != new_ids:
+                add_group(deltas, old_ids, -1)
+                add_group(deltas, new_ids)
+            snapshot.song_ids = ' '.join(str(song_id) for song_id in new_ids)
+            snapshot.date_taken = now
+            snapshot.save()
+        if len(deltas) >= FLUSH_PAIRS:
+            apply_deltas(deltas)
+            deltas = {}
+    apply_deltas(deltas)
+    return len(changed) + len(deleted)
+
+#--------------------------------- Updating ---------------------------------#
+
+def update():
+    """Bring the co-occurrence weights up to date.  Returns a summary dict."""
+    start = time.time()
+    sessions = update_history()
+    playlists = update_playlists()
+    return {'sessions': sessions, 'playlists': playlists,
+            'seconds': time.time() - start}
+
+@transaction.commit_on_success
+def reset():
+    """Forget every co-occurrence, so the next update starts from scratch."""
+    CoOccurrence.objects.all().delete()
+    SongNeighbors.objects.all().delete()
+    PlaylistSnapshot.objects.all().delete()
+    Watermark.set(HISTORY_WATERMARK, 0)
+
+def queue_update():
+    """Queue a background update, unless one is already waiting."""
+    jobs.enqueue('update_cooccurrences', key='all', coalesce=True,
+                 coalesce_running=False)
+
+@jobs.handler('update_cooccurrences')
+def update_job(job):
+    """The job handler that runs update()."""
+    return update()
+
+def merge_songs(original_id, duplicate_ids):
+    """Fold the pairs of duplicate songs into the original's.
+
+    Called by processing.merge_duplicates before the duplicates are deleted,
+    after their playlist entries have been moved to the original.
+    """
+    duplicate_ids = set(duplicate_ids)
+    deltas = {}
+    rows = (CoOccurrence.objects.filter(song_a__in=duplicate_ids) |
+            CoOccurrence.objects.filter(song_b__in=duplicate_ids))
+    for (a, b, weight) in rows.values_list('song_a', 'song_b', 'weight'):
+        a = original_id if a in duplicate_ids else a
+        b = original_id if b in duplicate_ids else b
+        if a != b:
+            pair = (min(a, b), max(a, b))
+            deltas[pair] = deltas.get(pair, 0.0) + weight
+    rows.delete()
+    SongNeighbors.objects.filter(song__in=duplicate_ids).delete()
+    apply_deltas(deltas)
+
+    # The snapshots must agree with the playlists, or the next update would
+    # count the moved entries again.
+    playlist_ids = (PlaylistEntry.objects.filter(song=original_id)
+                    .values_list('playlist', flat=True))
+    for snapshot in PlaylistSnapshot.objects.filter(
+            playlist_id__in=list(playlist_ids)):
+        song_ids = set(original_id if song_id in duplicate_ids else song_id
+                       for song_id in _parse_ids(snapshot.song_ids))
+        snapshot.song_ids = ' '.join(str(song_id)
+                                     for song_id in sorted(song_ids))
+        snapshot.save()
+
+def scale_pairs(song_ids, other_ids, factor):
+    """Multiply the feedback of the pairs between two sets of songs.
+
+    This is one UPDATE, and then the neighbors of the songs are refreshed.
+    Returns the number of pairs changed.
+    """
+    song_ids = list(song_ids)
+    other_ids = list(other_ids)
+    if not song_ids or not other_ids:
+        return 0
+    pairs = CoOccurrence.objects.filter(
+            Q(song_a__in=song_ids, song_b__in=other_ids) |
+            Q(song_a__in=other_ids, song_b__in=song_ids))
+    count = pairs.update(feedback=F('feedback') * factor)
+    if count:
+        refresh_neighbors(set(song_ids) | set(other_ids))
+    return count
+
+#-------------------------------- Neighbors ---------------------------------#
+
+def _format_neighbors(neighbors):
+    return ' '.join('%d:%.6g' % (song_id, weight)
+                    for (weight, song_id) in neighbors)
+
+def _parse_neighbors(text):
+    for item in text.split():
+        (song_id, weight) = item.split(':')
+        yield (int(song_id), float(weight))
+
+def refresh_neighbors(song_ids):
+    """Recompute the top neighbors of the given songs."""
+    k = neighbor_count()
+    for chunk in _chunks(song_ids, QUERY_CHUNK):
+        pairs = {}
+        rows = (CoOccurrence.objects.filter(song_a__in=chunk)
+                .values_list('song_a', 'song_b', 'weight', 'feedback'))
+        for (a, b, weight, feedback) in rows:
+            pairs.setdefault(a, []).append((weight * feedback, b))
+        rows = (CoOccurrence.objects.filter(song_b__in=chunk)
+                .values_list('song_a', 'song_b', 'weight', 'feedback'))
+        for (a, b, weight, feedback) in rows:
+            pairs.setdefault(b, []).append((weight * feedback, a))
+        SongNeighbors.objects.filter(song__in=chunk).delete()
+        bulk.insert_rows(SongNeighbors, ('song', 'neighbors'),
+                         [(song_id, _format_neighbors(heapq.nlargest(k, pair)))
+                          for (song_id, pair) in pairs.iteritems()])
+
+@transaction.commit_on_success
+def refresh_all_neighbors():
+    """Recompute every song's neighbors, say after AENCLAVE_NEIGHBORS changes.
+
+    Returns the number of songs.
+    """
+    song_ids = set(CoOccurrence.objects.values_list('song_a', flat=True)
+                   .distinct())
+    song_ids.update(CoOccurrence.objects.values_list('song_b', flat=True)
+                    .distinct())
+    SongNeighbors.objects.all().delete()
+    refresh_neighbors(sorted(song_ids))
+    return len(song_ids)
+
+def recommend_ids(song_ids, n):
+    """Return the ids of the n songs that go best with song_ids, best first.
+
+    This merges the songs' neighbor lists, so it takes one small query.
+    """
+    song_ids = set(song_ids)
+    scores = {}
+    rows = (SongNeighbors.objects.filter(song__in=list(song_ids))
+            .values_list('neighbors', flat=True))
+    for text in rows:
+        for (song_id, weight) in _parse_neighbors(text):
+            if song_id not in song_ids:
+                scores[song_id] = scores.get(song_id, 0.0) + weight
+    best = heapq.nlargest(n, scores.iteritems(), key=lambda item: item[1])
+    return [song_id for (song_id, score) in best]
+
+#--------------------------------- Reading ----------------------------------#
+
+def related_scores(song_ids):
+    """Sum the scores of every song paired with any of song_ids.
+
+    Returns a dict from song id to score, which doesn't include song_ids.
+    This reads every pair, so use recommend_ids for anything interactive.
+    """
+    song_ids = list(song_ids)
+    scores = {}
+    for chunk in _chunks(song_ids, QUERY_CHUNK):
+        pairs = CoOccurrence.objects.filter(song_a__in=chunk)
+        for (song_id, weight, feedback) in pairs.values_list(
+                'song_b', 'weight', 'feedback'):
+            scores[song_id] = scores.get(song_id, 0.0) + weight * feedback
+        pairs = CoOccurrence.objects.filter(song_b__in=chunk)
+        for (song_id, weight, feedback) in pairs.values_list(
+                'song_a', 'weight', 'feedback'):
+            scores[song_id] = scores.get(song_id, 0.0) + weight * feedback
+    for song_id in song_ids:
+        scores.pop(song_id, None)
+    return scores
@@ -1,13 +1,17 @@
 
-import zipfile
-import tempfile
 import datetime
+import mimetypes
 import os
+import random
 
-from django.core.servers.basehttp import FileWrapper
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date
+from django.views.static import was_modified_since
 
+from menclave.aenclave import archive_cache
 from menclave.aenclave.utils import get_song_list
+from menclave.aenclave.zipstream import ZipStream
 
 #-------------------------------- DL Requests --------------------------------#
 
@@ -19,9 +23,9 @@ def dl(request):
         # TODO(rnk): Better error handling.
         raise Exception("No ids were provided to dl.")
     elif len(songs) == 1:
-        return send_song(songs[0])
+        return send_song(request, songs[0])
     else:
-        return send_songs(songs)
+        return send_songs(request, songs)
 
 class StreamingHttpResponse(HttpResponse):
 
@@ -30,7 +34,7 @@ class StreamingHttpResponse(HttpResponse):
     See Django bug #6027: http://code.djangoproject.com/ticket/6027
 
     We override content to be a no-op, so that GzipMiddleware doesn't exhaust
-    the FileWrapper generator, which reads the file incrementally.
+    the generator, which reads the file incrementally.
     """
 
     def _get_content(self):
@@ -41,63 +45,249 @@ class StreamingHttpResponse(HttpResponse):
 
     content = property(_get_content, _set_content)
 
-def send_song(song):
-    """Return an HttpResponse that will serve an MP3 from disk.
+#----------------------------- Ranges and Sendfile ----------------------------#
 
-    This happens without reading the whole MP3 in as a string.
+# Read files in large chunks; small reads are slow on network storage.
+CHUNK_SIZE = 1024 * 1024
+
+# Requests with more ranges than this get the whole file instead.  Lots of
+# tiny overlapping ranges are a cheap way to make us do a lot of work.
+MAX_RANGES = 32
+
+def file_etag(path, checksum=None, stat=None):
+    """Return a strong ETag for a file on disk.
+
+    We prefer the stored checksum, but tag edits rewrite files without
+    updating it, so the mtime is mixed in as well.
+    """
+    if stat is None:
+        stat = os.stat(path)
+    if checksum:
+        return '"%s-%x"' % (checksum, int(stat.st_mtime))
+    return '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return etag in [tag.strip() for tag in header.split(',')]
+
+def parse_range_header(header, size):
+    """Parse an HTTP Range header into a list of (start, stop) byte offsets.
+
+    stop is exclusive.  Returns None if the header is missing, malformed, or
+    asks for too many ranges, in which case the whole file should be sent.
+    Returns an empty list if no range is satisfiable.
     """
-    fd = file(song.audio.path)
-    wrapper = FileWrapper(fd)
-    response = StreamingHttpResponse(wrapper, content_type='audio/mpeg')
+    if not header or not header.startswith('bytes='):
+        return None
+    specs = header[len('bytes='):].split(',')
+    if len(specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for spec in specs:
+        spec = spec.strip()
+        if '-' not in spec:
+            return None
+        first, last = spec.split('-', 1)
+        try:
+            if not first:
+                # A suffix range: the last N bytes.
+                length = int(last)
+                if length <= 0:
+                    continue
+                start, stop = max(0, size - length), size
+            else:
+                start = int(first)
+                if last:
+                    stop = int(last) + 1
+                    if stop <= start:
+                        return None
+                else:
+                    stop = size
+        except ValueError:
+            return None
+        if start >= size:
+            continue  # Unsatisfiable, but others might not be.
+        ranges.append((start, min(stop, size)))
+    return ranges
+
+def _read_range(path, start, stop, chunk_size=CHUNK_SIZE):
+    """Yield the bytes of the file between start and stop."""
+    f = open(path, 'rb')
+    try:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+def _multipart_ranges(path, ranges, size, content_type, boundary):
+    """Return (iterator, length) for a multipart/byteranges body."""
+    parts = []
+    length = 0
+    for (start, stop) in ranges:
+        head = ('\r\n--%s\r\nContent-Type: %s\r\n'
+                'Content-Range: bytes %d-%d/%d\r\n\r\n' %
+                (boundary, content_type, start, stop - 1, size))
+        parts.append((head, start, stop))
+        length += len(head) + stop - start
+    tail = '\r\n--%s--\r\n' % boundary
+    length += len(tail)
+    def body():
+        for (head, start, stop) in parts:
+            yield head
+            for chunk in _read_range(path, start, stop):
+                yield chunk
+        yield tail
+    return body(), length
+
+def _sendfile_response(path, content_type):
+    """Hand the file off to the front-end web server, if configured to.
+
+    AENCLAVE_SENDFILE may be 'x-sendfile' (Apache mod_xsendfile, lighttpd) or
+    'x-accel-redirect' (nginx).  Either way the web server handles ranges and
+    streaming, and Django only does the authorization check.
+    """
+    mode = getattr(settings, 'AENCLAVE_SENDFILE', None)
+    if not mode:
+        return None
+    response = HttpResponse('', content_type=content_type)
+    if mode == 'x-sendfile':
+        response['X-Sendfile'] = path
+    elif mode == 'x-accel-redirect':
+        relpath = os.path.relpath(path, settings.MEDIA_ROOT)
+        response['X-Accel-Redirect'] = (settings.AENCLAVE_ACCEL_REDIRECT_PREFIX
+                                        + relpath)
+    else:
+        raise ValueError('Unknown AENCLAVE_SENDFILE mode: %r' % mode)
+    return response
+
+def send_file(request, path, content_type, filename, checksum=None):
+    """Serve a file from disk with conditional GET and Range support.
+
+    filename -- The name to suggest to the browser.  It must not contain
+                backslashes or quotes.
+    checksum -- A checksum of the file, used for the ETag if available.
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = file_etag(path, checksum, stat)
+    last_modified = http_date(stat.st_mtime)
+    meta = request.META
+
+    # Conditional GET.  If-None-Match takes precedence over If-Modified-Since.
+    if 'HTTP_IF_NONE_MATCH' in meta:
+        not_modified = _etag_matches(meta['HTTP_IF_NONE_MATCH'], etag)
+    else:
+        not_modified = not was_modified_since(
+            meta.get('HTTP_IF_MODIFIED_SINCE'), int(stat.st_mtime), size)
+    if not_modified:
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+        return response
+
+    response = _sendfile_response(path, content_type)
+    if response is None:
+        ranges = parse_range_header(meta.get('HTTP_RANGE'), size)
+        # If-Range means "only send me a range if it hasn't changed".
+        if_range = meta.get('HTTP_IF_RANGE')
+        if ranges is not None and if_range and if_range not in (etag,
+                                                                last_modified):
+            ranges = None
+        if ranges is None:
+            response = StreamingHttpResponse(_read_range(path, 0, size),
+                                             content_type=content_type)
+            response['Content-Length'] = size
+        elif not ranges:
+            response = HttpResponse('', content_type=content_type, status=416)
+            response['Content-Range'] = 'bytes */%d' % size
+        elif len(ranges) == 1:
+            ((start, stop),) = ranges
+            response = StreamingHttpResponse(_read_range(path, start, stop),
+                                             content_type=content_type)
+            response.status_code = 206
+            response['Content-Range'] = 'bytes %d-%d/%d' % (start, stop - 1,
+                                                            size)
+            response['Content-Length'] = stop - start
+        else:
+            boundary = '%032x' % random.getrandbits(128)
+            body, length = _multipart_ranges(path, ranges, size, content_type,
+                                             boundary)
+            response = StreamingHttpResponse(
+                    body, content_type='multipart/byteranges; boundary=' +
+                    boundary)
+            response.status_code = 206
+            response['Content-Length'] = length
+        response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    return response
+
+#------------------------------- Song Downloads -------------------------------#
+
+def send_song(request, song):
+    """Return an HttpResponse that will serve a song from disk.
+
+    This happens without reading the whole file in as a string, and supports
+    Range requests so browser players can seek and downloads can resume.
+    """
+    path = song.audio.path
+    content_type = mimetypes.guess_type(path)[0] or 'audio/mpeg'
     # BTW nice_filename is guaranteed not to have any backslashes or quotes in
     #     it, so we don't need to escape anything.
-    response['Content-Disposition'] = ('attachment; filename="%s"' %
-                                       song.nice_filename())
-    response['Content-Length'] = os.path.getsize(song.audio.path)
-    return response
+    return send_file(request, path, content_type, song.nice_filename(),
+                     song.filechecksum)
 
-def send_songs(songs):
-    """Serve a zip archive of the chosen songs."""
+def send_songs(request, songs):
+    """Serve a zip archive of the chosen songs.
+
+    Archives come from the archive cache when possible.  Otherwise they are
+    streamed, and also written into the cache if they are small enough.
+    """
     # Make an archive name with a timestamp of the form YYYY-MM-DD_HH-MM-SS.
     timestamp = '%i-%i-%i_%i-%i-%i' % datetime.datetime.today().timetuple()[:6]
     archive_name = 'nr_dl_%s.zip' % timestamp
-    filenames = []
-    for song in songs:
-        # WTF Use str() here because the filename apparently *cannot* be a
-        #     unicode string, or zipfile flips out.
-        filenames.append((song.audio.path, str(song.nice_filename())))
-    return render_zip(archive_name, filenames)
+    # WTF Use str() here because the filename apparently *cannot* be a
+    #     unicode string, or zipfile flips out.
+    members = [(song, str(song.nice_filename())) for song in songs]
+    key = archive_cache.archive_key(members)
+    cached_path = archive_cache.lookup(key)
+    if cached_path is not None:
+        return send_file(request, cached_path, 'application/zip',
+                         archive_name, key)
+    filenames = [(song.audio.path, arcname) for (song, arcname) in members]
+    archive = ZipStream(filenames)
+    stream = iter(archive)
+    if archive_cache.is_cacheable(archive.size):
+        stream = archive_cache.tee(stream, key, songs)
+    return render_zip(archive_name, archive, stream)
 
-def render_zip(archive_name, filenames):
-    """Serve a zip archive containing all of the named files.
+def render_zip(archive_name, archive, stream=None):
+    """Serve a zip archive.
 
     archive_name -- The name to give the zip archive when it is served.
-    filenames -- A list of tuples of the form (path, newname).
-
-    This creates a temporary zip archive on disk which is cleaned up after its
-    references are garbage collected.
+    archive -- The ZipStream to serve.
+    stream -- An iterator over the archive's bytes, if not the archive itself.
 
-    TODO(rnk): What would be really hot (lapnap does this) would be to find a
-               way to write the zip archive to the HTTP stream instead of a
-               temp file.  This would prevent us from having a usable download
-               progress bar, but the download would start right away.
+    The archive is written straight to the HTTP stream as it is read from
+    disk, so the download starts right away and nothing is buffered in a temp
+    file.  We don't compress, so the exact size is known up front and the
+    client still gets a usable progress bar.
     """
-    # Make a temporary zip archive.
-    tmp_file = tempfile.TemporaryFile(mode='w+b')
-    # Use ZIP_STORED to disable compression because mp3s are already well
-    # compressed.
-    archive = zipfile.ZipFile(tmp_file, 'w', zipfile.ZIP_STORED)
-    # Write songs to zip archive.
-    for (path, newname) in filenames:
-        archive.write(path, newname)
-    archive.close()
-    filesize = tmp_file.tell()
-    # Serve zip archive.
-    wrapper = FileWrapper(tmp_file)
+    if stream is None:
+        stream = archive
     # Using StreamingHttpResponse tries to avoid gzip middleware from fucking
     # everything up.
-    response = StreamingHttpResponse(wrapper, content_type='application/zip')
+    response = StreamingHttpResponse(stream, content_type='application/zip')
     response['Content-Disposition'] = 'attachment; filename=%s' % archive_name
-    response['Content-Length'] = filesize
-    tmp_file.seek(0)
+    response['Content-Length'] = archive.size
     return response
@@ -1,4 +1,3 @@
-
 # Workaround for different versions of mutagen.
 try:
     from mutagen.mp3 import EasyMP3
@@ -7,47 +6,139 @@ except ImportError:
     from mutagen.easyid3 import EasyID3
     def EasyMP3(*args, **kwargs):
         return MP3(*args, ID3=EasyID3, **kwargs)
+from mutagen.mp4 import MP4
+
+import json
+import os
+import shutil
+
+from django.db import transaction
 
 from menclave.login import permission_required_xml, permission_required_json
 from menclave.aenclave.xml import xml_error, render_xml_to_response
-from menclave.aenclave.json_response import json_error, render_json_template
-from menclave.aenclave.utils import get_unicode, get_integer
-from menclave.aenclave.models import Song
+from menclave.aenclave.json_response import (json_error, render_json_response,
+                                             render_json_template)
+from menclave.aenclave.utils import get_unicode, get_integer, get_int_list
+from menclave.aenclave.models import GRAMMAR_FIELDS, Song
+from menclave.aenclave import archive_cache
+from menclave.aenclave import jobs
+from menclave.aenclave import processing
+from menclave.aenclave import smartplaylist
+from menclave.aenclave import wami_grammar
 
-@permission_required_xml('aenclave.change_song')
-def xml_edit(request):
-    if not request.user.is_authenticated():
-        return xml_error('user not logged in')
-    form = request.POST
-    try: song = Song.objects.get(pk=int(form.get('id','')))
-    except (ValueError, TypeError, Song.DoesNotExist), err:
-        return xml_error(str(err))
-    audio = EasyMP3(song.audio.path)
+#------------------------------- Form Parsing --------------------------------#
+
+def get_changes(form):
+    """Return a dict of the Song fields that an edit form changes."""
+    changes = {}
     # Update title.
     title = get_unicode(form, 'title')
     if title:  # Disallow empty titles.
-        song.title = title
-        audio['title'] = title
+        changes['title'] = title
     # Update album.
     album = get_unicode(form, 'album')
     if album is not None:
-        song.album = album
-        audio['album'] = album
+        changes['album'] = album
     # Update artist.
     artist = get_unicode(form, 'artist')
     if artist is not None:
-        song.artist = artist
-        audio['artist'] = artist
+        changes['artist'] = artist
     # Update track number.
-    if form.get('track', None) == '': song.track = 0
+    if form.get('track', None) == '':
+        changes['track'] = 0
     else:
         track = get_integer(form, 'track')
         if track is not None and 0 <= track < 999:
-            song.track = track
-            audio['tracknumber'] = unicode(track)
-    # Save and report success.
-    song.save()
+            changes['track'] = track
+    return changes
+
+#------------------------------- Tag Writing ---------------------------------#
+
+def queue_tag_writes(song_ids):
+    """Queue jobs to write the songs' tags back to their files.
+
+    The job reads the song when it runs, so several edits to a song before
+    its job starts are coalesced into one write.
+    """
+    for song_id in song_ids:
+        jobs.enqueue('write_tags', {'song_id': song_id}, key=str(song_id),
+                     coalesce=True, coalesce_running=False)
+
+def _unshare_file(song):
+    """Give a song its own copy of its file, if another song uses it too.
+
+    Otherwise writing this song's tags would change the other song's audio.
+    Doesn't save the song.
+    """
+    name = song.audio.name
+    if not Song.objects.filter(audio=name).exclude(pk=song.pk).count():
+        return
+    storage = song.audio.storage
+    (root, ext) = os.path.splitext(name)
+    new_name = storage.get_available_name('%s-%d%s' % (root, song.pk, ext))
+    shutil.copyfile(storage.path(name), storage.path(new_name))
+    song.audio.name = new_name
+
+@jobs.handler('write_tags')
+def write_tags(job, song_id):
+    """The job handler that copies a song's fields into its file's tags."""
+    try:
+        song = Song.objects.get(pk=song_id)
+    except Song.DoesNotExist:
+        # It was deleted after it was edited.
+        return {'song_id': song_id}
+    _unshare_file(song)
+    path = song.audio.path
+    if path.lower().endswith('.m4a'):
+        audio = MP4(path.encode('latin1'))
+        audio['\xa9nam'] = song.title
+        audio['\xa9alb'] = song.album
+        audio['\xa9ART'] = song.artist
+        if song.track:
+            audio['trkn'] = [(song.track, 0)]
+    else:
+        audio = EasyMP3(path.encode('latin1'))
+        audio['title'] = song.title
+        audio['album'] = song.album
+        audio['artist'] = song.artist
+        if song.track:
+            audio['tracknumber'] = unicode(song.track)
     audio.save()
+
+    # The file has changed, so checksum it again.  It stays where it is,
+    # since the player may have it queued and downloads may be reading it;
+    # its name is the checksum it was uploaded with.  Only update these
+    # columns so that we don't clobber another edit made since we read the
+    # song.
+    old_checksum = song.filechecksum
+    processing.annotate_checksum(song)
+    Song.objects.filter(pk=song.pk).update(
+            audio=song.audio.name, filechecksum=song.filechecksum,
+            file_size=song.file_size, file_mtime=song.file_mtime,
+            tags_size=song.file_size, tags_mtime=song.file_mtime)
+    return {'song_id': song_id, 'old_checksum': old_checksum,
+            'checksum': song.filechecksum}
+
+#---------------------------------- Views ------------------------------------#
+
+def _edit_song(song, form):
+    changes = get_changes(form)
+    for (field, value) in changes.items():
+        setattr(song, field, value)
+    song.save()
+    archive_cache.invalidate_songs([song.pk])
+    queue_tag_writes([song.pk])
+
+@permission_required_xml('aenclave.change_song')
+def xml_edit(request):
+    if not request.user.is_authenticated():
+        return xml_error('user not logged in')
+    form = request.POST
+    try: song = Song.objects.get(pk=int(form.get('id','')))
+    except (ValueError, TypeError, Song.DoesNotExist), err:
+        return xml_error(str(err))
+    # Save and report success.  The tags get written in the background.
+    _edit_song(song, form)
     return render_xml_to_response('done_editing.xml', {'song':song})
 
 @permission_required_json('aenclave.change_song')
@@ -59,31 +150,35 @@ def json_edit(request):
     try: song = Song.objects.get(pk=int(form.get('id','')))
     except (ValueError, TypeError, Song.DoesNotExist), err:
         return json_error(str(err))
-    audio = EasyMP3(song.audio.path)
-    # Update title.
-    title = get_unicode(form, 'title')
-    if title:  # Disallow empty titles.
-        song.title = title
-        audio['title'] = title
-    # Update album.
-    album = get_unicode(form, 'album')
-    if album is not None:
-        song.album = album
-        audio['album'] = album
-    # Update artist.
-    artist = get_unicode(form, 'artist')
-    if artist is not None:
-        song.artist = artist
-        audio['artist'] = artist
-    # Update track number.
-    if form.get('track', None) == '':
-        song.track = 0
-    else:
-        track = get_integer(form, 'track')
-        if track is not None and 0 <= track < 999:
-            song.track = track
-            audio['tracknumber'] = unicode(track)
-    # Save and report success.
-    song.save()
-    audio.save()
+    # Save and report success.  The tags get written in the background.
+    _edit_song(song, form)
     return render_json_template('aenclave/done_editing.json', {'song':song})
+
+@permission_required_json('aenclave.change_song')
+@transaction.commit_on_success
+def json_bulk_edit(request):
+    """Apply the same changes to many songs at once.
+
+    Takes the song ids in 'ids' and the fields to change like json_edit, and
+    only changes the fields that are given.  The songs are updated with one
+    query, and their tags are written back in the background.
+    """
+    if not request.user.is_authenticated():
+        return json_error('user not logged in')
+    form = request.POST
+    song_ids = get_int_list(form, 'ids')
+    if not song_ids:
+        return json_error('no songs given')
+    changes = get_changes(form)
+    if not changes:
+        return json_error('no changes given')
+    songs = Song.objects.filter(pk__in=song_ids)
+    song_ids = list(songs.values_list('id', flat=True))
+    songs.update(**changes)
+    archive_cache.invalidate_songs(song_ids)
+    if set(changes).intersection(GRAMMAR_FIELDS[Song]):
+        wami_grammar.library_changed()
+    smartplaylist.queue_recheck(song_ids)
+    queue_tag_writes(song_ids)
+    return render_json_response(json.dumps({'songs': song_ids,
+                                            'changes': changes}))
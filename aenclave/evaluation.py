@@ -0,0 +1,312 @@
+# menclave/aenclave/evaluation.py
+
+"""Offline evaluation of recommenders.
+
+The play history is replayed in time order and split into sessions.  At each
+point in a session, the songs queued so far are the seeds, and the next few
+songs queued are held out.  A recommender is scored on how often its top k
+recommendations include a held out song (hit rate) and what fraction of them
+do (precision).  The in-memory recommenders only learn from sessions that
+ended before the one being queried, so they never see the answers.
+
+Events are (timestamp in seconds, song id) pairs.  They can come from the
+database, from a file written by export_events, or from synthetic_events,
+so recommenders can be compared on a laptop before they are deployed.
+
+The evaluate_recommendations command drives this.
+"""
+
+import bisect
+import heapq
+import random
+import time
+
+# The same cap on sessions as cooccurrence.MAX_GROUP_SIZE.
+MAX_SESSION_SIZE = 250
+
+def neighbor_count():
+    from menclave.aenclave import cooccurrence
+    return cooccurrence.neighbor_count()
+
+#---------------------------------- Events ----------------------------------#
+
+def database_events():
+    """Return the events in PlayHistory, oldest first.
+
+    Only the history that hasn't been rolled up yet is left to replay, so
+    export_events it before it ages out if you want to keep it.  The rolled
+    up plays are still counted by database_popularity.
+    """
+    from menclave.aenclave.models import PlayHistory
+    rows = (PlayHistory.objects.order_by('id')
+            .values_list('queued_time', 'song'))
+    return [(time.mktime(queued_time.timetuple()), song_id)
+            for (queued_time, song_id) in rows.iterator()]
+
+def database_popularity():
+    """Return {song id: plays} from the rolled up history.
+
+    These plays are all older than the raw history that database_events
+    replays, so a recommender can learn them first without seeing answers.
+    """
+    import datetime
+    from menclave.aenclave import history
+    return history.play_counts(datetime.date(1970, 1, 1), raw=False)
+
+def export_events(events, f):
+    """Write events to a file, one 'timestamp song_id' per line."""
+    for (timestamp, song_id) in events:
+        f.write('%.3f %d\n' % (timestamp, song_id))
+
+def read_events(f):
+    """Read events written by export_events."""
+    events = []
+    for line in f:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            (timestamp, song_id) = line.split()
+            events.append((float(timestamp), int(song_id)))
+    events.sort()
+    return events
+
+def synthetic_events(sessions=2000, songs=5000, albums=400, seed=0):
+    """Make up a history where songs on the same 'album' are queued together.
+
+    Each session mostly draws from one or two albums, with some popular
+    songs and some noise mixed in, so a good recommender has something to
+    find.
+    """
+    rng = random.Random(seed)
+    album_songs = [[] for i in xrange(albums)]
+    for song_id in xrange(1, songs + 1):
+        album_songs[rng.randrange(albums)].append(song_id)
+    album_songs = [album for album in album_songs if album]
+    popular = range(1, min(songs, 50) + 1)
+    events = []
+    now = 1.0e9
+    for i in xrange(sessions):
+        now += rng.uniform(600, 6 * 60 * 60)
+        favorites = rng.sample(album_songs, min(2, len(album_songs)))
+        for j in xrange(rng.randint(2, 12)):
+            roll = rng.random()
+            if roll < 0.75:
+                song_id = rng.choice(rng.choice(favorites))
+            elif roll < 0.9:
+                song_id = rng.choice(popular)
+            else:
+                song_id = rng.randint(1, songs)
+            now += rng.uniform(1, 20)
+            events.append((now, song_id))
+    return events
+
+def sessions(events, gap_seconds):
+    """Split events into lists of song ids queued within gap of each other."""
+    session = []
+    last_time = None
+    for (timestamp, song_id) in events:
+        if session and timestamp - last_time > gap_seconds:
+            yield (last_time, session)
+            session = []
+        session.append(song_id)
+        last_time = timestamp
+    if session:
+        yield (last_time, session)
+
+#------------------------------- Recommenders -------------------------------#
+
+# A recommender has a name, observe(song_ids) to learn from a finished
+# session, and recommend(seed_ids, k) to return up to k song ids, best first,
+# not including seed_ids.
+
+class PopularityRecommender(object):
+
+    """Recommends the most queued songs, whatever the seeds are.
+
+    Any recommender worth deploying should beat this.
+    """
+
+    name = 'popularity'
+
+    def __init__(self, counts=None):
+        # Start from counts, like the rolled up history, if given.
+        self.counts = dict(counts or {})
+
+    def observe(self, song_ids):
+        for song_id in song_ids:
+            self.counts[song_id] = self.counts.get(song_id, 0) + 1
+
+    def recommend(self, seed_ids, k):
+        seeds = set(seed_ids)
+        best = heapq.nlargest(k + len(seeds), self.counts.iteritems(),
+                              key=lambda item: item[1])
+        return [song_id for (song_id, count) in best
+                if song_id not in seeds][:k]
+
+class CoOccurrenceRecommender(object):
+
+    """An in-memory copy of the co-occurrence model in cooccurrence.py.
+
+    Each session of n songs adds 100/n to each of its pairs, and a song's
+    score is the sum of its weights with the seeds.  If neighbors is given,
+    only each seed's top neighbors are merged, like the SongNeighbors table.
+    """
+
+    name = 'cooccurrence'
+
+    def __init__(self, neighbors=None):
+        self.weights = {}
+        self.neighbors = neighbors
+        if neighbors:
+            self.name = 'cooccurrence-top%d' % neighbors
+
+    def observe(self, song_ids):
+        song_ids = sorted(set(song_ids))
+        n = len(song_ids)
+        if n < 2 or n > MAX_SESSION_SIZE:
+            return
+        weight = 100.0 / n
+        for a in song_ids:
+            row = self.weights.setdefault(a, {})
+            for b in song_ids:
+                if a != b:
+                    row[b] = row.get(b, 0.0) + weight
+
+    def recommend(self, seed_ids, k):
+        seeds = set(seed_ids)
+        scores = {}
+        for seed in seeds:
+            row = self.weights.get(seed, {})
+            items = row.iteritems()
+            if self.neighbors:
+                items = heapq.nlargest(self.neighbors, items,
+                                       key=lambda item: item[1])
+            for (song_id, weight) in items:
+                if song_id not in seeds:
+                    scores[song_id] = scores.get(song_id, 0.0) + weight
+        best = heapq.nlargest(k, scores.iteritems(), key=lambda item: item[1])
+        return [song_id for (song_id, score) in best]
+
+class LiveRecommender(object):
+
+    """The deployed recommender, reading the database.
+
+    It has already learned from the whole history, including the held out
+    songs, so its accuracy is flattering.  It's here for latency and query
+    counts.
+    """
+
+    name = 'live'
+
+    def observe(self, song_ids):
+        # The database already has every session.
+        pass
+
+    def recommend(self, seed_ids, k):
+        from menclave.aenclave import recommendations
+        return [song.id for song in recommendations.recommend_ids(seed_ids, k)]
+
+#-------------------------------- Evaluating --------------------------------#
+
+class Result(object):
+
+    """The scores of one recommender, asked for k songs at a time."""
+
+    def __init__(self, name, k):
+        self.name = name
+        self.k = k
+        self.queries = 0
+        self.hits = 0
+        self.precision_sum = 0.0
+        self.latencies = []
+        self.sql_queries = []
+
+    def add(self, recommended, held_out, latency, sql_queries=None):
+        self.queries += 1
+        relevant = len(set(recommended) & held_out)
+        if relevant:
+            self.hits += 1
+        # Recommending fewer than k songs doesn't raise precision.
+        self.precision_sum += float(relevant) / self.k
+        bisect.insort(self.latencies, latency)
+        if sql_queries is not None:
+            self.sql_queries.append(sql_queries)
+
+    @property
+    def hit_rate(self):
+        return float(self.hits) / max(self.queries, 1)
+
+    @property
+    def precision(self):
+        return self.precision_sum / max(self.queries, 1)
+
+    def latency(self, fraction):
+        """Return a latency percentile in milliseconds."""
+        if not self.latencies:
+            return 0.0
+        index = min(int(fraction * len(self.latencies)),
+                    len(self.latencies) - 1)
+        return self.latencies[index] * 1000
+
+    def report(self):
+        line = ('%-20s %6d queries  hit@%d %.3f  precision@%d %.3f  '
+                'p50 %.2fms  p95 %.2fms  max %.2fms' %
+                (self.name, self.queries, self.k, self.hit_rate, self.k,
+                 self.precision, self.latency(0.5), self.latency(0.95),
+                 self.latency(1.0)))
+        if self.sql_queries:
+            line += '  %.1f SQL queries/request' % (
+                    float(sum(self.sql_queries)) / len(self.sql_queries))
+        return line
+
+def _count_queries(func, *args):
+    """Run func and return its result and how many SQL queries it made.
+
+    Django only logs queries when DEBUG is on, so it is turned on for the
+    call.
+    """
+    from django.conf import settings
+    from django.db import connection
+    debug = settings.DEBUG
+    settings.DEBUG = True
+    start = len(connection.queries)
+    try:
+        result = func(*args)
+    finally:
+        settings.DEBUG = debug
+    return (result, len(connection.queries) - start)
+
+def evaluate(events, recommenders, gap_seconds=60, k=10, seed_size=10,
+             horizon=5, max_queries=None, count_queries=False):
+    """Replay events through the recommenders and return their Results.
+
+    For each song after the first in a session, the songs before it (at most
+    seed_size of them) are the seeds, and it and the horizon - 1 songs after
+    it are held out.
+    """
+    results = [Result(recommender.name, k) for recommender in recommenders]
+    queries = 0
+    for (end_time, session) in sessions(events, gap_seconds):
+        if len(session) <= MAX_SESSION_SIZE:
+            for i in xrange(1, len(session)):
+                if max_queries is not None and queries >= max_queries:
+                    break
+                seeds = session[max(0, i - seed_size):i]
+                held_out = set(session[i:i + horizon]) - set(seeds)
+                if not held_out:
+                    continue
+                queries += 1
+                for (recommender, result) in zip(recommenders, results):
+                    start = time.time()
+                    if count_queries:
+                        (recommended, sql_queries) = _count_queries(
+                                recommender.recommend, seeds, k)
+                    else:
+                        recommended = recommender.recommend(seeds, k)
+                        sql_queries = None
+                    result.add(recommended, held_out, time.time() - start,
+                               sql_queries)
+        if max_queries is not None and queries >= max_queries:
+            break
+        for recommender in recommenders:
+            recommender.observe(session)
+    return results
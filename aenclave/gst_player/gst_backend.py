@@ -35,11 +35,14 @@ pygst.require("0.10")
 import gst
 from collections import deque
 import logging
-import threading
 import random
+import time
 from django.db import transaction
 from menclave import settings
 from menclave.aenclave.models import Song
+from menclave.aenclave.gst_player.metrics import (MetricsRegistry,
+                                                  InstrumentedRLock, Tracer,
+                                                  instrumented)
 
 
 GST_STATES = {
@@ -106,20 +109,6 @@ def synchronized(func):
     return new_func
 
 
-def logged(func):
-    def new_func(*args, **kwargs):
-        logging.info("Entering function %r." % func.__name__)
-        try:
-            value = func(*args, **kwargs)
-        except Exception, e:
-            logging.exception(e.message)
-            raise e
-        finally:
-            logging.info("Exiting function %r." % func.__name__)
-        return value
-    return new_func
-
-
 class GstPlayer(object):
 
     """
@@ -139,6 +128,8 @@ class GstPlayer(object):
     song_history -- A deque of the last 20 songs played.  The head is the most
                     recently played song.
     player -- The gst player object that does the dirty work.
+    metrics -- The MetricsRegistry for this player, read via get_metrics().
+    tracer -- The sampled call Tracer; see GST_PLAYER_TRACE_SAMPLE_RATE.
     """
 
     def __init__(self):
@@ -156,8 +147,14 @@ class GstPlayer(object):
         bus = self.player.get_bus()
         bus.add_signal_watch()
         bus.connect("message", self.on_message)
+        # Metrics and tracing.  The lock records its own wait and hold times.
+        self.metrics = MetricsRegistry()
+        self.tracer = Tracer(getattr(settings, "GST_PLAYER_TRACE_SAMPLE_RATE",
+                                     0.0))
+        # Set when a song ends and cleared when the next one starts playing.
+        self._transition_started = None
         # The lock for the instance.
-        self.lock = threading.RLock()
+        self.lock = InstrumentedRLock(self.metrics, "lock")
         self.next_playid = 0
 
     MAX_PLAYID = 2 ** 32
@@ -173,15 +170,24 @@ class GstPlayer(object):
     def on_message(self, bus, message):
         """Handle messages from GStreamer."""
         t = message.type
-        # Ignore these messages, there are too many.
-        if t == gst.MESSAGE_STATE_CHANGED: return
-        logging.info("Message type: %r" % t)
+        if t == gst.MESSAGE_STATE_CHANGED:
+            # There are too many of these to do anything with, except measure
+            # the gap between the end of one song and the start of the next.
+            if (self._transition_started is not None and
+                message.src is self.player and
+                message.parse_state_changed()[1] == gst.STATE_PLAYING):
+                self.metrics.observe("transition_gap",
+                                     time.time() - self._transition_started)
+                self._transition_started = None
+            return
         if t == gst.MESSAGE_ERROR:
             # When there's an error playing a track, log it, and play the next
             # song.
-            logging.info(message)
+            self.metrics.incr("gst_errors")
+            logging.error("GStreamer error: %s", message)
             self.start()
         elif t == gst.MESSAGE_EOS:
+            self.metrics.incr("songs_finished")
             self._song_transition()
 
     @transaction.autocommit
@@ -191,6 +197,7 @@ class GstPlayer(object):
         last_song = self.current_song
         self._stop()
         if self.song_queue:
+            self._transition_started = time.time()
             self.start()
         if last_song and not last_song.noise:
             try:
@@ -206,13 +213,12 @@ class GstPlayer(object):
     #---------------------------- STATUS METHODS -----------------------------#
 
     @synchronized
-    @logged
+    @instrumented
     def get_channel_snapshot(self):
         """Get a snapshot of the channel state."""
         song_queue = list(self.song_queue)
         duration = sum(song.time for song in song_queue)
         status = self._get_status()
-        logging.info(status)
         if status == "stopped":
             current_song = None
             time_elapsed = 0
@@ -249,7 +255,7 @@ class GstPlayer(object):
     #--------------------------- PLAYBACK CONTROL ----------------------------#
 
     @synchronized
-    @logged
+    @instrumented
     def start(self):
         """
         Start playback.
@@ -262,7 +268,6 @@ class GstPlayer(object):
         if status == "paused":
             self.player.set_state(gst.STATE_PLAYING)
         elif status != "playing":
-            logging.info("Starting playback.")
             song = self.song_queue.popleft()
             self.current_song = song
             while len(self.song_history) > 20:
@@ -271,7 +276,7 @@ class GstPlayer(object):
             self.player.set_property("uri", "file://" + song.audio.path)
             self.player.set_state(gst.STATE_PLAYING)
 
-    @logged
+    @instrumented
     def _stop(self):
         """Stop the player."""
         if self.current_song and not self.current_song.noise:
@@ -279,20 +284,20 @@ class GstPlayer(object):
         self.player.set_state(gst.STATE_NULL)
 
     @synchronized
-    @logged
+    @instrumented
     def stop(self):
         """Stop the player and clear the queue."""
         self._stop()
         self.song_queue.clear()
         
     @synchronized
-    @logged
+    @instrumented
     def pause(self):
         """Pause the player."""
         self.player.set_state(gst.STATE_PAUSED)
 
     @synchronized
-    @logged
+    @instrumented
     def unpause(self):
         """Unpause the player."""
         if self._get_status() == "paused":
@@ -307,7 +312,7 @@ class GstPlayer(object):
         return Noise(os.path.join(settings.AENCLAVE_DEQUEUE_NOISES_DIR, deq))
 
     @synchronized
-    @logged
+    @instrumented
     @transaction.autocommit
     def skip(self):
         """Skip the current song and play a dequeue noise."""
@@ -339,10 +344,9 @@ class GstPlayer(object):
         self.add_songs([song])
 
     @synchronized
-    @logged
+    @instrumented
     def add_songs(self, songs):
         """Add some songs to the queue."""
-        logging.info("Queuing songs: %r" % songs)
         for song in songs:
             song.playid = self._get_next_playid()
             song.noise = False
@@ -358,6 +362,7 @@ class GstPlayer(object):
                 logging.exception("Unable to save song model to db.")
 
     @synchronized
+    @instrumented
     def queue_to_front(self, song):
         """Dequeue the current song and start playing the new song."""
         self._stop()
@@ -372,19 +377,17 @@ class GstPlayer(object):
         self.remove_songs([playid])
 
     @synchronized
-    @logged
+    @instrumented
     def remove_songs(self, playids):
         """Remove the songs with playids in playids from the queue."""
         playids = set(playids)
-        logging.info(playids)
         self.song_queue = deque(song for song in self.song_queue
                                 if song.playid not in playids)
 
     @synchronized
-    @logged
+    @instrumented
     def move_song(self, playid, after_playid):
         """Move the first song to after the second song in the queue."""
-        logging.info('playid: %i, after_playid: %i', playid, after_playid)
         # TODO(rnk): Clean this shit up.
         songs = list(self.song_queue)
         for (start_index, song) in enumerate(songs):
@@ -406,7 +409,29 @@ class GstPlayer(object):
         self.song_queue = deque(songs)
 
     @synchronized
-    @logged
+    @instrumented
     def shuffle(self):
         """Shuffle the songs in the queue."""
         random.shuffle(self.song_queue)
+
+    #-------------------------------- METRICS --------------------------------#
+
+    @synchronized
+    def get_metrics(self):
+        """Return a snapshot dict of the player's metrics."""
+        snapshot = self.metrics.snapshot()
+        snapshot["gauges"]["queue_length"] = len(self.song_queue)
+        snapshot["gauges"]["queue_duration"] = sum(song.time for song
+                                                   in self.song_queue)
+        snapshot["trace_sample_rate"] = self.tracer.sample_rate
+        return snapshot
+
+    @synchronized
+    def reset_metrics(self):
+        """Clear all counters and histograms."""
+        self.metrics.reset()
+
+    @synchronized
+    def set_trace_sample_rate(self, sample_rate):
+        """Trace this fraction of calls; zero turns tracing off."""
+        self.tracer.set_sample_rate(sample_rate)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+"""
+In-process metrics and sampled tracing for the GstPlayer.
+
+Everything here lives in the player process and is cheap enough to leave on
+all the time.  The web side reads it over Pyro with GstPlayer.get_metrics(),
+which returns a plain dict built by MetricsRegistry.snapshot().
+
+Tracing replaces the old per-call INFO logging.  It is off unless
+GST_PLAYER_TRACE_SAMPLE_RATE is set, and when it is off the only cost per call
+is a single attribute test.
+"""
+
+import bisect
+import logging
+import random
+import threading
+import time
+
+
+# Upper bounds in seconds of the latency histogram buckets.  Anything slower
+# than the last bound lands in the overflow bucket.
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0,
+                   5.0)
+
+
+class Histogram(object):
+
+    """
+    A fixed-bucket histogram of float observations.
+
+    Not thread safe on its own; the registry serializes access.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self):
+        bounds = [str(b) for b in self.buckets] + ['+inf']
+        if self.count:
+            mean = self.total / self.count
+        else:
+            mean = 0.0
+        return {'count': self.count,
+                'sum': self.total,
+                'mean': mean,
+                'max': self.max,
+                'buckets': zip(bounds, self.counts)}
+
+
+class MetricsRegistry(object):
+
+    """
+    Counters, gauges, and latency histograms keyed by name.
+
+    Names are dotted strings like "calls.add_songs" or "latency.skip".
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def record_call(self, name, elapsed):
+        """Count one call of the named method and record its latency."""
+        with self._lock:
+            key = 'calls.' + name
+            self.counters[key] = self.counters.get(key, 0) + 1
+            key = 'latency.' + name
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(elapsed)
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def snapshot(self):
+        """Return a picklable dict of every metric."""
+        with self._lock:
+            return {'uptime': time.time() - self.started,
+                    'counters': dict(self.counters),
+                    'gauges': dict(self.gauges),
+                    'histograms': dict((name, h.snapshot()) for (name, h)
+                                       in self.histograms.iteritems())}
+
+
+class InstrumentedRLock(object):
+
+    """
+    A re-entrant lock that records how long callers wait for it and hold it.
+
+    Only the outermost acquisition is measured, so nested synchronized calls
+    don't count their hold time twice.
+    """
+
+    def __init__(self, registry, name='lock'):
+        self._lock = threading.RLock()
+        self._registry = registry
+        self._wait_key = name + '.wait'
+        self._hold_key = name + '.hold'
+        # Only touched by the thread that owns the lock.
+        self._depth = 0
+        self._acquired_at = 0.0
+
+    def __enter__(self):
+        start = time.time()
+        self._lock.acquire()
+        self._depth += 1
+        if self._depth == 1:
+            self._acquired_at = time.time()
+            self._registry.observe(self._wait_key, self._acquired_at - start)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._depth -= 1
+        if self._depth == 0:
+            self._registry.observe(self._hold_key,
+                                   time.time() - self._acquired_at)
+        self._lock.release()
+
+
+class Tracer(object):
+
+    """
+    Logs a sample of method calls with their arguments and latency.
+
+    sample_rate -- The fraction of calls to log, between 0 and 1.  Zero turns
+                   tracing off.
+    """
+
+    def __init__(self, sample_rate=0.0):
+        self.set_sample_rate(sample_rate)
+
+    def set_sample_rate(self, sample_rate):
+        self.sample_rate = max(0.0, min(1.0, float(sample_rate)))
+        self.enabled = self.sample_rate > 0.0
+
+    def maybe_trace(self, name, args, elapsed):
+        if random.random() < self.sample_rate:
+            logging.info("TRACE %s%r took %.2fms", name, args,
+                         elapsed * 1000.0)
+
+
+def instrumented(func):
+    """
+    A decorator that records call counts and latency for GstPlayer methods.
+
+    The instance must have `metrics` and `tracer` attributes.  Exceptions are
+    counted, logged, and re-raised.
+    """
+    name = func.__name__
+    def new_func(self, *args, **kwargs):
+        start = time.time()
+        try:
+            return func(self, *args, **kwargs)
+        except Exception, e:
+            self.metrics.incr('errors.' + name)
+            logging.exception("Error in %r: %s", name, e)
+            raise
+        finally:
+            elapsed = time.time() - start
+            self.metrics.record_call(name, elapsed)
+            if self.tracer.enabled:
+                self.tracer.maybe_trace(name, args, elapsed)
+    new_func.__name__ = name
+    new_func.__doc__ = func.__doc__
+    return new_func
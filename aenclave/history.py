@@ -0,0 +1,260 @@
+# menclave/aenclave/history.py
+
+"""Play history and listening sessions.
+
+Songs queued within AENCLAVE_SESSION_GAP seconds of each other make up a
+listening session.  As songs are queued, the current session's song ids are
+kept in the cache, so recommendations can seed from it without reading the
+history.  If the cache has lost it, say because the web server restarted or
+another process wrote the last entry to its own local memory cache, it is
+rebuilt from the newest history rows with one query.
+
+Use a shared cache like memcached when running more than one web process, or
+each process will only see the songs it queued.
+
+Raw history is only kept for AENCLAVE_HISTORY_DAYS days.  rollup() folds
+older rows into daily per-song and per-user counts and deletes them, so the
+PlayHistory table, and every scan of it, stays the size of that window.  Rows
+that the co-occurrence model hasn't counted yet are never rolled up, so
+update_cooccurrences must run for retention to work; rollup() logs a
+warning when it is holding rows back.  Use play_counts() and
+user_play_counts() to count plays over any period; they add up the rollups
+and the raw rows.
+"""
+
+import datetime
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+from menclave.aenclave.models import (DailySongPlays, DailyUserPlays,
+                                      PlayHistory, Watermark)
+from menclave.aenclave import bulk
+from menclave.aenclave import jobs
+
+# The cache key for the current session.
+SESSION_KEY = 'aenclave-current-session'
+
+# Only remember this many of the session's songs.
+MAX_SESSION_SONGS = 50
+
+# How long the cache may keep the session.  It's rebuilt if it's dropped.
+SESSION_CACHE_SECONDS = 24 * 60 * 60
+
+# Roll up this many raw rows per transaction.
+ROLLUP_BATCH = 5000
+
+# Look up this many existing rollup rows per query.
+QUERY_CHUNK = 500
+
+def session_gap():
+    """Songs queued within this long of each other are in the same session."""
+    return datetime.timedelta(0, getattr(settings, 'AENCLAVE_SESSION_GAP', 60))
+
+def retention_days():
+    """Raw history older than this many days is rolled up."""
+    return getattr(settings, 'AENCLAVE_HISTORY_DAYS', 90)
+
+def _timestamp(dt):
+    return time.mktime(dt.timetuple()) + dt.microsecond / 1e6
+
+#--------------------------------- Writing ----------------------------------#
+
+def record_queued(songs, user=None, channel=None):
+    """Record that songs were just queued, in the history and the session.
+
+    The history rows are written with one executemany, however many songs
+    there are.
+    """
+    song_ids = [song.pk for song in songs]
+    if not song_ids:
+        return
+    user_id = channel_id = None
+    if user is not None and user.is_authenticated():
+        user_id = user.pk
+    if channel is not None:
+        channel_id = channel.pk
+    now = datetime.datetime.now()
+    bulk.insert_rows(PlayHistory, ('song', 'user', 'channel', 'queued_time'),
+                     [(song_id, user_id, channel_id, now)
+                      for song_id in song_ids])
+    extend_session(song_ids, _timestamp(now))
+
+def extend_session(song_ids, queued_time):
+    """Add songs queued at queued_time, in seconds, to the current session."""
+    if not song_ids:
+        return
+    session = cache.get(SESSION_KEY)
+    gap = session_gap()
+    gap_seconds = gap.days * 24 * 60 * 60 + gap.seconds
+    if session is None or queued_time - session['last_time'] > gap_seconds:
+        session = {'song_ids': []}
+    session['song_ids'] = (session['song_ids'] +
+                           list(song_ids))[-MAX_SESSION_SONGS:]
+    session['last_time'] = queued_time
+    cache.set(SESSION_KEY, session, SESSION_CACHE_SECONDS)
+
+#--------------------------------- Reading ----------------------------------#
+
+def load_session():
+    """Rebuild the current session from the newest history rows."""
+    gap = session_gap()
+    rows = (PlayHistory.objects.order_by('-id')
+            .values_list('song', 'queued_time')[:MAX_SESSION_SONGS])
+    song_ids = []
+    last_time = previous = None
+    for (song_id, queued_time) in rows:
+        if previous is not None and previous - queued_time > gap:
+            break
+        if last_time is None:
+            last_time = queued_time
+        song_ids.append(song_id)
+        previous = queued_time
+    song_ids.reverse()
+    session = {'song_ids': song_ids, 'last_time': 0}
+    if last_time is not None:
+        session['last_time'] = _timestamp(last_time)
+    return session
+
+def current_session(max_size=MAX_SESSION_SONGS):
+    """Return the ids of the songs queued in the latest session, oldest first.
+
+    The latest session is returned even if it ended a while ago.
+    """
+    session = cache.get(SESSION_KEY)
+    if session is None:
+        session = load_session()
+        cache.set(SESSION_KEY, session, SESSION_CACHE_SECONDS)
+    return session['song_ids'][-max_size:]
+
+def play_counts(since, song_ids=None, raw=True):
+    """Return {song id: times queued} for the songs queued since a date.
+
+    If song_ids is given, only those songs are counted.  Rolled up days are
+    counted whole, so since is a date rather than a time.  Pass raw=False to
+    only count the plays that have been rolled up.
+    """
+    counts = {}
+    rollups = DailySongPlays.objects.filter(date__gte=since)
+    raw_rows = PlayHistory.objects.filter(
+            queued_time__gte=datetime.datetime.combine(since, datetime.time()))
+    if song_ids is not None:
+        rollups = rollups.filter(song__in=song_ids)
+        raw_rows = raw_rows.filter(song__in=song_ids)
+    for (song_id, count) in rollups.values_list('song', 'count').iterator():
+        counts[song_id] = counts.get(song_id, 0) + count
+    if not raw:
+        return counts
+    for row in raw_rows.values('song').annotate(plays=Count('id')):
+        counts[row['song']] = counts.get(row['song'], 0) + row['plays']
+    return counts
+
+def user_play_counts(user, since):
+    """Return {date: songs queued} for a user's days since a date."""
+    counts = {}
+    rollups = DailyUserPlays.objects.filter(user=user, date__gte=since)
+    for (date, count) in rollups.values_list('date', 'count').iterator():
+        counts[date] = counts.get(date, 0) + count
+    raw = PlayHistory.objects.filter(
+            user=user,
+            queued_time__gte=datetime.datetime.combine(since, datetime.time()))
+    for queued_time in raw.values_list('queued_time', flat=True).iterator():
+        date = queued_time.date()
+        counts[date] = counts.get(date, 0) + 1
+    return counts
+
+#--------------------------------- Rollups ----------------------------------#
+
+def _add_counts(model, field, counts):
+    """Add {(key id, date): count} to a daily rollup table.
+
+    Existing rows are incremented and the rest are inserted, a few queries
+    per QUERY_CHUNK keys rather than one per key.
+    """
+    keys = counts.keys()
+    existing = {}
+    for i in xrange(0, len(keys), QUERY_CHUNK):
+        chunk = keys[i:i+QUERY_CHUNK]
+        rows = model.objects.filter(**{
+                field + '__in': set(key_id for (key_id, date) in chunk),
+                'date__in': set(date for (key_id, date) in chunk)})
+        for (pk, key_id, date) in rows.values_list('id', field, 'date'):
+            existing[(key_id, date)] = pk
+    bulk.increment_rows(model, 'count', [(counts[key], pk) for (key, pk)
+                                         in existing.iteritems()])
+    bulk.insert_rows(model, (field, 'date', 'count'),
+                     [(key_id, date, count) for ((key_id, date), count)
+                      in counts.iteritems() if (key_id, date) not in existing])
+
+@transaction.commit_on_success
+def _rollup_batch(rows):
+    song_counts = {}
+    user_counts = {}
+    for (pk, song_id, user_id, queued_time) in rows:
+        date = queued_time.date()
+        key = (song_id, date)
+        song_counts[key] = song_counts.get(key, 0) + 1
+        if user_id is not None:
+            key = (user_id, date)
+            user_counts[key] = user_counts.get(key, 0) + 1
+    _add_counts(DailySongPlays, 'song', song_counts)
+    _add_counts(DailyUserPlays, 'user', user_counts)
+    bulk.delete_rows(PlayHistory, [row[0] for row in rows])
+
+def rollup(days=None):
+    """Fold raw history older than days (or AENCLAVE_HISTORY_DAYS) into the
+    daily counts, and delete it.
+
+    Returns a dict of how many rows were rolled up, and how many old enough
+    rows were held back because update_cooccurrences hasn't counted them.
+    Each batch is its own transaction, so an interrupted rollup loses
+    nothing and can just be run again.
+    """
+    # This import goes here because cooccurrence imports this module.
+    from menclave.aenclave.cooccurrence import HISTORY_WATERMARK
+    if days is None:
+        days = retention_days()
+    cutoff = datetime.datetime.combine(
+            datetime.date.today() - datetime.timedelta(days), datetime.time())
+    # Sessions after the watermark haven't been counted as co-occurrences.
+    counted = Watermark.get(HISTORY_WATERMARK)
+    rows = (PlayHistory.objects
+            .filter(queued_time__lt=cutoff, pk__lte=counted).order_by('id')
+            .values_list('id', 'song', 'user', 'queued_time'))
+    total = 0
+    last_id = 0
+    while True:
+        batch = list(rows.filter(pk__gt=last_id)[:ROLLUP_BATCH])
+        if not batch:
+            break
+        _rollup_batch(batch)
+        last_id = batch[-1][0]
+        total += len(batch)
+    held_back = PlayHistory.objects.filter(queued_time__lt=cutoff,
+                                           pk__gt=counted).count()
+    if held_back:
+        logging.warning('Kept %d plays older than %d days because '
+                        'update_cooccurrences has not counted them yet',
+                        held_back, days)
+    return {'rolled_up': total, 'held_back': held_back}
+
+@jobs.handler('rollup_history')
+def rollup_job(job):
+    """The job handler that runs rollup()."""
+    return rollup()
+
+def merge_songs(original_id, duplicate_ids):
+    """Move the daily counts of duplicate songs to the original.
+
+    Called by processing.merge_duplicates before the duplicates are deleted.
+    """
+    rows = DailySongPlays.objects.filter(song__in=duplicate_ids)
+    counts = {}
+    for (date, count) in rows.values_list('date', 'count').iterator():
+        counts[(original_id, date)] = counts.get((original_id, date), 0) + count
+    _add_counts(DailySongPlays, 'song', counts)
+    rows.delete()
@@ -0,0 +1,198 @@
+# menclave/aenclave/jobs.py
+
+"""A small database-backed job queue for work that shouldn't block requests.
+
+Views enqueue jobs, and the run_jobs management command runs them in a pool
+of worker processes.  Because the queue lives in the database, any number of
+web processes can add to it and clients can poll a job's status while it
+runs.
+
+To define a kind of job, register a handler in one of JOB_MODULES:
+
+    @jobs.handler('ingest')
+    def ingest_song(job, song_id):
+        ...
+        return {'song_id': song_id}
+
+The handler gets the Job and its JSON-decoded args as keyword arguments, and
+its return value is JSON-encoded into job.result.  Handlers can report
+progress with set_progress().  If a handler raises, the job is marked failed
+and the exception message is saved.  A job whose worker died stays running
+until it has been running for AENCLAVE_JOB_TIMEOUT seconds, when run_jobs
+marks it failed.
+"""
+
+import datetime
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.db.models import Q
+
+from menclave.aenclave.models import Job
+
+# The modules that define job handlers.  The worker imports them all at
+# startup so it knows how to run every kind of job.
+JOB_MODULES = (
+    'menclave.aenclave.cooccurrence',
+    'menclave.aenclave.edit',
+    'menclave.aenclave.history',
+    'menclave.aenclave.processing',
+    'menclave.aenclave.smartplaylist',
+    'menclave.aenclave.wami_grammar',
+    'menclave.aenclave.youtuberip',
+)
+
+HANDLERS = {}
+
+def kind_limits():
+    """The most jobs of each kind that may run at once.
+
+    Kinds that aren't listed can use every worker.  YouTube rips are slow and
+    hog the network, so they are kept from starving the other jobs.
+    """
+    return {'youtube_rip': getattr(settings, 'AENCLAVE_YOUTUBE_RIP_WORKERS', 2)}
+
+def stale_cutoff(now=None):
+    """Jobs still running that started before this are presumed dead."""
+    timeout = getattr(settings, 'AENCLAVE_JOB_TIMEOUT', 6 * 60 * 60)
+    if now is None:
+        now = datetime.datetime.now()
+    return now - datetime.timedelta(seconds=timeout)
+
+#--------------------------------- Defining ---------------------------------#
+
+def handler(kind):
+    """A decorator that registers a function as the handler for a job kind."""
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+def load_handlers():
+    for module in JOB_MODULES:
+        __import__(module, {}, {}, [''])
+
+#-------------------------------- Enqueuing ---------------------------------#
+
+def enqueue(kind, args=None, key='', owner=None, coalesce=False,
+            coalesce_running=True):
+    """Add a job to the queue and return it.
+
+    If coalesce is true and an unfinished job of the same kind, key and owner
+    is already queued, that job is returned instead of adding another.  Pass
+    coalesce_running=False to only coalesce with jobs that haven't started,
+    for jobs that must see state that changed after they started.  Running
+    jobs older than stale_cutoff() are never coalesced with.
+    """
+    if owner is not None and not owner.is_authenticated():
+        owner = None
+    if coalesce and key:
+        pending = Job.objects.filter(kind=kind, key=key, owner=owner)
+        if coalesce_running:
+            pending = pending.filter(
+                    Q(status='queued') |
+                    Q(status='running', date_started__gte=stale_cutoff()))
+        else:
+            pending = pending.filter(status='queued')
+        for job in pending.order_by('id')[:1]:
+            return job
+    job = Job(kind=kind, key=key, args=json.dumps(args or {}), owner=owner)
+    job.save()
+    return job
+
+def get_jobs(job_ids):
+    """Fetch jobs by id, preserving the order of the ids."""
+    job_dict = Job.objects.in_bulk(job_ids)
+    return [job_dict[i] for i in job_ids if i in job_dict]
+
+def visible_to(job, user):
+    """Return whether a user may see a job's status and result."""
+    return job.owner_id is None or job.owner_id == user.id
+
+def job_info(job):
+    """Return a JSON-friendly dict of a job's status."""
+    info = {'id': job.pk,
+            'kind': job.kind,
+            'status': job.status,
+            'progress': job.progress,
+            'message': job.message}
+    if job.result:
+        info['result'] = json.loads(job.result)
+    return info
+
+#--------------------------------- Running ----------------------------------#
+
+def set_progress(job, progress, message=None):
+    """Record a running job's progress, between 0 and 1."""
+    fields = {'progress': progress}
+    if message is not None:
+        fields['message'] = message[:255]
+    Job.objects.filter(pk=job.pk).update(**fields)
+
+class ProgressReporter(object):
+
+    """Reports a job's progress without writing to the database too often.
+
+    A job with several steps can give each step a reporter for its own slice
+    of the progress bar, from start to end.
+    """
+
+    def __init__(self, job, start=0.0, end=1.0, interval=1.0):
+        self.job = job
+        self.start = start
+        self.end = end
+        self.interval = interval
+        self.last_report = 0
+
+    def report(self, fraction, message=None):
+        """Report that the step is fraction of the way done."""
+        now = time.time()
+        if now - self.last_report < self.interval and fraction < 1:
+            return
+        self.last_report = now
+        fraction = min(max(fraction, 0.0), 1.0)
+        set_progress(self.job, self.start + (self.end - self.start) * fraction,
+                     message)
+
+def claim(job_id):
+    """Atomically mark a queued job as running.  Returns False if we lost."""
+    count = Job.objects.filter(pk=job_id, status='queued').update(
+            status='running', date_started=datetime.datetime.now())
+    return count == 1
+
+def fail_stale(now=None):
+    """Mark jobs that have been running too long as failed.
+
+    Their workers were most likely killed, and until they're failed they hold
+    their keys, so coalesced enqueues would keep getting them back.  Returns
+    how many jobs were failed.
+    """
+    if now is None:
+        now = datetime.datetime.now()
+    stale = Job.objects.filter(status='running',
+                               date_started__lt=stale_cutoff(now))
+    return stale.update(status='failed', date_finished=now,
+                        message='Timed out.  Its worker may have died.')
+
+def run(job_id):
+    """Claim and run one job.  Returns the job's final status."""
+    if not claim(job_id):
+        return None
+    job = Job.objects.get(pk=job_id)
+    try:
+        func = HANDLERS[job.kind]
+        args = dict((str(k), v) for (k, v)
+                    in json.loads(job.args or '{}').items())
+        result = func(job, **args)
+    except Exception, e:
+        logging.exception('Job %d (%s) failed.', job.pk, job.kind)
+        Job.objects.filter(pk=job.pk).update(
+                status='failed', message=unicode(e)[:255],
+                date_finished=datetime.datetime.now())
+        return 'failed'
+    Job.objects.filter(pk=job.pk).update(
+            status='done', progress=1.0, result=json.dumps(result),
+            date_finished=datetime.datetime.now())
+    return 'done'
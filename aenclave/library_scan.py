@@ -0,0 +1,174 @@
+# menclave/aenclave/library_scan.py
+
+"""Compares the Song table against the song files on disk.
+
+Checking each song with os.path.exists, or each file with a query, takes
+hours on a big library.  Instead we read every song path in one query, walk
+SONGS_ROOT once, and compare the two sets.  Each top level directory of
+SONGS_ROOT is walked in its own thread, since the walk is nearly all waiting
+on the filesystem.
+
+This drives the list_missing, delete_missing, list_orphans and add_orphans
+commands.
+"""
+
+import os
+import sys
+import time
+from multiprocessing.pool import ThreadPool
+
+from menclave.aenclave.models import Song, SONGS_ROOT
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+# Threads to walk the song directories with.  The walk is I/O bound, so this
+# can be more than the number of CPUs.
+SCAN_THREADS = 8
+
+# The encodings that file names on disk may be in, most likely first.  Paths
+# from the walk are byte strings, and the database has unicode.
+ENCODINGS = (sys.getfilesystemencoding() or 'utf-8', 'utf-8', 'latin1')
+
+class ScanResult(object):
+
+    """The outcome of a library scan.
+
+    songs is a list of (song id, audio path) for every song, and files is the
+    set of every file's audio path.  missing lists the songs whose files are
+    gone, and orphans is a sorted list of the files with no song.  Paths are
+    relative to the song storage's root, as they are stored in Song.audio.
+    """
+
+    def __init__(self):
+        self.songs = []
+        self.files = set()
+        self.missing = []
+        self.orphans = []
+        self.timings = []
+
+    @property
+    def song_count(self):
+        return len(self.songs)
+
+    @property
+    def file_count(self):
+        return len(self.files)
+
+    def time(self, name, start):
+        self.timings.append((name, time.time() - start))
+
+    def timing_report(self):
+        return ', '.join('%s in %.2fs' % timing for timing in self.timings)
+
+#--------------------------------- Walking ----------------------------------#
+
+def _walk_scandir(path, files):
+    for entry in scandir(path):
+        if entry.is_dir():
+            _walk_scandir(entry.path, files)
+        elif entry.is_file():
+            files.append(entry.path)
+
+def _walk_listdir(path, files):
+    for (root, dirs, names) in os.walk(path):
+        files.extend(os.path.join(root, name) for name in names)
+
+def walk_files(path):
+    """Return the paths of all files under path, recursively."""
+    files = []
+    if scandir is not None:
+        _walk_scandir(path, files)
+    else:
+        _walk_listdir(path, files)
+    return files
+
+def disk_files(storage, root):
+    """Return the set of files under root, relative to the storage's root.
+
+    Each top level directory is walked in parallel.
+    """
+    # Walk byte strings, so that os.listdir doesn't choke on names that
+    # aren't in the filesystem encoding.
+    root = _encode(storage.path(root))
+    if not os.path.isdir(root):
+        return set()
+    media_root = os.path.join(_encode(storage.path('')), '')
+    subdirs = []
+    files = []
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if os.path.isdir(path):
+            subdirs.append(path)
+        else:
+            files.append(path)
+    pool = ThreadPool(min(SCAN_THREADS, max(len(subdirs), 1)))
+    try:
+        for subdir_files in pool.map(walk_files, subdirs):
+            files.extend(subdir_files)
+    finally:
+        pool.close()
+        pool.join()
+    return set(_decode(path[len(media_root):]) for path in files)
+
+def _encode(path):
+    if isinstance(path, unicode):
+        return path.encode(ENCODINGS[0])
+    return path
+
+def _decode(name):
+    for encoding in ENCODINGS:
+        try:
+            return name.decode(encoding)
+        except UnicodeError:
+            pass
+
+def song_file_exists(storage, name):
+    """Check for one song's file, with its name in any of ENCODINGS."""
+    path = storage.path(name)
+    if not isinstance(path, unicode):
+        return os.path.exists(path)
+    for encoding in ENCODINGS:
+        try:
+            if os.path.exists(path.encode(encoding)):
+                return True
+        except UnicodeError:
+            pass
+    return False
+
+#--------------------------------- Scanning ---------------------------------#
+
+def scan(missing=True, orphans=True):
+    """Scan the library for missing songs and orphaned files."""
+    result = ScanResult()
+    storage = Song._meta.get_field('audio').storage
+
+    start = time.time()
+    result.songs = list(Song.objects.values_list('id', 'audio').iterator())
+    result.time('read %d songs' % result.song_count, start)
+
+    start = time.time()
+    result.files = disk_files(storage, SONGS_ROOT)
+    result.time('walked %d files' % result.file_count, start)
+
+    start = time.time()
+    if missing:
+        for (pk, name) in result.songs:
+            if name in result.files:
+                continue
+            # The walk only covers SONGS_ROOT, and a name may be spelled
+            # differently on disk, so check the few left over by hand.
+            if song_file_exists(storage, name):
+                continue
+            result.missing.append((pk, name))
+    if orphans:
+        names = set(name for (pk, name) in result.songs)
+        result.orphans = sorted(result.files.difference(names))
+    result.time('compared', start)
+
+    return result
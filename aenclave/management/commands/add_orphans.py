@@ -1,12 +1,9 @@
-import os
-from os.path import join
-
 from django.core.management.base import NoArgsCommand
 from optparse import make_option
 
-from menclave.aenclave.models import Song, SONGS_ROOT
+from menclave.aenclave.models import Song
+from menclave.aenclave import library_scan
 from menclave.aenclave import processing
-from menclave import settings
 
 class Command(NoArgsCommand):
     """
@@ -20,36 +17,27 @@ class Command(NoArgsCommand):
             song = Song(track=0, time=0)
             song.audio = path
             audio = processing.annotate_metadata(song)
+            processing.annotate_checksum(song)
             song.save()
         except Exception, e:
             print "Got exception while adding orphan", e
         
     def handle_noargs(self, **options):
         verbose = options.get('verbose', False)
-        
-        orphans = 0
-        total = 0
-
-        SONGS_PATH = settings.MEDIA_ROOT + SONGS_ROOT
-        for root,dirs,files in os.walk(SONGS_PATH):
-            for f in files:
-                filename = join(root,f).replace(settings.MEDIA_ROOT, '')
-
-                # Need to convert filename from str to unicode (it's a
-                # latin1 string)
-                filename = filename.decode('latin1')
 
-                total += 1
-                try:
-                    song = Song.objects.get(audio=filename)
-                    if verbose:
-                        print "Song #%d => %s" % (song.pk, filename)
-                except Song.DoesNotExist, e:
-                    orphans += 1
-                    print "Orphan: %s" % (filename)
-                    self.add_song_by_path(filename)
-                except Exception, e:
-                    print "Got exception for", filename, ":", e
-                    
-                
-        print 'Done -- %d files orphaned of %d' % (orphans, total)
+        result = library_scan.scan(missing=False)
+        if verbose:
+            for (pk, filename) in result.songs:
+                if filename in result.files:
+                    print "Song #%d => %s" % (pk, filename)
+        print 'Scanned -- %s' % result.timing_report()
+
+        for filename in result.orphans:
+            print "Orphan: %s" % (filename)
+            try:
+                self.add_song_by_path(filename)
+            except Exception, e:
+                print "Got exception for", filename, ":", e
+
+        print 'Done -- %d files orphaned of %d' % (len(result.orphans),
+                                                   result.file_count)
@@ -1,34 +1,176 @@
+import multiprocessing
 import os
+import tempfile
+import time
 
 from django.core.management.base import NoArgsCommand
+from django.db import connection
 from optparse import make_option
 
 from menclave.aenclave.models import Song
+from menclave.aenclave import bulk
 from menclave.aenclave import processing
 
+DEFAULT_CHECKPOINT = os.path.join(tempfile.gettempdir(),
+                                  'aenclave-checksum_files.checkpoint')
+
+def _checksum(args):
+    """Hash one file in a worker.  Returns (pk, checksum, size, mtime).
+
+    The checksum is None if the file couldn't be read.
+    """
+    (pk, path) = args
+    try:
+        stat = os.stat(path)
+        return (pk, processing.md5sum(path), stat.st_size, int(stat.st_mtime))
+    except EnvironmentError:
+        # This happens if the file doesn't exist, or some such.
+        return (pk, None, 0, 0)
+
 class Command(NoArgsCommand):
     """
+    Checksums the song files in a pool of worker processes.  Files whose size
+    and mtime match the database are skipped, so rerunning it is cheap.  The
+    last song finished is checkpointed after each batch, and an interrupted
+    run picks up from there.
+
+    Files whose contents changed are moved to their new content addressed
+    path.  Missing files are reported, and their checksums are kept.
     """
 
-    option_list = NoArgsCommand.option_list + ( make_option('--verbose', action='store_true', dest='verbose', help='Lists each file processed.'),)
-    help = 'Re-checksums every file in the database.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--verbose', action='store_true', dest='verbose',
+                    help='Lists each file processed.'),
+        make_option('--force', action='store_true', dest='force',
+                    help='Checksum every file, even unchanged ones.'),
+        make_option('--processes', type='int', dest='processes',
+                    default=None, help='Number of worker processes.'
+                    '  Defaults to the number of CPUs.'),
+        make_option('--batch-size', type='int', dest='batch_size',
+                    default=500, help='Songs to write back per batch.'),
+        make_option('--checkpoint', dest='checkpoint',
+                    default=DEFAULT_CHECKPOINT,
+                    help='File to keep the progress of the run in.'),
+        make_option('--restart', action='store_true', dest='restart',
+                    help='Ignore the checkpoint and start from the top.'),
+    )
+    help = 'Re-checksums every changed file in the database.'
 
     def handle_noargs(self, **options):
         verbose = options.get('verbose', False)
-        songs = Song.objects.all();
-        total_songs = len(songs)
-        log_every_n = 1000
-        last_log = 0
-        done = 0
-        for song in songs:
-            filename = song.audio.path
-            processing.annotate_checksum(song)
-            song.save()
-            if verbose:
-                print "Checksummed song #%d. (%s)" % (song.pk, song.filechecksum)
-            done += 1
-            if last_log == 0:
-                print "Processed %d/%d" % (done, total_songs)
-                last_log = log_every_n
-            last_log -= 1
-        print 'Done'
+        force = options.get('force', False)
+        processes = options.get('processes') or multiprocessing.cpu_count()
+        batch_size = options.get('batch_size', 500)
+        checkpoint = options.get('checkpoint', DEFAULT_CHECKPOINT)
+
+        start_pk = 0
+        if not options.get('restart', False):
+            start_pk = self.read_checkpoint(checkpoint)
+            if start_pk:
+                print "Resuming after song #%d." % start_pk
+
+        songs = Song.objects.filter(pk__gt=start_pk).order_by('pk')
+        total_songs = songs.count()
+        rows = songs.values_list('pk', 'audio', 'file_size', 'file_mtime',
+                                 'filechecksum')
+        storage = Song._meta.get_field('audio').storage
+
+        start = time.time()
+        # Fork the pool before we open a connection it could inherit.
+        connection.close()
+        pool = multiprocessing.Pool(processes)
+        done = changed = moved = 0
+        missing = []
+        try:
+            last_pk = start_pk
+            while True:
+                batch = list(rows.filter(pk__gt=last_pk)[:batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1][0]
+                todo = self.changed_files(storage, batch, force)
+                results = pool.map(_checksum, todo)
+                old_checksums = dict((row[0], row[4]) for row in batch)
+                names = dict((row[0], row[1]) for row in batch)
+                updates = []
+                for (pk, checksum, size, mtime) in results:
+                    if checksum is None:
+                        missing.append(pk)
+                        print "Song #%d's file is missing. (%s)" % (
+                                pk, names[pk])
+                        continue
+                    name = names[pk]
+                    if checksum != old_checksums[pk]:
+                        name = self.relocate(pk, name, checksum)
+                        if name != names[pk]:
+                            moved += 1
+                    updates.append((checksum, size, mtime, name, pk))
+                    if verbose:
+                        print "Checksummed song #%d. (%s)" % (pk, checksum)
+                bulk.update_rows(Song, ('filechecksum', 'file_size',
+                                        'file_mtime', 'audio'), updates)
+                self.write_checkpoint(checkpoint, last_pk)
+                done += len(batch)
+                changed += len(updates)
+                print "Processed %d/%d, %d changed" % (done, total_songs,
+                                                       changed)
+        finally:
+            pool.close()
+            pool.join()
+
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        print 'Done -- checksummed %d of %d files in %.1fs, moved %d' % (
+                changed, done, time.time() - start, moved)
+        if missing:
+            print '%d files are missing: songs %s' % (
+                    len(missing), ', '.join('#%d' % pk for pk in missing))
+
+    def relocate(self, pk, name, checksum):
+        """Move a changed file to its new content addressed path.
+
+        Returns the file's new name, or the old one if it couldn't be moved.
+        """
+        song = Song(pk=pk, audio=name, filechecksum=checksum)
+        try:
+            processing.relocate_song(song)
+        except OSError, e:
+            print "Couldn't move song #%d: %s" % (pk, e)
+            return name
+        return song.audio.name
+
+    def changed_files(self, storage, batch, force):
+        """Return (pk, path) for the songs whose files need checksumming."""
+        todo = []
+        for (pk, name, size, mtime, checksum) in batch:
+            path = storage.path(name)
+            if not force:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    stat = None
+                if (stat is not None and stat.st_size == size and
+                    int(stat.st_mtime) == mtime):
+                    continue
+            todo.append((pk, path))
+        return todo
+
+    def read_checkpoint(self, checkpoint):
+        try:
+            f = open(checkpoint)
+            try:
+                return int(f.read().strip() or 0)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return 0
+
+    def write_checkpoint(self, checkpoint, pk):
+        # Write then rename so a crash never leaves a torn checkpoint.
+        tmp_path = checkpoint + '.tmp'
+        f = open(tmp_path, 'w')
+        try:
+            f.write('%d\n' % pk)
+        finally:
+            f.close()
+        os.rename(tmp_path, checkpoint)
@@ -0,0 +1,73 @@
+from django.core.management.base import NoArgsCommand
+from django.db.models import Count
+from optparse import make_option
+
+from menclave.aenclave.models import Song
+from menclave.aenclave import processing
+
+class Command(NoArgsCommand):
+    """
+    Merges songs whose files are identical, as told by their checksums.  The
+    oldest visible copy of each song is kept, and the playlists, history and
+    counts of the others are moved over to it.
+
+    Songs without a checksum are ignored, so run checksum_files first.
+    """
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--verbose', action='store_true', dest='verbose',
+                    help='Lists each duplicate found.'),
+        make_option('--dry-run', action='store_true', dest='dry_run',
+                    help='Only report the duplicates.'),
+        make_option('--relocate', action='store_true', dest='relocate',
+                    help='Also move every song file to its content addressed'
+                    ' path.'),
+    )
+    help = 'Merges duplicate songs in the database.'
+
+    def handle_noargs(self, **options):
+        verbose = options.get('verbose', False)
+        dry_run = options.get('dry_run', False)
+
+        if dry_run:
+            print "Dry-run mode -- no songs will be merged."
+
+        checksums = (Song.objects.exclude(filechecksum='')
+                     .values('filechecksum')
+                     .annotate(copies=Count('id'))
+                     .filter(copies__gt=1))
+        merged = 0
+        for row in checksums:
+            songs = list(Song.objects.filter(filechecksum=row['filechecksum'])
+                         .order_by('-visible', 'id'))
+            original, duplicates = songs[0], songs[1:]
+            if verbose:
+                print "Song #%d has duplicates %s. (%s)" % (
+                        original.pk, ', '.join('#%d' % s.pk for s in duplicates),
+                        original.filechecksum)
+            if not dry_run:
+                processing.merge_duplicates(original, duplicates)
+            merged += len(duplicates)
+        print 'Merged %d duplicates of %d songs' % (merged, len(checksums))
+
+        if options.get('relocate', False) and not dry_run:
+            self.relocate(verbose)
+
+    def relocate(self, verbose):
+        moved = 0
+        songs = Song.objects.exclude(filechecksum='').only('audio',
+                                                           'filechecksum')
+        for song in songs.iterator():
+            old_name = song.audio.name
+            try:
+                processing.relocate_song(song)
+            except OSError, e:
+                print "Couldn't move song #%d: %s" % (song.pk, e)
+                continue
+            if song.audio.name != old_name:
+                # Only touch the path so we don't clobber concurrent edits.
+                Song.objects.filter(pk=song.pk).update(audio=song.audio.name)
+                moved += 1
+                if verbose:
+                    print "Moved song #%d to %s" % (song.pk, song.audio.name)
+        print 'Moved %d song files' % moved
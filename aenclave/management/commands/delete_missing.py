@@ -1,9 +1,11 @@
-import os
-
 from django.core.management.base import NoArgsCommand
 from optparse import make_option
 
 from menclave.aenclave.models import Song
+from menclave.aenclave import library_scan
+
+# Delete missing songs this many at a time to keep the queries small.
+DELETE_BATCH_SIZE = 500
 
 class Command(NoArgsCommand):
     """
@@ -23,18 +25,22 @@ class Command(NoArgsCommand):
         else:
             print "Dry-run mode -- no database entries will be deleted."
 
-        missing = 0
-        total = 0
-        for song in Song.objects.all():
-            filename = song.audio.path
-
-            total +=1
-            if not os.path.exists(filename):
-                print "Song #%d is missing. (%s)" % (song.pk, filename)
-                missing += 1
-                if delete:
-                    song.delete()
+        result = library_scan.scan(orphans=False)
+        missing = set(pk for (pk, filename) in result.missing)
+        for (pk, filename) in result.songs:
+            if pk in missing:
+                print "Song #%d is missing. (%s)" % (pk, filename)
             elif verbose:
-                print "Song #%d is present. (%s)" % (song.pk, filename)
-                
-        print 'Done -- %d files missing of %d' % (missing, total)
+                print "Song #%d is present. (%s)" % (pk, filename)
+        print 'Scanned -- %s' % result.timing_report()
+
+        if delete:
+            # The scan can take a while, so make sure each file is still gone.
+            storage = Song._meta.get_field('audio').storage
+            pks = [pk for (pk, filename) in result.missing
+                   if not library_scan.song_file_exists(storage, filename)]
+            for i in xrange(0, len(pks), DELETE_BATCH_SIZE):
+                Song.objects.filter(pk__in=pks[i:i + DELETE_BATCH_SIZE]).delete()
+
+        print 'Done -- %d files missing of %d' % (len(result.missing),
+                                                  result.song_count)
@@ -0,0 +1,86 @@
+import sys
+
+from django.core.management.base import NoArgsCommand
+from optparse import make_option
+
+from menclave.aenclave import evaluation
+from menclave.aenclave import history
+
+class Command(NoArgsCommand):
+    """
+    Replays the play history through several recommenders and reports how
+    often they recommend what was queued next, and how fast they are.  The
+    history can come from the database, from a file made with --export, or
+    be made up with --synthetic, so this can run anywhere.
+    """
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--input', dest='input', default=None,
+                    help='Read events from this file instead of the'
+                    ' database.'),
+        make_option('--export', dest='export', default=None,
+                    help='Write the database\'s events to this file and'
+                    ' exit.'),
+        make_option('--synthetic', type='int', dest='synthetic',
+                    default=None, help='Make up this many sessions instead'
+                    ' of reading any.'),
+        make_option('--live', action='store_true', dest='live',
+                    help='Also time the deployed recommender and count its'
+                    ' SQL queries.  Its accuracy is inflated, since it has'
+                    ' seen the whole history.'),
+        make_option('-k', type='int', dest='k', default=10,
+                    help='How many songs to recommend.'),
+        make_option('--seeds', type='int', dest='seeds', default=10,
+                    help='How many of the songs queued so far to seed with.'),
+        make_option('--horizon', type='int', dest='horizon', default=5,
+                    help='How many of the next songs queued count as hits.'),
+        make_option('--max-queries', type='int', dest='max_queries',
+                    default=None, help='Stop after this many queries.'),
+    )
+    help = 'Evaluates recommenders offline against the play history.'
+
+    def handle_noargs(self, **options):
+        popularity = None
+        if options.get('synthetic'):
+            events = evaluation.synthetic_events(options['synthetic'])
+        elif options.get('input'):
+            f = open(options['input'])
+            try:
+                events = evaluation.read_events(f)
+            finally:
+                f.close()
+        else:
+            events = evaluation.database_events()
+            popularity = evaluation.database_popularity()
+
+        if options.get('export'):
+            f = open(options['export'], 'w')
+            try:
+                evaluation.export_events(events, f)
+            finally:
+                f.close()
+            print "Wrote %d events to %s" % (len(events), options['export'])
+            return
+
+        recommenders = [evaluation.PopularityRecommender(popularity),
+                        evaluation.CoOccurrenceRecommender(),
+                        evaluation.CoOccurrenceRecommender(
+                                evaluation.neighbor_count())]
+        if options.get('live'):
+            if options.get('synthetic') or options.get('input'):
+                print >>sys.stderr, ("--live only makes sense with the"
+                                     " database's own history.")
+                return
+            recommenders.append(evaluation.LiveRecommender())
+
+        gap = history.session_gap()
+        print "Replaying %d events..." % len(events)
+        results = evaluation.evaluate(
+                events, recommenders,
+                gap_seconds=gap.days * 24 * 60 * 60 + gap.seconds,
+                k=options['k'], seed_size=options['seeds'],
+                horizon=options['horizon'],
+                max_queries=options.get('max_queries'),
+                count_queries=bool(options.get('live')))
+        for result in results:
+            print result.report()
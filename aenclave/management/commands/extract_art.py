@@ -0,0 +1,86 @@
+import multiprocessing
+import time
+
+from django.core.management.base import NoArgsCommand
+from django.db import connection
+from optparse import make_option
+
+from menclave.aenclave.models import Song
+from menclave.aenclave import artwork
+from menclave.aenclave import bulk
+
+def _extract(args):
+    """Store one file's art in a worker.  Returns (pk, art name or None).
+
+    None means the file couldn't be read, as opposed to '' for no art.
+    """
+    (pk, path) = args
+    try:
+        return (pk, artwork.extract_artwork(path))
+    except Exception:
+        return (pk, None)
+
+class Command(NoArgsCommand):
+    """
+    Extracts the album art embedded in song files, for songs that were added
+    before art was extracted at upload time.  The images are stored by their
+    checksum, so an album whose tracks all embed the same cover gets one
+    image and one set of thumbnails.
+    """
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--force', action='store_true', dest='force',
+                    help='Read every song, not just the ones without art.'),
+        make_option('--processes', type='int', dest='processes',
+                    default=None, help='Number of worker processes.'
+                    '  Defaults to the number of CPUs.'),
+        make_option('--batch-size', type='int', dest='batch_size',
+                    default=500, help='Songs to write back per batch.'),
+    )
+    help = 'Extracts embedded album art and makes its thumbnails.'
+
+    def handle_noargs(self, **options):
+        force = options.get('force', False)
+        processes = options.get('processes') or multiprocessing.cpu_count()
+        batch_size = options.get('batch_size', 500)
+
+        songs = Song.objects.all()
+        if not force:
+            songs = songs.filter(album_art__isnull=True) | songs.filter(
+                    album_art='')
+        songs = songs.order_by('pk')
+        total_songs = songs.count()
+        rows = songs.values_list('pk', 'audio')
+        storage = Song._meta.get_field('audio').storage
+
+        start = time.time()
+        # Fork the pool before we open a connection it could inherit.
+        connection.close()
+        pool = multiprocessing.Pool(processes)
+        done = found = 0
+        images = set()
+        try:
+            last_pk = 0
+            while True:
+                batch = list(rows.filter(pk__gt=last_pk)[:batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1][0]
+                todo = [(pk, storage.path(name)) for (pk, name) in batch]
+                updates = []
+                for (pk, name) in pool.map(_extract, todo, chunksize=16):
+                    if name:
+                        updates.append((name, pk))
+                        images.add(name)
+                if updates:
+                    bulk.update_rows(Song, ('album_art',), updates)
+                done += len(batch)
+                found += len(updates)
+                print "Processed %d/%d, %d with art, %d distinct images" % (
+                        done, total_songs, found, len(images))
+        finally:
+            pool.close()
+            pool.join()
+
+        print 'Done -- found art for %d of %d songs in %.1fs' % (
+                found, done, time.time() - start)
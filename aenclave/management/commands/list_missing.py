@@ -1,9 +1,7 @@
-import os
-
 from django.core.management.base import NoArgsCommand
 from optparse import make_option
 
-from menclave.aenclave.models import Song
+from menclave.aenclave import library_scan
 
 class Command(NoArgsCommand):
     """
@@ -14,16 +12,14 @@ class Command(NoArgsCommand):
 
     def handle_noargs(self, **options):
         verbose = options.get('verbose', False)
-        missing = 0
-        total = 0
-        for song in Song.objects.all():
-            filename = song.audio.path
-
-            total +=1
-            if not os.path.exists(filename):
-                print "Song #%d is missing. (%s)" % (song.pk, filename)
-                missing += 1
+        result = library_scan.scan(orphans=False)
+        missing = set(pk for (pk, filename) in result.missing)
+        for (pk, filename) in result.songs:
+            if pk in missing:
+                print "Song #%d is missing. (%s)" % (pk, filename)
             elif verbose:
-                print "Song #%d is present. (%s)" % (song.pk, filename)
-                
-        print 'Done -- %d files missing of %d' % (missing, total)
+                print "Song #%d is present. (%s)" % (pk, filename)
+
+        print 'Scanned -- %s' % result.timing_report()
+        print 'Done -- %d files missing of %d' % (len(result.missing),
+                                                  result.song_count)
@@ -1,12 +1,7 @@
-import os
-from os.path import join
-
 from django.core.management.base import NoArgsCommand
 from optparse import make_option
 
-
-from menclave.aenclave.models import Song, SONGS_ROOT
-from menclave import settings
+from menclave.aenclave import library_scan
 
 class Command(NoArgsCommand):
     """
@@ -17,22 +12,14 @@ class Command(NoArgsCommand):
 
     def handle_noargs(self, **options):
         verbose = options.get('verbose', False)
-        
-        orphans = 0
-        total = 0
-
-        SONGS_PATH = settings.MEDIA_ROOT + SONGS_ROOT
-        for root,dirs,files in os.walk(SONGS_PATH):
-            for f in files:
-                filename = join(root,f).replace(settings.MEDIA_ROOT, '')
-
-                total += 1
-                try:
-                    song = Song.objects.get(audio=filename)
-                    if verbose:
-                        print "Song #%d => %s" % (song.pk, filename)
-                except Song.DoesNotExist, e:
-                    orphans += 1
-                    print "Orphan: %s" % (filename)
-                
-        print 'Done -- %d files orphaned of %d' % (orphans, total)
+        result = library_scan.scan(missing=False)
+        if verbose:
+            for (pk, filename) in result.songs:
+                if filename in result.files:
+                    print "Song #%d => %s" % (pk, filename)
+        for filename in result.orphans:
+            print "Orphan: %s" % (filename)
+
+        print 'Scanned -- %s' % result.timing_report()
+        print 'Done -- %d files orphaned of %d' % (len(result.orphans),
+                                                   result.file_count)
@@ -0,0 +1,145 @@
+import multiprocessing
+import os
+import time
+
+from django.core.management.base import NoArgsCommand
+from django.db import connection
+from optparse import make_option
+
+from menclave.aenclave.models import Song
+from menclave.aenclave import bulk
+from menclave.aenclave import processing
+from menclave.aenclave import smartplaylist
+from menclave.aenclave import wami_grammar
+
+def _read_tags(args):
+    """Read one file's tags in a worker.  Returns (pk, info, size, mtime).
+
+    info is None if the file couldn't be read or parsed, so that we never
+    replace good tags with the defaults for a broken file.
+    """
+    (pk, path) = args
+    try:
+        stat = os.stat(path)
+        (info, audio) = processing.read_metadata(path)
+    except Exception:
+        return (pk, None, 0, 0)
+    if audio is None:
+        info = None
+    return (pk, info, stat.st_size, int(stat.st_mtime))
+
+class Command(NoArgsCommand):
+    """
+    Re-reads the tags of the song files in a pool of worker processes and
+    updates the songs whose tags have changed.  Files whose size and mtime
+    haven't changed since their tags were last read are skipped.
+    """
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--verbose', action='store_true', dest='verbose',
+                    help='Lists each song updated.'),
+        make_option('--force', action='store_true', dest='force',
+                    help='Read every file, even unchanged ones.'),
+        make_option('--artist', dest='artist', default=None,
+                    help='Only retag songs by this artist.'),
+        make_option('--album', dest='album', default=None,
+                    help='Only retag songs on this album.'),
+        make_option('--ids', dest='ids', default=None,
+                    help='Only retag these songs, separated by commas.'),
+        make_option('--processes', type='int', dest='processes',
+                    default=None, help='Number of worker processes.'
+                    '  Defaults to the number of CPUs.'),
+        make_option('--batch-size', type='int', dest='batch_size',
+                    default=500, help='Songs to write back per batch.'),
+    )
+    help = 'Refreshes song metadata from the tags of their files.'
+
+    def handle_noargs(self, **options):
+        verbose = options.get('verbose', False)
+        force = options.get('force', False)
+        processes = options.get('processes') or multiprocessing.cpu_count()
+        batch_size = options.get('batch_size', 500)
+
+        songs = Song.objects.all()
+        if options.get('artist'):
+            songs = songs.filter(artist=options['artist'])
+        if options.get('album'):
+            songs = songs.filter(album=options['album'])
+        if options.get('ids'):
+            ids = [int(i) for i in options['ids'].split(',') if i.strip()]
+            songs = songs.filter(pk__in=ids)
+        songs = songs.order_by('pk')
+        total_songs = songs.count()
+        fields = ('audio', 'tags_size', 'tags_mtime') + processing.METADATA_FIELDS
+        rows = songs.values('pk', *fields)
+        storage = Song._meta.get_field('audio').storage
+
+        start = time.time()
+        # Fork the pool before we open a connection it could inherit.
+        connection.close()
+        pool = multiprocessing.Pool(processes)
+        done = read = updated = 0
+        try:
+            last_pk = 0
+            while True:
+                batch = list(rows.filter(pk__gt=last_pk)[:batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1]['pk']
+                todo = []
+                for row in batch:
+                    path = storage.path(row['audio'])
+                    if force or self.changed(path, row):
+                        todo.append((row['pk'], path))
+                rows_by_pk = dict((row['pk'], row) for row in batch)
+                results = pool.map(_read_tags, todo, chunksize=16)
+                updated += self.write_back(rows_by_pk, results, verbose)
+                done += len(batch)
+                read += len(todo)
+                elapsed = time.time() - start
+                print "Processed %d/%d, read %d (%.1f files/s), updated %d" % (
+                        done, total_songs, read, read / max(elapsed, 0.001),
+                        updated)
+        finally:
+            pool.close()
+            pool.join()
+        if updated:
+            wami_grammar.library_changed()
+            smartplaylist.sweep(everything=True)
+
+        elapsed = time.time() - start
+        print 'Done -- read %d of %d files in %.1fs (%.1f files/s), updated %d' % (
+                read, done, elapsed, read / max(elapsed, 0.001), updated)
+
+    def changed(self, path, row):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # The file is gone, so there's nothing to read.
+            return False
+        return (stat.st_size != row['tags_size'] or
+                int(stat.st_mtime) != row['tags_mtime'])
+
+    def write_back(self, rows_by_pk, results, verbose):
+        """Write the changed fields back, batched by which fields changed.
+
+        Returns the number of songs whose tags changed.
+        """
+        updates = {}
+        changed_songs = 0
+        for (pk, info, size, mtime) in results:
+            if info is None:
+                continue
+            row = rows_by_pk[pk]
+            changed = tuple(field for field in processing.METADATA_FIELDS
+                            if info[field] != row[field])
+            if changed:
+                changed_songs += 1
+                if verbose:
+                    print "Song #%d: changed %s" % (pk, ', '.join(changed))
+            values = tuple(info[field] for field in changed)
+            updates.setdefault(changed, []).append(values + (size, mtime, pk))
+        for (changed, update_rows) in updates.iteritems():
+            bulk.update_rows(Song, changed + ('tags_size', 'tags_mtime'),
+                             update_rows)
+        return changed_songs
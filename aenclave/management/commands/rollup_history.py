@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import NoArgsCommand
+from optparse import make_option
+
+from menclave.aenclave import history
+
+class Command(NoArgsCommand):
+    """
+    Folds play history older than AENCLAVE_HISTORY_DAYS into daily per-song
+    and per-user counts, and deletes it.  Plays that update_cooccurrences
+    hasn't counted yet are kept, so run this after it, say nightly from cron;
+    if update_cooccurrences never runs, nothing is ever rolled up.
+    """
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--days', type='int', dest='days', default=None,
+                    help='Keep this many days of raw history instead.'),
+    )
+    help = 'Rolls up old play history into daily counts.'
+
+    def handle_noargs(self, **options):
+        start = time.time()
+        result = history.rollup(options.get('days'))
+        print "Rolled up %d plays in %.1fs" % (result['rolled_up'],
+                                               time.time() - start)
+        if result['held_back']:
+            print ("Kept %d old plays that update_cooccurrences hasn't counted"
+                   " yet.  Run it first, or they will never be rolled up." %
+                   result['held_back'])
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+"""
+A Django management command that runs queued background jobs.
+
+Run one of these next to the web server (under the same init system as the
+gst player is a good choice).  It polls the Job table and hands queued jobs
+to a pool of worker processes, so a large SFTP drop gets ingested on every
+core at once.
+"""
+
+import logging
+import multiprocessing
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from menclave.aenclave import jobs
+from menclave.aenclave.models import Job
+
+# How often to look for jobs whose workers died, in seconds.
+STALE_CHECK_INTERVAL = 60
+
+
+def _init_worker():
+    # Each worker must open its own database connection rather than share
+    # the one it inherited from the parent.
+    connection.close()
+
+
+class Command(BaseCommand):
+
+    """Runs queued jobs until interrupted."""
+
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', type='int', dest='processes', default=None,
+                    help='Number of worker processes.  Defaults to the number'
+                    ' of CPUs.'),
+        make_option('--poll', type='float', dest='poll', default=1.0,
+                    help='Seconds to wait between polls of an empty queue.'),
+        make_option('--once', action='store_true', dest='once',
+                    help='Exit once the queue is empty.'),
+    )
+    help = 'Runs queued background jobs in a pool of worker processes.'
+
+    def handle(self, *args, **options):
+        processes = options.get('processes') or multiprocessing.cpu_count()
+        poll = options.get('poll', 1.0)
+        once = options.get('once', False)
+        jobs.load_handlers()
+        # Fork the pool before we touch the database in this process.
+        connection.close()
+        pool = multiprocessing.Pool(processes, _init_worker)
+        limits = jobs.kind_limits()
+        pending = {}
+        last_stale_check = 0
+        logging.info('Running jobs with %d processes.', processes)
+        try:
+            while True:
+                if time.time() - last_stale_check >= STALE_CHECK_INTERVAL:
+                    last_stale_check = time.time()
+                    failed = jobs.fail_stale()
+                    if failed:
+                        logging.warning('Failed %d jobs that ran too long.',
+                                        failed)
+                for (job_id, (kind, result)) in pending.items():
+                    if result.ready():
+                        del pending[job_id]
+                free = processes - len(pending)
+                queued = []
+                if free > 0:
+                    queued = self.next_jobs(pending, limits, free)
+                for (job_id, kind) in queued:
+                    pending[job_id] = (kind, pool.apply_async(jobs.run,
+                                                              (job_id,)))
+                # Drop the connection so the next poll sees fresh data, even
+                # on databases with repeatable read isolation.
+                connection.close()
+                if not queued:
+                    if once and not pending:
+                        break
+                    time.sleep(poll)
+        finally:
+            pool.close()
+            pool.join()
+
+    def next_jobs(self, pending, limits, free):
+        """Pick up to free queued jobs to run, as (id, kind) pairs.
+
+        Kinds that already have as many jobs running as their limit allows
+        are skipped, so slow jobs can't take over every worker.
+        """
+        running = {}
+        for (kind, result) in pending.itervalues():
+            running[kind] = running.get(kind, 0) + 1
+        full = [kind for (kind, limit) in limits.iteritems()
+                if running.get(kind, 0) >= limit]
+        queued = (Job.objects.filter(status='queued')
+                  .exclude(pk__in=pending.keys()).exclude(kind__in=full)
+                  .order_by('id').values_list('id', 'kind'))
+        picked = []
+        for (job_id, kind) in queued[:free * 4]:
+            if len(picked) >= free:
+                break
+            if kind in limits:
+                if running.get(kind, 0) >= limits[kind]:
+                    continue
+                running[kind] = running.get(kind, 0) + 1
+            picked.append((job_id, kind))
+        return picked
@@ -0,0 +1,38 @@
+from math import log
+
+from django.core.management.base import NoArgsCommand
+from optparse import make_option
+
+from menclave.aenclave.models import NO_SCORE, Song, log_score_weight
+from menclave.aenclave import bulk
+
+class Command(NoArgsCommand):
+    """
+    Fills in Song.hot_score from the old score and last_played columns, for
+    songs that haven't been played since hot_score was added.  Songs that
+    already have a hot_score are left alone, so it's safe to run again.
+
+    hot_score used to be stored as a plain sum rather than its log; pass
+    --from-linear once to convert scores stored that way.
+    """
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--from-linear', action='store_true', dest='linear',
+                    help='Convert hot scores stored as plain sums to logs.'),
+    )
+    help = 'Seeds the hot song scores from the old scores.'
+
+    def handle_noargs(self, **options):
+        if options.get('linear', False):
+            songs = Song.objects.filter(hot_score__gt=NO_SCORE)
+            rows = [(log(hot_score), pk) for (pk, hot_score)
+                    in songs.values_list('pk', 'hot_score').iterator()]
+            bulk.update_rows(Song, ('hot_score',), rows)
+            print "Converted the scores of %d songs" % len(rows)
+        songs = Song.objects.filter(hot_score=NO_SCORE, score__gt=0,
+                                    last_played__isnull=False)
+        rows = [(log(score) + log_score_weight(last_played), pk)
+                for (pk, score, last_played)
+                in songs.values_list('pk', 'score', 'last_played').iterator()]
+        bulk.update_rows(Song, ('hot_score',), rows)
+        print "Seeded the scores of %d songs" % len(rows)
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import NoArgsCommand
+from optparse import make_option
+
+from menclave.aenclave import smartplaylist
+
+class Command(NoArgsCommand):
+    """
+    Refreshes the smart playlists whose filters are relative to now, like
+    'added in the last week'.  Everything else about a song is re-checked
+    when it changes, so only these drift.  Run it hourly from cron.
+    """
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--all', action='store_true', dest='everything',
+                    help='Refresh every smart playlist, not just the ones'
+                    ' with relative rules.'),
+    )
+    help = 'Refreshes the time-relative smart playlists.'
+
+    def handle_noargs(self, **options):
+        start = time.time()
+        changed = smartplaylist.sweep(options.get('everything', False))
+        print "Refreshed smart playlists, %d changed, in %.1fs" % (
+                changed, time.time() - start)
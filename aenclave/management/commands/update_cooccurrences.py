@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import NoArgsCommand
+from optparse import make_option
+
+from menclave.aenclave import cooccurrence
+from menclave.aenclave import recommendations
+
+class Command(NoArgsCommand):
+    """
+    Folds the play history and playlist edits since the last run into the
+    co-occurrence weights that recommendations are made from.  Each run only
+    does work for what's new, so it's cheap to run from cron every few
+    minutes.
+    """
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--rebuild', action='store_true', dest='rebuild',
+                    help='Forget the weights and count everything again.'
+                    '  History that was rolled up is not recounted.'),
+        make_option('--neighbors', action='store_true', dest='neighbors',
+                    help='Recompute every song\'s neighbor list.'),
+        make_option('--clusters', action='store_true', dest='clusters',
+                    help='Also rebuild the old Cluster table from scratch.'
+                    '  This is slow, and only useful for comparison.'),
+    )
+    help = 'Updates the song co-occurrence weights.'
+
+    def handle_noargs(self, **options):
+        if options.get('rebuild', False):
+            print "Forgetting the old weights."
+            cooccurrence.reset()
+        summary = cooccurrence.update()
+        print "Counted %d sessions and %d playlists in %.1fs" % (
+                summary['sessions'], summary['playlists'],
+                summary['seconds'])
+        if options.get('neighbors', False):
+            start = time.time()
+            count = cooccurrence.refresh_all_neighbors()
+            print "Refreshed the neighbors of %d songs in %.1fs" % (
+                    count, time.time() - start)
+        if options.get('clusters', False):
+            start = time.time()
+            recommendations.make_clusters()
+            print "Rebuilt the clusters in %.1fs" % (time.time() - start)
@@ -2,13 +2,18 @@
 
 from calendar import timegm
 import datetime
-from math import exp
+import logging
+from math import exp, log, log1p
 import os
 import re
 
 from django.db import models
 from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (post_delete, post_init, post_save,
+                                      pre_delete)
 from django.contrib.auth.models import Group, User
+from django.utils.text import get_valid_filename
 
 #================================= UTILITIES =================================#
 
@@ -19,6 +24,76 @@ def datetime_string(dt):
         return dt.strftime('Yesterday %H:%M:%S')
     else: return dt.strftime('%d %b %Y %H:%M:%S')
 
+# Each play adds PLAY_SCORE to a song's score, which then decays by a factor
+# of e^-SCORE_DECAY a day.
+PLAY_SCORE = 100
+SCORE_DECAY = 0.05
+
+# Song.hot_score is measured from here.  See log_score_weight().
+SCORE_EPOCH = datetime.datetime(2010, 1, 1)
+
+# The hot_score of a song that has never been played.  Real scores are
+# always bigger, since they're logs of at least PLAY_SCORE after the epoch.
+NO_SCORE = 0.0
+
+# add_hot_score() gives up on a clean update after this many tries.
+SCORE_RETRIES = 5
+
+# How far a hot_score read back from the database may be from the stored one,
+# relative to its size.  Some backends, like PostgreSQL without
+# extra_float_digits, round doubles on the way out.
+SCORE_TOLERANCE = 1e-9
+
+def log_score_weight(when):
+    """Return the log of what a score of 1 at a time is worth in hot_score.
+
+    Instead of decaying every song's score as time passes, a play is scaled
+    up by e^(SCORE_DECAY * days since SCORE_EPOCH) when it is added, and
+    hot_score is the log of the sum.  Every song's true score is then
+    e^(hot_score - log_score_weight(now)), so ordering by hot_score ranks
+    songs by their current score.  Keeping the log means it grows by only
+    SCORE_DECAY a day, so it never overflows.
+    """
+    delta = when - SCORE_EPOCH
+    # 1.1574074074074073e-05 == 1.0 / (60 * 60 * 24)
+    days = delta.days + delta.seconds * 1.1574074074074073e-05
+    return SCORE_DECAY * days
+
+def add_log_scores(a, b):
+    """Return log(e^a + e^b) for two hot_scores, without overflowing."""
+    if a == NO_SCORE:
+        return b
+    if b == NO_SCORE:
+        return a
+    (high, low) = (max(a, b), min(a, b))
+    return high + log1p(exp(low - high))
+
+def add_hot_score(song_id, log_amount):
+    """Add e^log_amount to a song's hot_score and return the new hot_score.
+
+    Adding in log space needs LN and EXP in SQL, which SQLite doesn't have,
+    so the sum is done here and only written if the score hasn't changed
+    since we read it; otherwise we try again.  After SCORE_RETRIES tries the
+    sum is written anyway, which can lose a play that raced with ours but
+    never holds up the player.
+    """
+    songs = Song.objects.filter(pk=song_id)
+    for attempt in xrange(SCORE_RETRIES):
+        scores = list(songs.values_list('hot_score', flat=True))
+        if not scores:
+            return None
+        old = scores[0]
+        new = add_log_scores(old, log_amount)
+        slack = abs(old) * SCORE_TOLERANCE
+        unchanged = songs.filter(hot_score__gte=old - slack,
+                                 hot_score__lte=old + slack)
+        if unchanged.update(hot_score=new):
+            return new
+    logging.warning('Song #%d: hot_score kept changing, writing it anyway',
+                    song_id)
+    songs.update(hot_score=new)
+    return new
+
 #================================== MODELS ===================================#
 
 class VisibleManager(models.Manager):
@@ -31,7 +106,28 @@ class VisibleManager(models.Manager):
 #-----------------------------------------------------------------------------#
 
 SONGS_ROOT = 'aenclave/songs'
-SONG_AUDIO_UPLOAD_TO = os.path.join(SONGS_ROOT, '%Y/%m/%d/')
+# Uploads whose checksum isn't known yet are staged here until the ingest job
+# moves them to their content addressed path.  Songs added before content
+# addressing also live in dated directories like these.
+SONG_AUDIO_STAGING_TO = os.path.join(SONGS_ROOT, '%Y/%m/%d/')
+
+def song_audio_path(checksum, filename):
+    """Return the content addressed path of a song file.
+
+    Files are stored by their md5, like 'aenclave/songs/ab/cd/abcd....mp3', so
+    two uploads of the same file end up at the same place.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    return os.path.join(SONGS_ROOT, checksum[:2], checksum[2:4],
+                        checksum + ext)
+
+def song_audio_upload_to(song, filename):
+    """The upload_to of Song.audio.  Stages the file if it isn't checksummed."""
+    if song.filechecksum:
+        return song_audio_path(song.filechecksum, filename)
+    staging_dir = datetime.datetime.now().strftime(SONG_AUDIO_STAGING_TO)
+    filename = get_valid_filename(os.path.basename(filename))
+    return os.path.join(staging_dir, filename)
 
 class Song(models.Model):
 
@@ -104,7 +200,7 @@ class Song(models.Model):
 
     #------------------------------ Audio Path -------------------------------#
 
-    audio = models.FileField(max_length=255, upload_to=SONG_AUDIO_UPLOAD_TO)
+    audio = models.FileField(max_length=255, upload_to=song_audio_upload_to)
 
     def nice_filename(self):
         """Make a filename of the form 'artist - album - track - title.mp3'."""
@@ -120,14 +216,26 @@ class Song(models.Model):
 
     #--------------------------------- Score ---------------------------------#
 
+    # The score as of last_played.  It is no longer updated, but the
+    # seed_hot_scores command reads it to fill in hot_score for old songs.
     score = models.PositiveIntegerField(default=0, editable=False)
+
+    # The log of the score relative to SCORE_EPOCH, see log_score_weight().
+    # It's indexed so the hottest songs are one query.
+    hot_score = models.FloatField(default=NO_SCORE, db_index=True,
+                                  editable=False)
+
     def adjusted_score(self):
-        if self.last_played is None: return 0
-        delta = datetime.datetime.now() - self.last_played
-        # 1.1574074074074073e-05 == 1.0 / (60 * 60 * 24)
-        days = delta.days + delta.seconds * 1.1574074074074073e-05
-        return int(self.score * exp(-0.05 * days))
+        if self.hot_score == NO_SCORE: return 0
+        return int(exp(self.hot_score -
+                       log_score_weight(datetime.datetime.now())))
     adjusted_score.short_description = 'score'
+    adjusted_score.admin_order_field = 'hot_score'
+
+    @classmethod
+    def hottest(cls, count):
+        """Return the count visible songs with the highest scores right now."""
+        return cls.visibles.order_by('-hot_score')[:count]
 
     #-------------------------------- Visible --------------------------------#
 
@@ -136,7 +244,21 @@ class Song(models.Model):
 
     #----------------------------- File Checksum -----------------------------#
 
-    filechecksum = models.TextField(help_text="A checksum for the file.")
+    # The md5 of the file, which is also how the file is named on disk.  The
+    # index lets us spot duplicate uploads with a single lookup.
+    filechecksum = models.CharField(max_length=32, blank=True, db_index=True,
+                                    help_text="A checksum for the file.")
+
+    # The size and mtime of the file when it was checksummed, so that
+    # checksum_files can skip files that haven't changed.
+    file_size = models.PositiveIntegerField(default=0, editable=False)
+
+    file_mtime = models.IntegerField(default=0, editable=False)
+
+    # Likewise for when the tags were last read, for the retag command.
+    tags_size = models.PositiveIntegerField(default=0, editable=False)
+
+    tags_mtime = models.IntegerField(default=0, editable=False)
 
     #------------------------------ Other Stuff ------------------------------#
 
@@ -163,19 +285,29 @@ class Song(models.Model):
     def get_absolute_url(self):
         return ('aenclave-song', (str(self.id),))
 
+    # The player holds on to its songs for a while, so these update just their
+    # own columns, in the database, rather than saving stale copies.
+
     def queue_touch(self):
         self.last_queued = datetime.datetime.now()
-        self.save()
+        Song.objects.filter(pk=self.pk).update(last_queued=self.last_queued)
 
     def play_touch(self):
         self.last_played = datetime.datetime.now()
-        self.score = self.adjusted_score() + 100
+        Song.objects.filter(pk=self.pk).update(
+                last_played=self.last_played,
+                play_count=F('play_count') + 1)
         self.play_count += 1
-        self.save()
+        hot_score = add_hot_score(self.pk, log(PLAY_SCORE) +
+                                  log_score_weight(self.last_played))
+        if hot_score is not None:
+            self.hot_score = hot_score
+        _recheck_smart_playlists([self.pk])
 
     def skip_touch(self):
+        Song.objects.filter(pk=self.pk).update(skip_count=F('skip_count') + 1)
         self.skip_count += 1
-        self.save()
+        _recheck_smart_playlists([self.pk])
 
     objects = models.Manager()
     visibles = VisibleManager()
@@ -225,12 +357,30 @@ class Playlist(models.Model):
         for entry in last_entries:
             start_pos = entry.position + 1
         self._append_songs(songs, start_pos)
+        self.touch()
 
     @transaction.commit_on_success
     def set_songs(self, songs):
         """Clear the playlist and replace it with these songs in this order."""
         self.songs.clear()
         self._append_songs(songs, 0)
+        self.touch()
+
+    @transaction.commit_on_success
+    def remove_songs(self, songs):
+        """Remove songs from the playlist."""
+        PlaylistEntry.objects.filter(playlist=self, song__in=songs).delete()
+        self.touch()
+
+    def touch(self):
+        """Bump last_modified without saving the rest of the playlist.
+
+        Anything that changes the songs must call this, so that the
+        co-occurrence update knows to look at the playlist again.
+        """
+        self.last_modified = datetime.datetime.now()
+        Playlist.objects.filter(pk=self.pk).update(
+                last_modified=self.last_modified)
 
     last_modified = models.DateTimeField(auto_now=True, editable=False)
     def last_modified_string(self): return datetime_string(self.last_modified)
@@ -256,6 +406,10 @@ class Playlist(models.Model):
             return True
         return (user.id == self.owner_id)
 
+    def is_smart(self):
+        """Whether this is a smart playlist, whose songs follow its filter."""
+        return SmartPlaylist.objects.filter(pk=self.pk).count() > 0
+
     def can_edit(self, user):
         if user.is_staff:
             return True
@@ -300,6 +454,30 @@ class PlaylistEntry(models.Model):
 
 #-----------------------------------------------------------------------------#
 
+class SmartPlaylist(models.Model):
+
+    """A playlist whose songs are the results of a saved filter search.
+
+    The songs are kept in the playlist's entries like any other playlist's,
+    so opening one costs the same.  See menclave.aenclave.smartplaylist for
+    how they are kept up to date.
+    """
+
+    playlist = models.OneToOneField(Playlist, primary_key=True,
+                                    related_name='smart')
+
+    # The filter search's query string, like 'k=and&k_0=title&...'.
+    query = models.TextField()
+
+    # Whether the filter has rules relative to now, like 'added in the last
+    # week', so that the sweep has to re-check it as time passes.
+    relative = models.BooleanField(default=False, db_index=True)
+
+    last_refreshed = models.DateTimeField(default=None, blank=True, null=True,
+                                          editable=False)
+
+#-----------------------------------------------------------------------------#
+
 class Channel(models.Model):
 
     """The database model of an audio output channel."""
@@ -342,18 +520,302 @@ class Channel(models.Model):
         from menclave.aenclave.control import Controller
         return Controller(self)
 
+#-----------------------------------------------------------------------------#
+
+class CachedArchive(models.Model):
+
+    """A prebuilt zip archive of songs in the on-disk archive cache.
+
+    The key is a hash of the ordered song ids, their checksums and their
+    archive names, so an archive never outlives the songs it was built from.
+    See menclave.aenclave.archive_cache.
+    """
+
+    def __unicode__(self): return self.key
+
+    key = models.CharField(max_length=40, unique=True)
+
+    size = models.BigIntegerField()
+
+    songs = models.ManyToManyField(Song)
+
+    last_access = models.DateTimeField(db_index=True)
+
+    date_created = models.DateTimeField(auto_now_add=True, editable=False)
+
+    class Meta:
+        ordering = ('last_access',)
+
+def _song_pre_delete(sender, instance, **kwargs):
+    # We do this before the delete so the archive's song links still exist.
+    # TODO(rnk): This import goes here to avoid circularity.
+    from menclave.aenclave import archive_cache
+    archive_cache.invalidate_songs([instance.pk])
+
+pre_delete.connect(_song_pre_delete, sender=Song)
+
+# The fields the speech grammar is built from.  Other saves, like the player's,
+# leave the grammar alone.
+GRAMMAR_FIELDS = {Song: ('title', 'artist', 'album', 'visible'),
+                  Playlist: ('name',)}
+
+def _grammar_fields(sender, instance):
+    # Read __dict__ so that deferred fields aren't loaded just for this.
+    return tuple(instance.__dict__.get(name)
+                 for name in GRAMMAR_FIELDS[sender])
+
+def _library_loaded(sender, instance, **kwargs):
+    instance._grammar_fields = _grammar_fields(sender, instance)
+
+def _library_saved(sender, instance, created=False, **kwargs):
+    fields = _grammar_fields(sender, instance)
+    if created or fields != getattr(instance, '_grammar_fields', None):
+        _library_changed(sender)
+    instance._grammar_fields = fields
+
+def _library_changed(sender, **kwargs):
+    # TODO(rnk): This import goes here to avoid circularity.
+    from menclave.aenclave import wami_grammar
+    wami_grammar.library_changed()
+
+# The speech grammar lists every song and playlist by name.
+for model in GRAMMAR_FIELDS:
+    post_init.connect(_library_loaded, sender=model)
+    post_save.connect(_library_saved, sender=model)
+    post_delete.connect(_library_changed, sender=model)
+
+def _recheck_smart_playlists(song_ids):
+    # TODO(rnk): This import goes here to avoid circularity.
+    from menclave.aenclave import smartplaylist
+    smartplaylist.queue_recheck(song_ids)
+
+def _song_post_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _recheck_smart_playlists([instance.pk])
+
+post_save.connect(_song_post_save, sender=Song)
+
+#-----------------------------------------------------------------------------#
+
+class Job(models.Model):
+
+    """A unit of background work, such as ingesting an uploaded song.
+
+    Jobs are run by the run_jobs management command.  See
+    menclave.aenclave.jobs for how to define and enqueue them.
+    """
+
+    def __unicode__(self): return u'%s #%d (%s)' % (self.kind, self.pk,
+                                                     self.status)
+
+    STATUS_CHOICES = (('queued', 'Queued'),
+                      ('running', 'Running'),
+                      ('done', 'Done'),
+                      ('failed', 'Failed'))
+
+    kind = models.CharField(max_length=32, db_index=True)
+
+    # Jobs of the same kind with the same key can be coalesced.
+    key = models.CharField(max_length=255, blank=True, db_index=True)
+
+    # JSON encoded keyword arguments for the job handler.
+    args = models.TextField(blank=True)
+
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES,
+                              default='queued', db_index=True)
+
+    # Between 0 and 1, for jobs that report it.
+    progress = models.FloatField(default=0.0)
+
+    message = models.CharField(max_length=255, blank=True)
+
+    # JSON encoded return value of the job handler.
+    result = models.TextField(blank=True)
+
+    owner = models.ForeignKey(User, blank=True, null=True)
+
+    date_created = models.DateTimeField(auto_now_add=True, editable=False)
+
+    date_started = models.DateTimeField(blank=True, null=True, editable=False)
+
+    date_finished = models.DateTimeField(blank=True, null=True, editable=False)
+
+    class Meta:
+        get_latest_by = 'date_created'
+        ordering = ('id',)
+
+#-----------------------------------------------------------------------------#
+
+class Upload(models.Model):
+
+    """A resumable upload of a song file that is sent in chunks.
+
+    The chunks are written straight into a staging file, and the song is
+    ingested once every chunk has arrived.  See
+    menclave.aenclave.chunkupload.
+    """
+
+    def __unicode__(self): return self.filename
+
+    STATUS_CHOICES = (('receiving', 'Receiving'),
+                      ('finishing', 'Finishing'))
+
+    # The secret that names the upload in its URLs.
+    token = models.CharField(max_length=32, unique=True)
+
+    # Lets a client find its upload again to resume it, such as the file's
+    # name, size and modification time.
+    client_key = models.CharField(max_length=255, db_index=True)
+
+    owner = models.ForeignKey(User, blank=True, null=True)
+
+    filename = models.CharField(max_length=255)
+
+    size = models.PositiveIntegerField()
+
+    chunk_size = models.PositiveIntegerField()
+
+    date_created = models.DateTimeField(auto_now_add=True, editable=False)
+
+    last_activity = models.DateTimeField(db_index=True)
+
+    # An upload is claimed by setting this to 'finishing', so that only one
+    # request moves it into the library.
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES,
+                              default='receiving')
+
+    def chunk_count(self):
+        return (self.size + self.chunk_size - 1) // self.chunk_size
+
+    def chunk_length(self, number):
+        """The length of a chunk, which is short only for the last one."""
+        return min(self.chunk_size, self.size - number * self.chunk_size)
+
+class UploadChunk(models.Model):
+
+    """A chunk of an Upload that has been written to its staging file."""
+
+    upload = models.ForeignKey(Upload)
+
+    number = models.PositiveIntegerField()
+
+    # The md5 of the chunk, computed as it was written.
+    checksum = models.CharField(max_length=32)
+
+    class Meta:
+        ordering = ('upload', 'number')
+        unique_together = (('upload', 'number'),)
+
 #---------------------------- For 6.867 --------------------------------
 
 class PlayHistory(models.Model):
 
     song = models.ForeignKey(Song)
     queued_time = models.DateTimeField(auto_now_add=True, editable=False)
+    # Who queued it, and where.  Older rows don't have these.
+    user = models.ForeignKey(User, blank=True, null=True)
+    channel = models.ForeignKey(Channel, blank=True, null=True)
+
+class DailySongPlays(models.Model):
+
+    """How many times a song was queued on a day.
+
+    Old PlayHistory rows are rolled up into these and deleted, so the
+    history stays the size of its retention window.  See history.rollup.
+    """
+
+    song = models.ForeignKey(Song)
+    date = models.DateField(db_index=True)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (('song', 'date'),)
+
+class DailyUserPlays(models.Model):
+
+    """How many songs a user queued on a day, rolled up like DailySongPlays."""
+
+    user = models.ForeignKey(User)
+    date = models.DateField(db_index=True)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (('user', 'date'),)
 
 class Cluster(models.Model):
 
     weight = models.FloatField(editable=True)
     songs = models.ManyToManyField(Song)
 
+class CoOccurrence(models.Model):
+
+    """How strongly two songs go together, from sessions and playlists.
+
+    Each pair is stored once, with the lower song id as song_a, so the table
+    is a sparse, symmetric song by song matrix.  See cooccurrence.py.
+    """
+
+    song_a = models.ForeignKey(Song, related_name='cooccurrences_a')
+
+    song_b = models.ForeignKey(Song, related_name='cooccurrences_b')
+
+    # The sum of the sessions' and playlists' weights, which stays a plain sum
+    # so that edited playlists can be subtracted again.
+    weight = models.FloatField(default=0.0)
+
+    # What recommendation feedback has multiplied the weight by.
+    feedback = models.FloatField(default=1.0)
+
+    class Meta:
+        unique_together = (('song_a', 'song_b'),)
+
+class SongNeighbors(models.Model):
+
+    """The songs that co-occur most with a song, best first.
+
+    The list is kept as text, like '12:40.5 7:33.3', so that recommending
+    from several songs reads one short row for each.
+    """
+
+    song = models.OneToOneField(Song, primary_key=True,
+                                related_name='neighbor_list')
+
+    neighbors = models.TextField(blank=True)
+
+class PlaylistSnapshot(models.Model):
+
+    """The songs of a playlist when they were last counted as co-occurring.
+
+    This isn't a foreign key, so that we still have the snapshot to subtract
+    once the playlist is deleted.
+    """
+
+    playlist_id = models.IntegerField(primary_key=True)
+
+    # The song ids, separated by spaces.
+    song_ids = models.TextField(blank=True)
+
+    date_taken = models.DateTimeField()
+
+class Watermark(models.Model):
+
+    """How far an incremental job has gotten through a table, by name."""
+
+    name = models.CharField(max_length=64, unique=True)
+
+    value = models.IntegerField(default=0)
+
+    @staticmethod
+    def get(name):
+        for watermark in Watermark.objects.filter(name=name)[:1]:
+            return watermark.value
+        return 0
+
+    @staticmethod
+    def set(name, value):
+        if not Watermark.objects.filter(name=name).update(value=value):
+            Watermark(name=name, value=value).save()
+
 # just a count of recommendation songs that were selected for queueing.
 class GoodRecs(models.Model):
 
@@ -364,4 +826,24 @@ class BadRecs(models.Model):
 
     bad_recs = models.IntegerField(editable=False)
 
+class RecommendationFeedback(models.Model):
+
+    """A recommended song that was queued or marked bad, for evaluation.
+
+    seed_ids are the ids of the songs it was recommended from, separated by
+    spaces, so the recommendation can be replayed offline.
+    """
+
+    KIND_CHOICES = (('good', 'Queued'), ('bad', 'Marked bad'))
+
+    kind = models.CharField(max_length=8, choices=KIND_CHOICES)
+
+    song = models.ForeignKey(Song)
+
+    seed_ids = models.TextField(blank=True)
+
+    user = models.ForeignKey(User, blank=True, null=True)
+
+    date = models.DateTimeField(db_index=True)
+
 #=============================================================================#
@@ -1,12 +1,14 @@
+import datetime
 import json
 
-from django.contrib.auth.models import Group
+from django.contrib.auth.models import Group, User
 from django.contrib.auth.decorators import login_required
 from django.core.urlresolvers import reverse
 from django.template import RequestContext
 from django.db.models import Count, Q
 from django.http import Http404, HttpResponseRedirect
 
+from menclave.aenclave import history
 from menclave.aenclave import json_response
 from menclave.login import permission_required
 from menclave.aenclave.html import render_html_template, html_error
@@ -14,6 +16,11 @@ from menclave.aenclave.xml import render_xml_to_response
 from menclave.aenclave.models import Playlist, PlaylistEntry, Song
 from menclave.aenclave.utils import get_integer, get_unicode, get_song_list
 
+# Smart playlists are refreshed from their filters, which would undo any
+# change to their songs made by hand.
+SMART_EDIT_ERROR = ("The songs of a smart playlist come from its filter, so"
+                    " they can't be changed by hand.")
+
 #----------------------------- Playlist Viewing ------------------------------#
 
 def all_playlists(request):
@@ -33,7 +40,7 @@ def playlist_detail(request, playlist_id):
     try: playlist = Playlist.objects.get(pk=playlist_id)
     except Playlist.DoesNotExist: raise Http404
     can_cede = playlist.can_cede(request.user)
-    can_edit = playlist.can_edit(request.user)
+    can_edit = playlist.can_edit(request.user) and not playlist.is_smart()
     # Using the PlaylistEntry default order_by makes a godawful query.
     songs = playlist.songs.order_by('playlistentry__position')
     songs = Song.annotate_favorited(songs, request.user)
@@ -48,10 +55,21 @@ def playlist_detail(request, playlist_id):
                                  'groups': groups},
                                 context_instance=RequestContext(request))
 
+# The user playlists page counts the user's plays over this many days.
+RECENT_PLAY_DAYS = 30
+
 def user_playlists(request, username):
     plists = Playlist.objects.filter(owner__username=username)
+    owner = None
+    recent_plays = 0
+    for owner in User.objects.filter(username=username)[:1]:
+        since = datetime.date.today() - datetime.timedelta(RECENT_PLAY_DAYS)
+        recent_plays = sum(history.user_play_counts(owner, since).values())
     return render_html_template('aenclave/playlist_list.html', request,
-                                {'playlist_list': plists},
+                                {'playlist_list': plists,
+                                 'owner': owner,
+                                 'recent_plays': recent_plays,
+                                 'recent_play_days': RECENT_PLAY_DAYS},
                                 context_instance=RequestContext(request))
 
 @login_required
@@ -111,6 +129,8 @@ def add_to_playlist(request):
     if not playlist.can_edit(request.user):
         return html_error(request, 'You lack permission to edit this'
                           ' playlist.', 'Add Songs')
+    if playlist.is_smart():
+        return html_error(request, SMART_EDIT_ERROR, 'Add Songs')
     # Add the songs and redirect to the detail page for this playlist.
     songs = get_song_list(form)
     playlist.append_songs(songs)
@@ -128,9 +148,11 @@ def remove_from_playlist(request):
     if not playlist.can_edit(request.user):
         return html_error(request, 'You lack permission to edit this'
                           ' playlist.', 'Remove Songs')
+    if playlist.is_smart():
+        return html_error(request, SMART_EDIT_ERROR, 'Remove Songs')
     # Remove the songs and redirect to the detail page for this playlist.
     songs = get_song_list(form)
-    PlaylistEntry.objects.filter(song__in=songs).delete()
+    playlist.remove_songs(songs)
     return HttpResponseRedirect(playlist.get_absolute_url())
 
 @permission_required('aenclave.delete_playlist', 'Delete Playlist')
@@ -161,6 +183,8 @@ def edit_playlist(request, playlist_id):
     if not playlist.can_edit(request.user):
         return json_response.json_error('You are not authorized to edit this'
                                         ' playlist.')
+    if playlist.is_smart():
+        return json_response.json_error(SMART_EDIT_ERROR)
     songs = get_song_list(form)
     if songs:
         playlist.set_songs(songs)
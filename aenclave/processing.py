@@ -2,8 +2,18 @@ from __future__ import with_statement
 
 import hashlib
 import logging
+import mmap
+import os
+import shutil
 
-from models import Song
+from django.db import transaction
+
+from models import (Cluster, PlayHistory, PlaylistEntry, Song, add_log_scores,
+                    song_audio_path)
+from menclave.aenclave import artwork
+from menclave.aenclave import cooccurrence
+from menclave.aenclave import history
+from menclave.aenclave import jobs
 from mutagen.mp3 import MP3
 from mutagen.easyid3 import EasyID3
 from mutagen.mp4 import MP4
@@ -14,14 +24,38 @@ class BadContent(Exception):
     def __init__(self, extension):
         self.extension = extension
 
+# Read files for checksumming in big pieces; small reads are painfully slow
+# on network filesystems.
+MD5_BUFFER_SIZE = 1024 * 1024
+
 def md5sum(filename):
-    """Takes the md5sum of a given file."""
+    """Takes the md5sum of a given file.
+
+    The file is mmapped if possible, so it is hashed straight out of the page
+    cache without copying it through Python strings.
+    """
     m = hashlib.md5()
-    with open(filename, "r") as f:
-        bytes = f.read(4096)
-        while bytes != "":
-            m.update(bytes)
-            bytes = f.read(4096)
+    with open(filename, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        mapped = None
+        if size > 0:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (mmap.error, EnvironmentError, ValueError, OverflowError):
+                # Some filesystems can't be mapped, and big files may not fit
+                # in a 32-bit address space.  Fall back to reading.
+                mapped = None
+        if mapped is not None:
+            try:
+                for offset in xrange(0, size, MD5_BUFFER_SIZE):
+                    m.update(buffer(mapped, offset, MD5_BUFFER_SIZE))
+            finally:
+                mapped.close()
+        else:
+            bytes = f.read(MD5_BUFFER_SIZE)
+            while bytes != "":
+                m.update(bytes)
+                bytes = f.read(MD5_BUFFER_SIZE)
     return m.hexdigest()
 
 def valid_song(name):
@@ -32,8 +66,15 @@ def valid_song(name):
     ext = name.lower()[len(name)-3:]
     return ext in SUPPORTED_AUDIO
 
-def annotate_metadata(song):
-    path = song.audio.path
+def read_metadata(path):
+    """
+    Reads the tags of the audio file at path.  Returns a dict of the Song
+    fields they fill in, and the mutagen audio object, or None if mutagen
+    couldn't parse the file.
+
+    Mutagen only parses the tags and the header of the first frame, so this
+    is cheap compared to reading the whole file.
+    """
     audio = None
     info = {}
     ext = path.lower()[len(path)-3:]
@@ -107,12 +148,6 @@ def annotate_metadata(song):
     else:
         raise BadContent(ext)
 
-    song.title = info['title']
-    song.album = info['album']
-    song.artist = info['artist']
-    song.track = info['track']
-    song.time = info['time']
-
     if hasattr(audio, 'info') and not hasattr(audio.info, 'sketchy'):
         # Mutagen only checks mp3s for sketchiness
         audio.info.sketchy = False
@@ -120,30 +155,273 @@ def annotate_metadata(song):
     if audio == {}:
         audio = None
 
+    return (info, audio)
+
+# The Song fields that come from the file's tags.
+METADATA_FIELDS = ('title', 'album', 'artist', 'track', 'time')
+
+def annotate_metadata(song):
+    """
+    Fills in the song's fields from its file's tags.  Returns the mutagen
+    audio object, as read_metadata does.
+    """
+    path = song.audio.path
+    try:
+        stat = os.stat(path)
+        song.tags_size = stat.st_size
+        song.tags_mtime = int(stat.st_mtime)
+    except OSError:
+        pass
+    (info, audio) = read_metadata(path)
+    for field in METADATA_FIELDS:
+        setattr(song, field, info[field])
     return audio
 
-def annotate_checksum(song):
+def annotate_checksum(song, checksum=None):
+    """Record the song file's md5, computing it unless we already know it.
+
+    The file's size and mtime are recorded too, so that checksum_files knows
+    when it needs doing again.
+    """
     try:
-        song.filechecksum = md5sum(song.audio.path)
+        stat = os.stat(song.audio.path)
+        song.file_size = stat.st_size
+        song.file_mtime = int(stat.st_mtime)
+        if checksum:
+            song.filechecksum = checksum
+        else:
+            song.filechecksum = md5sum(song.audio.path)
     except Exception, e: 
         # This happens if the file doesn't exist, or some such.
-        song.filechecksum = ""
+        song.filechecksum = checksum or ""
 
-def process_song(name, content):
+def process_song(name, content, checksum=None):
     """
     Processes a song upload: saving it and reading the meta information
     returns the song object and mutagen audio object, or None if it couldn't
     parse the file.
+
+    Pass the file's md5 as checksum if it is already known, such as from
+    ChecksumUploadHandler, to avoid reading the whole file back.  If the song
+    is already in the library, the existing song is returned instead, and the
+    mutagen object may be None.
+
+    This does all the work inline; uploads from views should use stage_song
+    instead so that the slow parts happen in the background.
     """
 
     if not valid_song(name):
         raise BadContent(name)
 
+    if checksum:
+        original = find_duplicate(checksum)
+        if original is not None:
+            return (original, None)
+
     # Save the song into the database -- we'll fix the tags in a moment.
-    song = Song(track=0, time=0)
+    song = Song(track=0, time=0, filechecksum=checksum or '')
     song.audio.save(name, content)
     audio = annotate_metadata(song)
-    annotate_checksum(song)
+    annotate_checksum(song, checksum)
+    original = find_duplicate(song.filechecksum, song)
+    if original is not None:
+        discard_song(song)
+        return (original, audio)
+    relocate_song(song)
+    artwork.annotate_artwork(song)
     song.save()
 
     return (song, audio)
+
+def stage_song(name, content, owner=None, checksum=None):
+    """
+    Accepts a song upload: saves the file and queues an ingest job to read
+    the tags and checksum it in the background.
+
+    The song stays invisible until the job finishes.  Returns the song and
+    the ingest job, whose status can be polled.  As with process_song, pass
+    checksum if the file's md5 is already known.  In that case, if the song
+    is already in the library, nothing is stored and the existing song is
+    returned with no job.
+    """
+
+    if not valid_song(name):
+        raise BadContent(name)
+
+    if checksum:
+        original = find_duplicate(checksum)
+        if original is not None:
+            return (original, None)
+
+    song = _staged_song(name, checksum)
+    song.audio.save(name, content)
+    return (song, _enqueue_ingest(song, owner, checksum))
+
+def stage_song_file(name, path, owner=None):
+    """
+    Like stage_song, but for a file that is already on disk somewhere else.
+    The file is moved into the library rather than copied.
+    """
+
+    if not valid_song(name):
+        raise BadContent(name)
+
+    song = _staged_song(name, None)
+    storage = song.audio.storage
+    audio_name = song.audio.field.generate_filename(song, name)
+    audio_name = storage.get_available_name(audio_name)
+    audio_path = storage.path(audio_name)
+    directory = os.path.dirname(audio_path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    # Use shutil.move instead of os.rename to move across filesystems.
+    shutil.move(path, audio_path)
+    song.audio = audio_name
+    song.save()
+    return (song, _enqueue_ingest(song, owner, None))
+
+def _staged_song(name, checksum):
+    title = os.path.splitext(os.path.basename(name))[0]
+    return Song(title=title, track=0, time=0, visible=False,
+                filechecksum=checksum or '')
+
+def _enqueue_ingest(song, owner, checksum):
+    return jobs.enqueue('ingest', {'song_id': song.pk, 'checksum': checksum},
+                        key=str(song.pk), owner=owner)
+
+@jobs.handler('ingest')
+def ingest_song(job, song_id, checksum=None):
+    """The job handler that finishes what stage_song started."""
+    song = Song.objects.get(pk=song_id)
+    annotate_checksum(song, checksum)
+    original = find_duplicate(song.filechecksum, song)
+    if original is not None:
+        # Somebody beat us to it, so throw away our copy.
+        discard_song(song)
+        return _song_result(original, True, staged_song_id=song_id,
+                            duplicate=True)
+    audio = annotate_metadata(song)
+    relocate_song(song)
+    artwork.annotate_artwork(song)
+    song.visible = True
+    song.save()
+    if audio is None:
+        sketchy = True
+    else:
+        sketchy = audio.info.sketchy
+    return _song_result(song, sketchy, staged_song_id=song_id)
+
+def _song_result(song, sketchy, **extra):
+    result = {'song_id': song.pk,
+              'title': song.title,
+              'artist': song.artist,
+              'album': song.album,
+              'sketchy': sketchy}
+    result.update(extra)
+    return result
+
+#-------------------------------- Duplicates ---------------------------------#
+
+def find_duplicate(checksum, song=None):
+    """Find the song whose file has this checksum, other than song.
+
+    Visible songs win over hidden ones, and older songs over newer ones.
+    Returns None if there is no such song.
+    """
+    if not checksum:
+        return None
+    duplicates = Song.objects.filter(filechecksum=checksum)
+    if song is not None:
+        duplicates = duplicates.exclude(pk=song.pk)
+    for original in duplicates.order_by('-visible', 'id')[:1]:
+        return original
+    return None
+
+def discard_song(song):
+    """Delete a song that turned out to be a duplicate, along with its file.
+
+    The file is kept if another song still uses it.
+    """
+    name = song.audio.name
+    path = song.audio.path
+    # Clear the file so that Django doesn't try to delete it for us.
+    song.audio = None
+    song.delete()
+    if Song.objects.filter(audio=name).count() == 0 and os.path.exists(path):
+        os.remove(path)
+
+@transaction.commit_on_success
+def merge_duplicates(original, duplicates):
+    """Fold duplicate songs into the original and delete them.
+
+    Playlist entries, play history, clusters and co-occurrences are moved
+    over to the original, and the play and skip counts are added to its counts.
+    """
+    duplicate_ids = [song.pk for song in duplicates]
+    if not duplicate_ids:
+        return
+
+    # A playlist can't hold the same song twice, so if it already has the
+    # original (or another duplicate) we just drop the entry.
+    seen = set(PlaylistEntry.objects.filter(song=original)
+               .values_list('playlist', flat=True))
+    entries = (PlaylistEntry.objects.filter(song__in=duplicate_ids)
+               .order_by('playlist', 'position'))
+    for entry in entries:
+        if entry.playlist_id in seen:
+            entry.delete()
+        else:
+            seen.add(entry.playlist_id)
+            PlaylistEntry.objects.filter(pk=entry.pk).update(song=original)
+
+    PlayHistory.objects.filter(song__in=duplicate_ids).update(song=original)
+    cooccurrence.merge_songs(original.pk, duplicate_ids)
+    history.merge_songs(original.pk, duplicate_ids)
+    for cluster in Cluster.objects.filter(songs__in=duplicate_ids).distinct():
+        cluster.songs.remove(*duplicate_ids)
+        cluster.songs.add(original)
+
+    for song in duplicates:
+        original.play_count += song.play_count
+        original.skip_count += song.skip_count
+        original.score += song.score
+        original.hot_score = add_log_scores(original.hot_score,
+                                            song.hot_score)
+        if song.last_played and (not original.last_played or
+                                 song.last_played > original.last_played):
+            original.last_played = song.last_played
+        if song.last_queued and (not original.last_queued or
+                                 song.last_queued > original.last_queued):
+            original.last_queued = song.last_queued
+        discard_song(song)
+    original.save()
+
+def relocate_song(song):
+    """Move a checksummed song's file to its content addressed path.
+
+    This doesn't save the song.  If a file with the same contents is already
+    at that path, we use it instead.  Files are retagged in place, so the file
+    there may have changed since it was stored; then ours goes next to it
+    under another name.
+    """
+    if not song.filechecksum:
+        return
+    old_name = song.audio.name
+    new_name = song_audio_path(song.filechecksum, old_name)
+    if old_name == new_name:
+        return
+    storage = song.audio.storage
+    old_path = storage.path(old_name)
+    new_path = storage.path(new_name)
+    if os.path.exists(new_path):
+        if md5sum(new_path) == song.filechecksum:
+            os.remove(old_path)
+            song.audio.name = new_name
+            return
+        new_name = storage.get_available_name(new_name)
+        new_path = storage.path(new_name)
+    directory = os.path.dirname(new_path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    os.rename(old_path, new_path)
+    song.audio.name = new_name
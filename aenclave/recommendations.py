@@ -3,14 +3,18 @@ from django.template import RequestContext
 from menclave.aenclave.models import Song
 from menclave.aenclave.html import render_html_template
 
+from menclave.aenclave import bulk
+from menclave.aenclave import cooccurrence
+from menclave.aenclave import history
 from menclave.aenclave import utils
 from menclave.aenclave import json_response
 
 import django
 import django.conf
+from django.db import transaction
+from django.db.models import F
 from menclave.aenclave import models
 import datetime
-from operator import itemgetter
 
 # create one cluster entry.
 def create_cluster_entry(songlist):
@@ -20,7 +24,9 @@ def create_cluster_entry(songlist):
     cluster_entry.songs.add(*songlist)  # it gets mad because it expects 
 
 # populate the DB with clusters.
-# for now it's dumb and it just re-makes all of them.
+# for now it's dumb and it just re-makes all of them.  recommend() uses the
+# incrementally updated co-occurrences instead, so this is only run offline
+# (update_cooccurrences --clusters) to compare against.
 def make_clusters():
 
     # for now: clear all clusters (this should overwrite them)
@@ -33,107 +39,96 @@ def make_clusters():
         if len(pl) > 1:
             create_cluster_entry(pl)
    
-    # clusters from queue history
-    minute = datetime.timedelta(0,60)
-    this_cluster = []
-    play_history_objects = models.PlayHistory.objects.all().order_by(
-        'queued_time')
-
-    for i in range(0, len(play_history_objects)):
-        if i == 0:
-            continue
-        timediff = (play_history_objects[i].queued_time - 
-                    play_history_objects[i-1].queued_time)
-        if timediff <= minute:
-            if len(this_cluster) == 0:
-                this_cluster.append(play_history_objects[i-1].song)
-            this_cluster.append(play_history_objects[i].song)
-        else:
-            if len(this_cluster) > 1:
-                # create a new cluster
-                create_cluster_entry(this_cluster)
-            this_cluster = []
+    # clusters from queue history.  sessions only exist in the raw history;
+    # older plays have been rolled up into daily counts (see history.rollup),
+    # which say how popular songs were but not what was queued together.
+    # this streams the sessions rather than loading every row.
+    for (last_id, song_ids) in cooccurrence.history_sessions(
+            0, datetime.datetime.now()):
+        if len(set(song_ids)) > 1:
+            create_cluster_entry(list(set(song_ids)))
 
 # most recent cluster, i.e. whatever has been queued just now.
-# just returns a list; doesn't create a Cluster object.
+# just returns a list; doesn't create a Cluster object.  the session tracker
+# in history.py keeps it as songs are queued, so this doesn't scan anything.
 def get_latest_cluster(max_size):
-    res = []
-    play_history_objects = models.PlayHistory.objects
-    start_id = play_history_objects.count() - max_size
-    last_n = play_history_objects.filter(
-        id__gt=start_id).order_by('-queued_time')
-
-    minute = datetime.timedelta(0,60)
-    res.append(last_n[0]) # we always want the most recent one.
-    for i in range(0, len(last_n)-1):  # use [i+1] instead of [i-1] 
-        this_pho = last_n[i]
-        next_pho = last_n[i+1]
-        timediff = this_pho.queued_time - next_pho.queued_time
-        if timediff <= minute:
-            res.append(next_pho)
-        else:
-            break
-
-    res.reverse()
-    return [pho.song for pho in res]
-
-# in regular Python for now.
+    song_ids = history.current_session(max_size)
+    songs = Song.objects.in_bulk(song_ids)
+    return [songs[song_id] for song_id in song_ids if song_id in songs]
+
+# merge the precomputed neighbor lists of the songs in the cluster.
 def recommend(cluster,n):
-    related_clusters = []
-    recommendations = {}
-    for song in cluster:
-        related_clusters += models.Cluster.objects.filter(songs=song)
-    for rc in related_clusters:
-        for song in rc.songs.all():
-            recommendations[song] = rc.weight + recommendations.get(song,0)
-    reclist = sorted(recommendations.items(),
-                     key=itemgetter(1), reverse=True)
-    reclist = [rec[0] for rec in reclist if rec[0] not in cluster]
-    return reclist[:n]
+    return recommend_ids([song.id for song in cluster], n)
+
+def recommend_ids(song_ids,n):
+    # Ask for a few extra in case some of them are hidden.
+    reclist = cooccurrence.recommend_ids(song_ids, n * 2)
+    songs = Song.visibles.in_bulk(reclist)
+    return [songs[song_id] for song_id in reclist if song_id in songs][:n]
 
 def view_recommendations(request):
     form = request.REQUEST
     # Get the selected songs.
     #queued_songs = utils.get_song_list(form) # maybe better
-    queued_songs = get_latest_cluster(10) # than this bc. they're queued.
-    original_songs = ' '.join(str(song.id) for song in queued_songs)
-    recommended_songs = recommend(queued_songs, 10)
+    queued_ids = history.current_session(10) # than this bc. they're queued.
+    original_songs = ' '.join(str(song_id) for song_id in queued_ids)
+    recommended_songs = recommend_ids(queued_ids, 10)
     return render_html_template('aenclave/recommendations.html', request,
                                 {'song_list': recommended_songs,
                                  'original_songs': original_songs},
                                 context_instance=RequestContext(request))
 
 ## for 6.867 - Recommendations
+## feedback scales the pairs that connect the original songs to the
+## recommended ones: down when they're marked bad, up when they're queued.
+## co-occurrences keep it apart from their weights; see cooccurrence.py.
+BAD_FACTOR = 0.5
+GOOD_FACTOR = 2.0
+
+@transaction.commit_on_success
+def apply_feedback(request, kind, feedback_ids, original_ids, factor):
+    """Scale the clusters and co-occurrences linking the two sets of songs.
+
+    The clusters that hold both an original song and a feedback song are
+    found with one join, and updated with one UPDATE.  Each feedback song is
+    also recorded, with the songs it was recommended from, for evaluating
+    recommenders offline.
+    """
+    if feedback_ids and original_ids:
+        cluster_ids = list(models.Cluster.objects
+                           .filter(songs__in=original_ids)
+                           .filter(songs__in=feedback_ids)
+                           .values_list('id', flat=True).distinct())
+        if cluster_ids:
+            models.Cluster.objects.filter(pk__in=cluster_ids).update(
+                    weight=F('weight') * factor)
+        cooccurrence.scale_pairs(original_ids, feedback_ids, factor)
+
+    user_id = None
+    if request.user.is_authenticated():
+        user_id = request.user.id
+    seed_ids = ' '.join(str(song_id) for song_id in original_ids)
+    now = datetime.datetime.now()
+    bulk.insert_rows(models.RecommendationFeedback,
+                     ('kind', 'song', 'seed_ids', 'user', 'date'),
+                     [(kind, song_id, seed_ids, user_id, now)
+                      for song_id in feedback_ids])
+
+def _existing_song_ids(form, key):
+    ids = utils.get_int_list(form, key)
+    return list(Song.objects.filter(pk__in=ids).values_list('id', flat=True))
+
 ## this is what happens when a user marks some recommended songs as bad.
 def bad_recommendations(request):
     form = request.REQUEST
     # get songs that were marked as bad
-    bad_songs = utils.get_song_list(form, key='bad_songs')
+    bad_ids = _existing_song_ids(form, 'bad_songs')
     # get the original set of songs that were queued
-    original_songs = utils.get_song_list(form, key='original_songs')
-    # find the clusters that the two song lists have in common
-    # and decrease their weights accordingly.
-    related_clusters = []
-    for song in original_songs:
-        related_clusters += models.Cluster.objects.filter(songs=song)
-    # now keep only those clusters that contain some song in bad_songs....
-    bad_related_clusters = []
-    for rc in related_clusters:
-        for song in bad_songs:
-            if song in rc.songs.all():
-                bad_related_clusters.append(rc)
-                break # we've already counted it more than once if necessary
-    # WOW, THAT WAS A REALLY DUMB WAY TO DO IT.
-    # TODO FIX THIS.
-    # also TODO make this separate because we have to do this same thing
-    # when boosting songs that did well.
-
-    for brc in bad_related_clusters:
-        brc.weight = brc.weight * 0.5
-        brc.save()
+    original_ids = _existing_song_ids(form, 'original_songs')
+    apply_feedback(request, 'bad', bad_ids, original_ids, BAD_FACTOR)
 
     # record the data
-    bad_rec_entry = models.BadRecs(bad_recs=len(bad_songs))
+    bad_rec_entry = models.BadRecs(bad_recs=len(bad_ids))
     bad_rec_entry.save()
 
     # Songs get removed from the table on the page.
@@ -143,28 +138,12 @@ def bad_recommendations(request):
 ## (score for common cluster gets boosted)
 def good_recommendations(request):
     form = request.REQUEST
-    good_songs = utils.get_song_list(form)
-    original_songs = utils.get_song_list(form, key='original_songs')
-    
-    related_clusters = []
-    for song in original_songs:
-        related_clusters += models.Cluster.objects.filter(songs=song)
-
-    good_related_clusters = []
-    for rc in related_clusters:
-        for song in good_songs:
-            if song in rc.songs.all():
-                good_related_clusters.append(rc)
-                break # we've already counted it more than once if necessary
-
-    for grc in good_related_clusters:
-        grc.weight = brc.weight * 2
-        grc.save()
+    good_ids = _existing_song_ids(form, 'ids')
+    original_ids = _existing_song_ids(form, 'original_songs')
+    apply_feedback(request, 'good', good_ids, original_ids, GOOD_FACTOR)
 
     # record data
-    good_rec_entry = models.GoodRecs(good_recs=len(good_songs))
+    good_rec_entry = models.GoodRecs(good_recs=len(good_ids))
     good_rec_entry.save()
 
     return json_response.json_success("Yay!!!") # mostly for consistency.
-    # not 100% sure this actually works....
-    # TODO test it more.
@@ -0,0 +1,202 @@
+// chunkupload -- resumable uploads that are sent to the server in chunks
+
+var chunkupload = {
+
+  // How many chunks of a file to send at once.
+  PARALLEL_CHUNKS: 3,
+
+  // How many times to retry a chunk before giving up on the file.
+  MAX_RETRIES: 5,
+
+  queue: [],
+  uploading: false,
+  next_id: 0,
+  files_uploaded: 0,
+
+  // Whether the browser can read slices of files and send them.
+  supported: function() {
+    return !!(window.File && window.Blob && window.JSON &&
+              (Blob.prototype.slice || Blob.prototype.webkitSlice ||
+               Blob.prototype.mozSlice));
+  },
+
+  _slice: function(file, start, end) {
+    var slice = file.slice || file.webkitSlice || file.mozSlice;
+    return slice.call(file, start, end);
+  },
+
+  // Queue the files picked in a file input.  Files are uploaded one at a
+  // time, with several chunks of each in flight.
+  add_files: function(files) {
+    for (var i = 0; i < files.length; i++) {
+      var file = files[i];
+      var progress = new FileProgress({id: 'upload-' + chunkupload.next_id++,
+                                       name: file.name}, 'songlist');
+      progress.setStatus('Pending...');
+      chunkupload.queue.push({file: file, progress: progress,
+                              cancelled: false});
+      chunkupload._set_cancel(chunkupload.queue[chunkupload.queue.length - 1]);
+    }
+    chunkupload._next_file();
+  },
+
+  _set_cancel: function(item) {
+    item.progress.toggleCancel(true, {cancelUpload: function() {
+      item.cancelled = true;
+      item.progress.setStatus('Cancelled');
+      item.progress.setCancelled();
+      item.progress.toggleCancel(false);
+    }});
+  },
+
+  _next_file: function() {
+    if (chunkupload.uploading) return;
+    var item = chunkupload.queue.shift();
+    while (item && item.cancelled) {
+      item = chunkupload.queue.shift();
+    }
+    if (!item) return;
+    chunkupload.uploading = true;
+    chunkupload._start(item, function() {
+      chunkupload.uploading = false;
+      chunkupload._next_file();
+    });
+  },
+
+  _fail: function(item, message, done) {
+    item.progress.setError();
+    item.progress.setStatus(message);
+    item.progress.toggleCancel(false);
+    done();
+  },
+
+  // Start the upload, or pick it up where it left off.
+  _start: function(item, done) {
+    var file = item.file;
+    item.progress.setStatus('Starting...');
+    jQuery.ajax({
+      type: 'POST',
+      url: '/audio/upload/chunked/start/',
+      data: {filename: file.name,
+             size: file.size,
+             key: [file.name, file.size, file.lastModified].join(':')},
+      dataType: 'json',
+      success: function(upload) {
+        if (upload.error) {
+          chunkupload._fail(item, upload.error, done);
+        } else {
+          chunkupload._send_chunks(item, upload, done);
+        }
+      },
+      error: function() {
+        chunkupload._fail(item, 'Could not start the upload.', done);
+      }
+    });
+  },
+
+  _send_chunks: function(item, upload, done) {
+    var base_url = '/audio/upload/chunked/' + upload.token + '/';
+    var received = {};
+    for (var i = 0; i < upload.received.length; i++) {
+      received[upload.received[i]] = true;
+    }
+    var pending = [];
+    for (var n = 0; n < upload.chunk_count; n++) {
+      if (!received[n]) pending.push(n);
+    }
+    var sent = upload.chunk_count - pending.length;
+    var in_flight = 0;
+    var failed = false;
+
+    var next = function() {
+      if (failed) return;
+      if (item.cancelled) {
+        failed = true;
+        return done();
+      }
+      if (pending.length == 0 && in_flight == 0) {
+        return chunkupload._finish(item, base_url, done);
+      }
+      while (in_flight < chunkupload.PARALLEL_CHUNKS && pending.length > 0) {
+        send(pending.shift(), 0);
+      }
+    };
+
+    var send = function(number, tries) {
+      in_flight++;
+      var start = number * upload.chunk_size;
+      var end = Math.min(start + upload.chunk_size, item.file.size);
+      var xhr = new XMLHttpRequest();
+      xhr.open('PUT', base_url + number + '/', true);
+      xhr.onreadystatechange = function() {
+        if (xhr.readyState != 4) return;
+        var response = null;
+        try {
+          response = JSON.parse(xhr.responseText);
+        } catch (e) {}
+        if (xhr.status == 200 && response && !response.error) {
+          in_flight--;
+          sent++;
+          item.progress.setProgress(Math.ceil(100 * sent / upload.chunk_count));
+          item.progress.setStatus('Uploading...');
+          next();
+        } else if (tries < chunkupload.MAX_RETRIES && !item.cancelled) {
+          // Back off a little and send it again.  The chunk stays in flight
+          // so we don't finish while it's waiting.
+          window.setTimeout(function() {
+            in_flight--;
+            send(number, tries + 1);
+          }, 1000 * (tries + 1));
+        } else {
+          in_flight--;
+          if (!failed) {
+            failed = true;
+            var message = (response && response.error) || 'Upload failed.';
+            chunkupload._fail(item, message, done);
+          }
+        }
+      };
+      xhr.send(chunkupload._slice(item.file, start, end));
+    };
+
+    if (upload.received.length > 0) {
+      item.progress.setStatus('Resuming...');
+    }
+    next();
+  },
+
+  _finish: function(item, base_url, done) {
+    item.progress.setStatus('Finishing...');
+    jQuery.ajax({
+      type: 'POST',
+      url: base_url + 'finish/',
+      dataType: 'json',
+      success: function(response) {
+        if (response.error) {
+          return chunkupload._fail(item, response.error, done);
+        }
+        item.progress.setComplete();
+        item.progress.setStatus('Complete.');
+        item.progress.toggleCancel(false);
+        chunkupload.files_uploaded++;
+        var count = chunkupload.files_uploaded;
+        jQuery('#divStatus').text(count + ' file' + pluralize(count) +
+                                  ' uploaded.');
+
+        // Insert the new row into the songlist, and fill in its tags once
+        // the server has read them.
+        songlist.insert_row(jQuery('<tr>' + response.row + '</tr>'));
+        jobs.poll([response.job], function(infos) {
+          if (infos.length && infos[0].status == 'done') {
+            jobs.update_song_row(infos[0].result);
+          }
+        });
+        done();
+      },
+      error: function() {
+        chunkupload._fail(item, 'Could not finish the upload.', done);
+      }
+    });
+  }
+
+};
@@ -0,0 +1,108 @@
+// jobs -- functions for following background jobs, like upload ingestion
+
+var jobs = {
+
+  // Poll the status of the jobs with the given ids until they have all
+  // finished.  on_update is called with the list of job infos after every
+  // poll.
+  poll: function(ids, on_update, opt_seconds) {
+    var seconds = opt_seconds || 2;
+    var pending = ids;
+    var check = function() {
+      jQuery.ajax({
+        url: '/audio/json/jobs/',
+        data: {ids: pending.join(' ')},
+        dataType: 'json',
+        success: function(response_json) {
+          var still_pending = [];
+          var infos = response_json.jobs;
+          for (var i = 0; i < infos.length; i++) {
+            var status = infos[i].status;
+            if (status == 'queued' || status == 'running') {
+              still_pending.push(infos[i].id);
+            }
+          }
+          on_update(infos);
+          pending = still_pending;
+          if (pending.length > 0) {
+            window.setTimeout(check, seconds * 1000);
+          }
+        },
+        error: function() {
+          // Try again later; the server may just be busy.
+          window.setTimeout(check, seconds * 4 * 1000);
+        }
+      });
+    };
+    if (pending.length > 0) {
+      check();
+    }
+  },
+
+  // Fill in the tags of an uploaded song's row once its ingest job is done.
+  // If the upload turned out to be a duplicate, the row is pointed at the
+  // song that was already in the library.
+  update_song_row: function(result) {
+    var staged_id = result.staged_song_id || result.song_id;
+    var checkbox = jQuery('input.song_selected[name=' + staged_id + ']');
+    checkbox.attr('name', result.song_id);
+    var row = checkbox.parents('tr');
+    var fields = ['title', 'album', 'artist'];
+    for (var i = 0; i < fields.length; i++) {
+      var cell = row.find('td[name=' + fields[i] + ']');
+      var link = cell.find('a');
+      (link.length ? link : cell).text(result[fields[i]]);
+    }
+  },
+
+  // Follow the ingest jobs of an upload, updating the song rows, the status
+  // line with id 'ingest-status', and the warning with id 'sketchy-warning'.
+  watch_uploads: function(ids) {
+    ids = jQuery.grep(ids, function(id) { return id != ''; });
+    var total = ids.length;
+    jobs.poll(ids, function(infos) {
+      var finished = 0;
+      var failed = 0;
+      for (var i = 0; i < infos.length; i++) {
+        var info = infos[i];
+        if (info.status == 'done') {
+          finished++;
+          jobs.update_song_row(info.result);
+          if (info.result.sketchy) {
+            jQuery('#sketchy-warning').show();
+          }
+        } else if (info.status == 'failed') {
+          failed++;
+        }
+      }
+      var text = 'Processed ' + finished + ' of ' + total + ' song' +
+          pluralize(total) + '.';
+      if (failed > 0) {
+        text += ' ' + failed + ' failed.';
+      }
+      jQuery('#ingest-status').text(text);
+    });
+  },
+
+  // Follow a YouTube rip job, updating the progress bar with id
+  // 'rip-progress' and the status line with id 'rip-status', and go to the
+  // new song's page once it's done.
+  watch_rip: function(id) {
+    jobs.poll([id], function(infos) {
+      if (!infos.length) return;
+      var info = infos[0];
+      if (info.status == 'done') {
+        window.location = info.result.url;
+      } else if (info.status == 'failed') {
+        jQuery('#rip-status').text('Ripping failed: ' + info.message);
+      } else if (info.status == 'queued') {
+        jQuery('#rip-status').text('Waiting for a free worker...');
+      } else {
+        jQuery('#rip-progress').css('width',
+                                    Math.round(100 * info.progress) + '%');
+        jQuery('#rip-status').text(info.message || 'Starting...');
+      }
+    }, 1);
+  }
+
+};
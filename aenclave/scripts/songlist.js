@@ -245,7 +245,7 @@ var songlist = {
     var options = {
       type: 'post',
       dataType: 'json',
-      url: link.href + "&getupdate=1",
+      url: link.href + "&getupdate=1" + songlist._original_songs_param(),
       error: function(transport) {
         para.innerHTML = 'failed to queue.';
       },
@@ -275,8 +275,14 @@ var songlist = {
   queue: function() {
     var ids = songlist.gather_ids(true); // true -> queue nothing if nothing
     if (ids.length > 0) {                //         is selected
-      document.forms.queueform.ids.value = ids;
-      document.forms.queueform.submit();
+      var form = document.forms.queueform;
+      form.ids.value = ids;
+      if (songlist.original_songs && !form.original_songs) {
+        // Tell the server what these were recommended from.
+        jQuery(form).append(jQuery('<input type="hidden" name="original_songs"/>')
+                            .val(songlist.original_songs));
+      }
+      form.submit();
     } else {
       songlist.error_message("You haven't selected any songs.");
     }
@@ -393,6 +399,11 @@ var songlist = {
   },
 
   // For 6.867 / recommendations:
+  _original_songs_param: function() {
+    if (!songlist.original_songs) return '';
+    return '&original_songs=' + encodeURIComponent(songlist.original_songs);
+  },
+
   report_bad_recs: function() {
     // *****
     var ids = songlist.gather_ids(true); // true -> queue nothing if nothing
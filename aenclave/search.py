@@ -227,5 +227,6 @@ def filter_search(request):
     queryset = Song.annotate_favorited(queryset, request.user)
     return render_html_template('aenclave/filter_results.html', request,
                                 {'song_list':queryset[:500],
-                                 'criterion_count':total},
+                                 'criterion_count':total,
+                                 'filter_query':request.GET.urlencode()},
                                 context_instance=RequestContext(request))
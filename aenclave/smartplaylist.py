@@ -0,0 +1,229 @@
+# menclave/aenclave/smartplaylist.py
+
+"""Smart playlists: saved filter searches whose results are kept as entries.
+
+A smart playlist is an ordinary Playlist plus a SmartPlaylist row holding the
+filter search's query string.  Its songs are materialized in PlaylistEntry,
+so opening it is no different from opening any other playlist.  Rather than
+re-running the filter, membership is re-checked for just the songs that
+changed:
+
+    - Song.save() and the player's play_touch and skip_touch queue a
+      recheck_smart_playlists job for their song,
+    - bulk edits queue one for the songs they touched, and
+    - sweep() refreshes the playlists with rules relative to now, like
+      'added in the last week', whose results change as time passes.  Run it
+      from cron with the sweep_smart_playlists command.
+
+New matches are appended to the end of the playlist, and songs that stop
+matching are removed.  Since a refresh would undo them, the playlist views
+refuse to add, remove or reorder a smart playlist's songs by hand.
+
+refresh() and recheck_songs() don't manage transactions, so that they can
+run inside their callers'.
+"""
+
+import datetime
+
+from django.db import transaction
+from django.http import HttpResponseRedirect, QueryDict
+
+from menclave.login import permission_required
+from menclave.aenclave.html import html_error
+from menclave.aenclave.models import (Playlist, PlaylistEntry, SmartPlaylist,
+                                      Song)
+from menclave.aenclave.utils import get_unicode
+from menclave.aenclave import bulk
+from menclave.aenclave import jobs
+from menclave.aenclave import search
+
+# Look up this many songs per query.
+QUERY_CHUNK = 500
+
+class FilterError(Exception):
+    """The query string isn't a usable filter search."""
+    pass
+
+#--------------------------------- Filters ----------------------------------#
+
+def filter_tree(query_string):
+    """Parse a filter search query string into a tree for _build_filter_query.
+
+    Raises FilterError if the query string is malformed or has no criteria.
+    """
+    form = QueryDict(query_string.encode('utf-8'))
+    try:
+        (tree, total, errors) = search._build_filter_tree(form, 'k')
+    except KeyError, err:
+        raise FilterError(str(err))
+    if errors:
+        raise FilterError(', '.join(errors))
+    if not total:
+        raise FilterError('No criteria were given.')
+    return tree
+
+def is_relative(tree):
+    """Return whether a filter tree has rules relative to now."""
+    (kind, rule, data) = tree
+    if kind == 'sub':
+        for subtree in data:
+            if is_relative(subtree):
+                return True
+        return False
+    return rule in ('last', 'nolast')
+
+def _filter_query(smart):
+    return search._build_filter_query(filter_tree(smart.query))
+
+#-------------------------------- Membership --------------------------------#
+
+def _add_members(playlist_id, song_ids):
+    if not song_ids:
+        return
+    positions = (PlaylistEntry.objects.filter(playlist=playlist_id)
+                 .order_by('-position').values_list('position', flat=True))
+    start = 0
+    for position in positions[:1]:
+        start = position + 1
+    bulk.insert_rows(PlaylistEntry, ('playlist', 'song', 'position'),
+                     [(playlist_id, song_id, start + i)
+                      for (i, song_id) in enumerate(song_ids)])
+
+def _remove_members(playlist_id, song_ids):
+    song_ids = list(song_ids)
+    entry_ids = []
+    for i in xrange(0, len(song_ids), QUERY_CHUNK):
+        entries = PlaylistEntry.objects.filter(
+                playlist=playlist_id, song__in=song_ids[i:i+QUERY_CHUNK])
+        entry_ids.extend(entries.values_list('id', flat=True))
+    bulk.delete_rows(PlaylistEntry, entry_ids)
+
+def _update_members(smart, matching, current):
+    """Make the playlist's songs among those checked match the filter.
+
+    matching is the list of checked song ids that match, in playlist order,
+    and current is the set of checked song ids that are in the playlist.
+    Returns whether anything changed.
+    """
+    removed = current.difference(matching)
+    added = [song_id for song_id in matching if song_id not in current]
+    if not removed and not added:
+        return False
+    _remove_members(smart.playlist_id, removed)
+    _add_members(smart.playlist_id, added)
+    smart.playlist.touch()
+    return True
+
+def refresh(smart):
+    """Re-run a smart playlist's filter over the whole library.
+
+    Returns whether its songs changed.
+    """
+    matching = list(Song.visibles.filter(_filter_query(smart))
+                    .values_list('id', flat=True))
+    current = set(PlaylistEntry.objects.filter(playlist=smart.playlist_id)
+                  .values_list('song', flat=True))
+    changed = _update_members(smart, matching, current)
+    smart.last_refreshed = datetime.datetime.now()
+    SmartPlaylist.objects.filter(pk=smart.pk).update(
+            last_refreshed=smart.last_refreshed)
+    return changed
+
+def recheck_songs(song_ids):
+    """Re-check just these songs against every smart playlist.
+
+    This costs two queries per smart playlist per QUERY_CHUNK songs, however
+    big the library or the playlists are.
+    """
+    song_ids = list(set(song_ids))
+    if not song_ids:
+        return
+    for smart in SmartPlaylist.objects.all():
+        try:
+            query = _filter_query(smart)
+        except FilterError:
+            continue
+        for i in xrange(0, len(song_ids), QUERY_CHUNK):
+            chunk = song_ids[i:i+QUERY_CHUNK]
+            matching = list(Song.visibles.filter(pk__in=chunk).filter(query)
+                            .values_list('id', flat=True))
+            current = set(PlaylistEntry.objects
+                          .filter(playlist=smart.playlist_id, song__in=chunk)
+                          .values_list('song', flat=True))
+            _update_members(smart, matching, current)
+
+def queue_recheck(song_ids):
+    """Queue a job to re-check songs, unless there are no smart playlists.
+
+    Songs are saved all over the place, so the work is kept out of the
+    request or the player.  Jobs that haven't started yet are reused.
+    """
+    song_ids = sorted(set(song_ids))
+    if not song_ids or not SmartPlaylist.objects.count():
+        return
+    key = ''
+    if len(song_ids) == 1:
+        key = str(song_ids[0])
+    jobs.enqueue('recheck_smart_playlists', {'song_ids': song_ids}, key=key,
+                 coalesce=True, coalesce_running=False)
+
+@jobs.handler('recheck_smart_playlists')
+@transaction.commit_on_success
+def recheck_job(job, song_ids):
+    """The job handler that runs recheck_songs()."""
+    recheck_songs(song_ids)
+    return {'songs': len(song_ids)}
+
+def sweep(everything=False):
+    """Refresh the smart playlists with rules relative to now.
+
+    If everything is true, refresh all of them, say after the tags of many
+    songs were changed in bulk.  Returns how many playlists changed.
+    """
+    smarts = SmartPlaylist.objects.all()
+    if not everything:
+        smarts = smarts.filter(relative=True)
+    changed = 0
+    for smart in smarts:
+        try:
+            if transaction.commit_on_success(refresh)(smart):
+                changed += 1
+        except FilterError:
+            pass
+    return changed
+
+@jobs.handler('sweep_smart_playlists')
+def sweep_job(job, everything=False):
+    """The job handler that runs sweep()."""
+    return {'changed': sweep(everything)}
+
+@transaction.commit_on_success
+def create(owner, name, query_string):
+    """Save a filter search as a new smart playlist and fill it.
+
+    Raises FilterError if the query string isn't a usable filter.
+    """
+    tree = filter_tree(query_string)
+    playlist = Playlist(name=name, owner=owner)
+    playlist.save()
+    smart = SmartPlaylist(playlist=playlist, query=query_string,
+                          relative=is_relative(tree))
+    smart.save()
+    refresh(smart)
+    return smart
+
+#----------------------------------- Views -----------------------------------#
+
+@permission_required('aenclave.add_playlist', 'Make Playlist')
+def create_smart_playlist(request):
+    form = request.POST
+    name = get_unicode(form, 'name')
+    if not name:
+        return html_error(request, 'No name provided.')
+    if Playlist.objects.filter(name=name, owner=request.user).count():
+        return html_error(request, 'A playlist of that name already exists.')
+    try:
+        smart = create(request.user, name, get_unicode(form, 'query', u''))
+    except FilterError, err:
+        return html_error(request, str(err))
+    return HttpResponseRedirect(smart.playlist.get_absolute_url())
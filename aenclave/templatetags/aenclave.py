@@ -4,6 +4,8 @@ import datetime
 
 from django import template
 
+from menclave.aenclave import artwork
+
 register = template.Library()
 
 #=============================================================================#
@@ -102,3 +104,10 @@ def groups_of(value, arg=1):
     return result_list
 
 #=============================================================================#
+
+@register.filter
+def art_url(song, size):
+    """Returns the URL of the song's album art thumbnail of the given size, or
+    the empty string if it has none."""
+    try: return artwork.art_url(song, int(size))
+    except (TypeError, ValueError): return ''
@@ -0,0 +1,497 @@
+# menclave/aenclave/tests.py
+
+"""Tests for audio-enclave.  Run them with 'manage.py test aenclave'.
+
+Song files are written to a scratch directory that stands in for MEDIA_ROOT,
+and which is removed after each test.
+"""
+
+import datetime
+import hashlib
+from math import log
+import os
+import shutil
+import sys
+import tempfile
+from StringIO import StringIO
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management import call_command
+from django.http import HttpRequest
+from django.test import TestCase
+from django.utils.http import http_date
+
+from menclave.aenclave.models import (CoOccurrence, Job, PlaylistEntry, Song,
+                                      SongNeighbors,
+                                      Upload, song_audio_path)
+from menclave.aenclave import artwork
+from menclave.aenclave import chunkupload
+from menclave.aenclave import cooccurrence
+from menclave.aenclave import download
+from menclave.aenclave import evaluation
+from menclave.aenclave import jobs
+from menclave.aenclave import models
+from menclave.aenclave import library_scan
+from menclave.aenclave import playlist
+from menclave.aenclave import processing
+from menclave.aenclave import smartplaylist
+
+class SongFileTestCase(TestCase):
+
+    """A TestCase that can make songs with real files."""
+
+    def setUp(self):
+        self.storage = Song._meta.get_field('audio').storage
+        self.old_location = self.storage.location
+        self.scratch = tempfile.mkdtemp(prefix='aenclave-test-')
+        self.storage.location = self.scratch
+
+    def tearDown(self):
+        self.storage.location = self.old_location
+        shutil.rmtree(self.scratch, ignore_errors=True)
+
+    def write_file(self, name, data):
+        """Write a file into storage and return its name.
+
+        Unicode names are written in UTF-8, as on most servers.
+        """
+        path = self.storage.path(name)
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        f = open(path, 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        return name
+
+    def read_file(self, name):
+        f = open(self.storage.path(name), 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def make_song(self, filename, data, checksum='', **fields):
+        name = self.write_file('aenclave/songs/' + filename, data)
+        values = {'title': filename, 'album': 'Album', 'artist': 'Artist',
+                  'track': 1, 'time': 60}
+        values.update(fields)
+        song = Song(audio=name, filechecksum=checksum, **values)
+        song.save()
+        return song
+
+    def run_command(self, *args, **options):
+        """Run a management command and return what it printed."""
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            call_command(*args, **options)
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+def md5(data):
+    return hashlib.md5(data).hexdigest()
+
+#------------------------------ checksum_files ------------------------------#
+
+class ChecksumFilesTest(SongFileTestCase):
+
+    def checksum_files(self, **options):
+        options.setdefault('processes', 2)
+        options.setdefault('checkpoint',
+                           os.path.join(self.scratch, 'checkpoint'))
+        return self.run_command('checksum_files', **options)
+
+    def test_unchanged_file_is_skipped(self):
+        song = self.make_song('same.mp3', 'same', md5('same'))
+        self.checksum_files()
+        stat = os.stat(song.audio.path)
+        song = Song.objects.get(pk=song.pk)
+        self.assertEqual(song.filechecksum, md5('same'))
+        self.assertEqual(song.file_size, stat.st_size)
+        # A second run finds nothing to do.
+        output = self.checksum_files()
+        self.assert_('checksummed 0 of 1' in output, output)
+
+    def test_changed_file_is_relocated(self):
+        song = self.make_song('changed.mp3', 'new contents', 'stale')
+        old_path = song.audio.path
+        self.checksum_files()
+        song = Song.objects.get(pk=song.pk)
+        self.assertEqual(song.filechecksum, md5('new contents'))
+        self.assert_(song.audio.name.endswith(md5('new contents') + '.mp3'))
+        self.assert_(os.path.exists(song.audio.path))
+        self.failIf(os.path.exists(old_path))
+
+    def test_missing_file_keeps_checksum(self):
+        song = self.make_song('missing.mp3', 'gone', 'kept')
+        os.remove(song.audio.path)
+        output = self.checksum_files(force=True)
+        self.assert_('songs #%d' % song.pk in output, output)
+        self.assertEqual(Song.objects.get(pk=song.pk).filechecksum, 'kept')
+
+#------------------------------- Relocation --------------------------------#
+
+class RelocateSongTest(SongFileTestCase):
+
+    def test_same_contents_are_shared(self):
+        original = self.make_song('original.mp3', 'x', md5('x'))
+        processing.relocate_song(original)
+        original.save()
+        song = self.make_song('copy.mp3', 'x', md5('x'))
+        processing.relocate_song(song)
+        self.assertEqual(song.audio.name, original.audio.name)
+        copy_path = self.storage.path('aenclave/songs/copy.mp3')
+        self.failIf(os.path.exists(copy_path))
+
+    def test_retagged_file_is_not_reused(self):
+        # A retag leaves the file at the path of its old contents.
+        path = song_audio_path(md5('x'), 'original.mp3')
+        self.write_file(path, 'retagged')
+        retagged = Song(title='Retagged', album='', artist='', track=0,
+                        time=0, audio=path, filechecksum=md5('retagged'))
+        retagged.save()
+        song = self.make_song('upload.mp3', 'x', md5('x'))
+        processing.relocate_song(song)
+        self.assertNotEqual(song.audio.name, path)
+        self.assertEqual(self.read_file(song.audio.name), 'x')
+        self.assertEqual(self.read_file(path), 'retagged')
+
+#------------------------------ Library scans -------------------------------#
+
+class LibraryScanTest(SongFileTestCase):
+
+    def setUp(self):
+        super(LibraryScanTest, self).setUp()
+        self.present = self.make_song(u'caf\xe9.mp3', 'present')
+        self.gone = self.make_song('gone.mp3', 'gone')
+        os.remove(self.gone.audio.path)
+        self.orphan = self.write_file('aenclave/songs/orphan.mp3', 'orphan')
+
+    def test_scan(self):
+        result = library_scan.scan()
+        self.assertEqual(result.missing,
+                         [(self.gone.pk, self.gone.audio.name)])
+        self.assertEqual(result.orphans, [self.orphan])
+
+    def test_delete_missing(self):
+        self.run_command('delete_missing', delete=True)
+        pks = set(Song.objects.values_list('id', flat=True))
+        self.assertEqual(pks, set([self.present.pk]))
+
+#-------------------------------- Hot scores --------------------------------#
+
+class HotScoreTest(SongFileTestCase):
+
+    def setUp(self):
+        super(HotScoreTest, self).setUp()
+        self.song = self.make_song('hot.mp3', 'hot')
+        self.when = datetime.datetime(2011, 1, 1)
+        self.amount = (log(models.PLAY_SCORE) +
+                       models.log_score_weight(self.when))
+
+    def hot_score(self):
+        return Song.objects.get(pk=self.song.pk).hot_score
+
+    def test_scores_add(self):
+        models.add_hot_score(self.song.pk, self.amount)
+        self.assertAlmostEqual(self.hot_score(), self.amount)
+        models.add_hot_score(self.song.pk, self.amount)
+        self.assertAlmostEqual(self.hot_score(), self.amount + log(2))
+
+    def test_play_touch(self):
+        self.song.play_touch()
+        self.assert_(self.hot_score() > models.NO_SCORE)
+        self.assertAlmostEqual(self.song.hot_score, self.hot_score())
+        self.assertEqual(Song.objects.get(pk=self.song.pk).play_count, 1)
+
+    def test_gives_up_on_mismatched_reads(self):
+        # Pretend that the score we read never matches the stored one.
+        tolerance = models.SCORE_TOLERANCE
+        models.SCORE_TOLERANCE = -1.0
+        try:
+            models.add_hot_score(self.song.pk, self.amount)
+            models.add_hot_score(self.song.pk, self.amount)
+        finally:
+            models.SCORE_TOLERANCE = tolerance
+        self.assertAlmostEqual(self.hot_score(), self.amount + log(2))
+
+#----------------------------------- Jobs -----------------------------------#
+
+class JobTest(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', 'alice@example.com')
+        self.bob = User.objects.create_user('bob', 'bob@example.com')
+
+    def start(self, job, started):
+        Job.objects.filter(pk=job.pk).update(status='running',
+                                             date_started=started)
+
+    def test_coalesce(self):
+        job = jobs.enqueue('rip', key='video', owner=self.alice, coalesce=True)
+        self.start(job, datetime.datetime.now())
+        again = jobs.enqueue('rip', key='video', owner=self.alice,
+                             coalesce=True)
+        self.assertEqual(again.pk, job.pk)
+        # Other users get their own job, which they can poll.
+        other = jobs.enqueue('rip', key='video', owner=self.bob, coalesce=True)
+        self.assertNotEqual(other.pk, job.pk)
+
+    def test_stale_jobs_are_not_coalesced(self):
+        job = jobs.enqueue('rip', key='video', coalesce=True)
+        self.start(job, jobs.stale_cutoff() - datetime.timedelta(1))
+        again = jobs.enqueue('rip', key='video', coalesce=True)
+        self.assertNotEqual(again.pk, job.pk)
+
+    def test_fail_stale(self):
+        stale = jobs.enqueue('rip', key='stale')
+        self.start(stale, jobs.stale_cutoff() - datetime.timedelta(1))
+        fresh = jobs.enqueue('rip', key='fresh')
+        self.start(fresh, datetime.datetime.now())
+        self.assertEqual(jobs.fail_stale(), 1)
+        self.assertEqual(Job.objects.get(pk=stale.pk).status, 'failed')
+        self.assertEqual(Job.objects.get(pk=fresh.pk).status, 'running')
+
+    def test_visible_to(self):
+        mine = jobs.enqueue('rip', owner=self.alice)
+        anyones = jobs.enqueue('rip')
+        self.assert_(jobs.visible_to(mine, self.alice))
+        self.failIf(jobs.visible_to(mine, self.bob))
+        self.failIf(jobs.visible_to(mine, AnonymousUser()))
+        self.assert_(jobs.visible_to(anyones, self.bob))
+
+#------------------------------ Co-occurrences ------------------------------#
+
+class CoOccurrenceTest(SongFileTestCase):
+
+    def setUp(self):
+        super(CoOccurrenceTest, self).setUp()
+        self.a = self.make_song('a.mp3', 'a').pk
+        self.b = self.make_song('b.mp3', 'b').pk
+
+    def add(self, sign=1):
+        deltas = {}
+        cooccurrence.add_group(deltas, [self.a, self.b], sign)
+        cooccurrence.apply_deltas(deltas)
+
+    def neighbors(self, song_id):
+        text = SongNeighbors.objects.get(song=song_id).neighbors
+        return list(cooccurrence._parse_neighbors(text))
+
+    def test_feedback_scales_neighbors(self):
+        self.add()
+        cooccurrence.scale_pairs([self.a], [self.b], 0.5)
+        pair = CoOccurrence.objects.get()
+        self.assertEqual((pair.weight, pair.feedback), (50.0, 0.5))
+        self.assertEqual(self.neighbors(self.a), [(self.b, 25.0)])
+
+    def test_subtracting_after_feedback(self):
+        # A playlist is counted twice, then one copy is removed again.
+        self.add()
+        self.add()
+        cooccurrence.scale_pairs([self.a], [self.b], 0.5)
+        self.add(-1)
+        pair = CoOccurrence.objects.get()
+        self.assertEqual((pair.weight, pair.feedback), (50.0, 0.5))
+
+    def test_boosted_pair_is_removed_with_its_playlist(self):
+        self.add()
+        cooccurrence.scale_pairs([self.a], [self.b], 2.0)
+        self.add(-1)
+        self.assertEqual(CoOccurrence.objects.count(), 0)
+
+#--------------------------------- Artwork ----------------------------------#
+
+class ArtworkTest(TestCase):
+
+    def setUp(self):
+        self.media_root = settings.MEDIA_ROOT
+        settings.MEDIA_ROOT = tempfile.mkdtemp(prefix='aenclave-test-')
+
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        settings.MEDIA_ROOT = self.media_root
+
+    def image(self, format):
+        output = StringIO()
+        artwork.Image.new('RGB', (400, 400)).save(output, format)
+        return output.getvalue()
+
+    def get(self, digest, size, **headers):
+        request = HttpRequest()
+        request.META.update(headers)
+        return artwork.art(request, digest, str(size))
+
+    def test_stores_real_type(self):
+        name = artwork.store_artwork(self.image('GIF'), 'image/jpeg')
+        self.assert_(name.endswith('.gif'), name)
+        self.assertEqual(artwork.store_artwork('not an image', 'text/html'),
+                         '')
+
+    def test_conditional_get(self):
+        name = artwork.store_artwork(self.image('PNG'), 'image/png')
+        digest = os.path.splitext(os.path.basename(name))[0]
+        size = artwork.art_sizes()[0]
+        response = self.get(digest, size)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        etag = response['ETag']
+        response = self.get(digest, size, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.get(digest, size, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, 200)
+        response = self.get(digest, size,
+                            HTTP_IF_MODIFIED_SINCE=http_date(0))
+        self.assertEqual(response.status_code, 200)
+        response = self.get(digest, size,
+                            HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+#-------------------------------- Downloads ---------------------------------#
+
+class SendFileTest(SongFileTestCase):
+
+    def test_if_modified_since(self):
+        song = self.make_song('download.mp3', 'download')
+        request = HttpRequest()
+        response = download.send_file(request, song.audio.path, 'audio/mpeg',
+                                      'download.mp3')
+        self.assertEqual(response.status_code, 200)
+        request.META['HTTP_IF_MODIFIED_SINCE'] = response['Last-Modified']
+        response = download.send_file(request, song.audio.path, 'audio/mpeg',
+                                      'download.mp3')
+        self.assertEqual(response.status_code, 304)
+
+#-------------------------------- Evaluation --------------------------------#
+
+class EvaluationTest(TestCase):
+
+    def test_cooccurrence_learns_sessions(self):
+        # Sessions of songs 1 and 2, an hour apart.
+        events = []
+        for hour in xrange(5):
+            events.append((hour * 3600, 1))
+            events.append((hour * 3600 + 1, 2))
+        (popular, cooccurring) = evaluation.evaluate(
+                events, [evaluation.PopularityRecommender(),
+                         evaluation.CoOccurrenceRecommender()], k=10)
+        self.assertEqual(cooccurring.queries, 5)
+        # Every session but the first is predicted from the ones before it.
+        self.assertEqual(cooccurring.hits, 4)
+        # Only one of the ten recommendations could be right.
+        self.assertAlmostEqual(cooccurring.precision, 4 / 50.0)
+        self.assertEqual(popular.hits, 4)
+
+#------------------------------ Chunked uploads -----------------------------#
+
+class ChunkUploadTest(SongFileTestCase):
+
+    def setUp(self):
+        super(ChunkUploadTest, self).setUp()
+        self.old_settings = {}
+        self.set_setting('AENCLAVE_UPLOAD_STAGING_DIR',
+                         os.path.join(self.scratch, 'uploads'))
+        self.set_setting('AENCLAVE_UPLOAD_CHUNK_SIZE', 8)
+        self.data = 'a song in three chunks'
+        (self.upload, received) = chunkupload.start_upload(
+                'song.mp3', len(self.data), 'key')
+        self.assertEqual(self.upload.chunk_count(), 3)
+        for number in xrange(3):
+            chunk = self.data[number * 8:(number + 1) * 8]
+            chunkupload.write_chunk(self.upload, number, StringIO(chunk),
+                                    len(chunk), md5(chunk))
+
+    def tearDown(self):
+        for (name, value) in self.old_settings.iteritems():
+            if value is None:
+                delattr(settings._wrapped, name)
+            else:
+                setattr(settings, name, value)
+        super(ChunkUploadTest, self).tearDown()
+
+    def set_setting(self, name, value):
+        self.old_settings[name] = getattr(settings, name, None)
+        setattr(settings, name, value)
+
+    def test_finish(self):
+        (song, job) = chunkupload.finish_upload(self.upload)
+        self.assertEqual(self.read_file(song.audio.name), self.data)
+        self.failIf(song.visible)
+        self.assertEqual(job.kind, 'ingest')
+        self.assertEqual(Upload.objects.count(), 0)
+
+    def test_finish_is_claimed_once(self):
+        # Another request for the same upload got there first.
+        self.assert_(chunkupload.claim(self.upload))
+        self.assertRaises(chunkupload.ChunkError,
+                          chunkupload.finish_upload, self.upload)
+        self.assertEqual(Song.objects.count(), 0)
+        self.assert_(os.path.exists(chunkupload.staging_path(self.upload)))
+
+#----------------------------- Smart playlists ------------------------------#
+
+class SmartPlaylistTest(SongFileTestCase):
+
+    def setUp(self):
+        super(SmartPlaylistTest, self).setUp()
+        self.owner = User.objects.create_superuser('owner', 'owner@mit.edu',
+                                                   'password')
+        self.songs = [self.make_song('%s.mp3' % title, title, title=title)
+                      for title in ('Love Me Do', 'Help', 'Love Is All')]
+        self.smart = smartplaylist.create(self.owner, 'Love',
+                                          'k=title&k_r=start&k_f0=Love')
+
+    def members(self):
+        return list(PlaylistEntry.objects.filter(playlist=self.smart.pk)
+                    .order_by('position').values_list('song', flat=True))
+
+    def test_is_relative(self):
+        self.failIf(self.smart.relative)
+        tree = smartplaylist.filter_tree(
+                'k=or&k_0=title&k_0_r=in&k_0_f0=Love'
+                '&k_1=date_added&k_1_r=last&k_1_f0=1&k_1_f1=week')
+        self.assert_(smartplaylist.is_relative(tree))
+
+    def test_create_fills_playlist(self):
+        self.assertEqual(self.members(), [self.songs[0].pk, self.songs[2].pk])
+        self.assert_(self.smart.playlist.is_smart())
+
+    def test_bad_filter(self):
+        self.assertRaises(smartplaylist.FilterError, smartplaylist.create,
+                          self.owner, 'Nothing', 'k=title&k_r=start&k_f0=')
+
+    def test_recheck_songs(self):
+        (love, other, love_too) = self.songs
+        other.title = 'Love Is Help'
+        other.save()
+        love.title = 'Loved'
+        love.save()
+        love_too.title = 'All You Need Is Love'
+        love_too.save()
+        smartplaylist.recheck_songs([love.pk, other.pk, love_too.pk])
+        self.assertEqual(self.members(), [love.pk, other.pk])
+        # Nothing changed, so nothing more happens.
+        self.failIf(smartplaylist.refresh(self.smart))
+
+    def test_update_members_keeps_order(self):
+        (love, other, love_too) = self.songs
+        current = set([love.pk, love_too.pk])
+        self.assert_(smartplaylist._update_members(
+                self.smart, [other.pk, love_too.pk], current))
+        self.assertEqual(self.members(), [love_too.pk, other.pk])
+        self.failIf(smartplaylist._update_members(
+                self.smart, [other.pk], set([other.pk])))
+
+    def test_refuses_manual_edits(self):
+        request = HttpRequest()
+        request.method = 'POST'
+        request.user = self.owner
+        request.POST['ids'] = str(self.songs[1].pk)
+        playlist.edit_playlist(request, self.smart.pk)
+        self.assertEqual(self.members(), [self.songs[0].pk, self.songs[2].pk])
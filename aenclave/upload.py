@@ -1,21 +1,32 @@
+import json
 import logging
 import os
+from StringIO import StringIO
 
 from django.conf import settings
 from django.core.files import File
 from django.http import Http404, HttpResponseRedirect
 from django.core.urlresolvers import reverse
 from django.template import RequestContext
+from django.template.loader import render_to_string
 
 from menclave.log.util import enable_logging
-from menclave.login import permission_required_redirect
+from menclave.login import (permission_required_json,
+                            permission_required_redirect)
 from menclave.aenclave.html import html_error, render_html_template
+from menclave.aenclave.json_response import json_error, render_json_response
+from menclave.aenclave.models import Upload
+from menclave.aenclave.utils import get_int_list, get_integer, get_unicode
+from menclave.aenclave import chunkupload
+from menclave.aenclave import jobs
 from menclave.aenclave import processing
 from menclave.aenclave import youtuberip
+from menclave.aenclave.uploadhandlers import get_checksum, hash_uploads
 
 #---------------------------------- Upload -----------------------------------#
 
 @enable_logging
+@hash_uploads
 @permission_required_redirect('aenclave.add_song', 'goto')
 def upload_http(request):
     # Nab the file and make sure it's legit.
@@ -24,14 +35,20 @@ def upload_http(request):
         return html_error(request, 'No file was uploaded.', 'HTTP Upload')
 
     try:
-        song, audio = processing.process_song(audio.name, audio)
+        song, job = processing.stage_song(audio.name, audio, request.user,
+                                          get_checksum(request, 'audio'))
     except processing.BadContent:
         return html_error(request, "You may only upload audio files.",
                           "HTTP Upload")
 
+    if job is None:
+        job_ids = ''
+    else:
+        job_ids = str(job.pk)
     return render_html_template('aenclave/upload_http.html', request,
                                 {'song_list': [song],
-                                 'sketchy_upload': audio.info.sketchy},
+                                 'duplicate': job is None,
+                                 'job_ids': job_ids},
                                 context_instance=RequestContext(request))
 
 def sftp_info(request):
@@ -42,32 +59,44 @@ def sftp_info(request):
 @permission_required_redirect('aenclave.add_song', 'goto')
 def upload_sftp(request):
     song_list = []
-    sketchy = False
+    job_ids = []
     sftp_upload_dir = settings.AENCLAVE_SFTP_UPLOAD_DIR
 
-    # Figure out available MP3's in SFTP upload DIR
+    # Figure out available MP3's in SFTP upload DIR.  We only move the files
+    # here; the tags and checksums are done by the job workers in parallel.
     for root, dirs, files in os.walk(sftp_upload_dir):
         for filename in files:
             if processing.valid_song(filename):
                 full_path = root + '/' + filename
 
                 content = File(open(full_path, 'r'))
-
-                song, audio = processing.process_song(full_path, content)
+                try:
+                    song, job = processing.stage_song(full_path, content,
+                                                      request.user)
+                finally:
+                    content.close()
 
                 song_list.append(song)
-
-                if audio.info.sketchy:
-                    sketchy = True
+                job_ids.append(str(job.pk))
 
                 #remove the file from the sftp-upload directory
                 os.unlink(full_path)
 
     return render_html_template('aenclave/upload_sftp.html', request,
                                 {'song_list': song_list,
-                                 'sketchy_upload': sketchy},
+                                 'job_ids': ' '.join(job_ids)},
                                 context_instance=RequestContext(request))
 
+def json_job_status(request):
+    """Report the status of background jobs, for upload pages to poll.
+
+    Jobs that belong to other users are left out.
+    """
+    job_ids = get_int_list(request.REQUEST, 'ids')
+    infos = [jobs.job_info(job) for job in jobs.get_jobs(job_ids)
+             if jobs.visible_to(job, request.user)]
+    return render_json_response(json.dumps({'jobs': infos}))
+
 @permission_required_redirect('aenclave.add_song', 'goto')
 def upload_http_fancy(request):
     # HTTPS is way slowed down..
@@ -75,7 +104,7 @@ def upload_http_fancy(request):
         return HttpResponseRedirect("http://" + request.get_host() +
                                     reverse("aenclave-http-upload-fancy"))
 
-    file_types = map(lambda s: "*.%s" % s, settings.SUPPORTED_AUDIO)
+    file_types = map(lambda s: ".%s" % s, settings.SUPPORTED_AUDIO)
     return render_html_template('aenclave/upload_http_fancy.html', request,
                                 {'song_list': [],
                                  'show_songlist': True,
@@ -83,85 +112,110 @@ def upload_http_fancy(request):
                                  'force_actions_bar':True},
                                 context_instance=RequestContext(request))
 
-def load_session_from_request(handler):
-    """Read the session key from the GET/POST vars instead of the cookie.
+#------------------------------ Chunked Upload -------------------------------#
 
-    Centipedes, in my request headers?
-    Yes! We sometimes receive the session key in the POST, because the
-    multiple-file-uploader uses Flash to send the request, and the best Flash
-    can do is grab our cookies from javascript and send them in the POST.
+def _get_upload(request, token):
+    """Find an upload by its token, checking that the user started it."""
+    try:
+        upload = Upload.objects.get(token=token)
+    except Upload.DoesNotExist:
+        raise Http404()
+    if upload.owner_id is not None and upload.owner_id != request.user.id:
+        raise Http404()
+    return upload
+
+def _request_body(request):
+    """Return a file-like object of the raw request body.
+
+    Under WSGI we read the input stream directly so the chunk is never held
+    in memory.
     """
-    def func(request, *args, **kwargs):
-        session_key = request.REQUEST.get(settings.SESSION_COOKIE_NAME, None)
-        if not session_key:
-            # TODO(rnk): Do something more sane like ask the user if their
-            #            session is expired or some other weirdness.
-            raise Http404()
-        # This is how SessionMiddleware does it.
-        session_engine = __import__(settings.SESSION_ENGINE, {}, {}, [''])
-        try:
-            request.session = session_engine.SessionStore(session_key)
-        except Exception, e:
-            return html_error(e)
-        return handler(request, *args, **kwargs)
-    return func
+    environ = getattr(request, 'environ', {})
+    if 'wsgi.input' in environ:
+        return environ['wsgi.input']
+    return StringIO(request.raw_post_data)
+
+def _upload_info(upload, received):
+    return {'token': upload.token,
+            'chunk_size': upload.chunk_size,
+            'chunk_count': upload.chunk_count(),
+            'received': received}
 
 @enable_logging
-@load_session_from_request
-@permission_required_redirect('aenclave.add_song', 'goto')
-def upload_http_fancy_receiver(request):
-    logging.info("Got fancy receiver request.")
-    audio = None
-    # The key is generally 'Filedata' but this is just easier.
-    for k,f in request.FILES.items():
-        audio = f
-
-    # SWFUpload does not properly fill out the song's mimetype, so
-    # just use the extension.
-    if audio is None:
-        logging.error("Did not find any file uploaded.")
-        return html_error(request, 'No file was uploaded.', 'HTTP Upload')
+@permission_required_json('aenclave.add_song')
+def json_upload_start(request):
+    """Start a chunked upload, or find the one to resume.
+
+    Takes the file's 'filename' and 'size', and a 'key' that the client will
+    use to resume the upload.  Returns where to send the chunks, the chunk
+    size, and the numbers of the chunks already received.
+    """
+    form = request.POST
+    filename = get_unicode(form, 'filename', u'')
+    size = get_integer(form, 'size')
+    if not filename or size is None:
+        return json_error('A filename and size are required.')
+    try:
+        upload, received = chunkupload.start_upload(
+                filename, size, get_unicode(form, 'key', u''), request.user)
+    except processing.BadContent:
+        return json_error('This filetype is unsupported.')
+    except chunkupload.ChunkError, e:
+        return json_error(str(e))
+    return render_json_response(json.dumps(_upload_info(upload, received)))
 
-    logging.info("Received upload of %s" % audio.name)
+@permission_required_json('aenclave.add_song')
+def json_upload_chunk(request, token, number):
+    """Receive a chunk of an upload, sent as the raw body of a PUT.
 
-    if not processing.valid_song(audio.name):
-        logging.error("Rejecting upload due to unsupported filetype")
-        return html_error(request, 'This filetype is unsupported.',
-                          'HTTP Upload')
+    The client may send an X-Chunk-MD5 header to have the chunk verified.
+    """
+    if request.method not in ('PUT', 'POST'):
+        return json_error('Chunks must be PUT.')
+    upload = _get_upload(request, token)
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+        checksum = chunkupload.write_chunk(
+                upload, int(number), _request_body(request), length,
+                request.META.get('HTTP_X_CHUNK_MD5'))
+    except (ValueError, chunkupload.ChunkError), e:
+        return json_error(str(e))
+    return render_json_response(json.dumps({'number': int(number),
+                                            'checksum': checksum}))
 
-    # Save the song into the database -- we'll fix the tags in a moment.
-    song, audio = processing.process_song(audio.name, audio)
+@enable_logging
+@permission_required_json('aenclave.add_song')
+def json_upload_finish(request, token):
+    """Finish an upload once all of its chunks are in, and queue its ingest.
 
-    return render_html_template('aenclave/songlist_song_row.html', request,
-                                {'song': song},
-                                context_instance=RequestContext(request))
+    Returns the song's row for the songlist and the ingest job's id.
+    """
+    upload = _get_upload(request, token)
+    try:
+        song, job = chunkupload.finish_upload(upload)
+    except chunkupload.ChunkError, e:
+        return json_error(str(e))
+    logging.info("Received upload of %s" % song.audio.name)
+    row = render_to_string('aenclave/songlist_song_row.html',
+                           {'song': song, 'job': job},
+                           context_instance=RequestContext(request))
+    return render_json_response(json.dumps({'song_id': song.pk,
+                                            'job': job.pk,
+                                            'row': row}))
 
 @permission_required_redirect('aenclave.add_song', 'goto')
 def upload_youtube_receiver(request):
-    url = request.POST.get('youtube-url', '')
+    """Queue a job to rip a YouTube video, and show its progress.
+
+    Ripping takes minutes, so it happens in the job workers.  Several
+    requests for the same video share one job.
+    """
+    url = request.POST.get('youtube-url', '').strip()
     if not url:
         return html_error(request, "URL required.")
-    #try:
-        #audio_pp = youtuberip.rip_video(url, path="/tmp/")
-    #except Exception, e:
-        #return html_error(request, e.message)
-    audio_pp = youtuberip.rip_video(url, path="/tmp/")
-    audio_file = audio_pp.audio_file
-    song, audio = processing.process_song(audio_file, File(open(audio_file)))
-    try:
-        sketchy = audio.info.sketchy
-    except AttributeError:
-        sketchy = True
-
-    # Fill in these defaults on the tags.  It would be better to tag the file
-    # as we rip it, but then we'd have to deal with teaching gstreamer to tag
-    # MP3 and M4As.
-    song.title = audio_pp.title
-    song.artist = audio_pp.uploader
-    song.album = 'YouTube'
-    song.save()
-
-    return render_html_template('aenclave/upload_http.html', request,
-                                {'song_list': [song],
-                                 'sketchy_upload': sketchy},
+    job = jobs.enqueue('youtube_rip', {'url': url},
+                       key=youtuberip.video_key(url), owner=request.user,
+                       coalesce=True)
+    return render_html_template('aenclave/upload_youtube.html', request,
+                                {'url': url, 'job': job},
                                 context_instance=RequestContext(request))
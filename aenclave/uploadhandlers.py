@@ -0,0 +1,60 @@
+# menclave/aenclave/uploadhandlers.py
+
+"""Upload handlers that do work while the upload streams in.
+
+Django writes each upload to memory or a temp file and then we save it into
+the library.  Checksumming it afterwards means reading the whole file back,
+so instead ChecksumUploadHandler hashes the chunks as they arrive and passes
+them along untouched to the handlers that actually store the file.
+"""
+
+import hashlib
+
+from django.core.files.uploadhandler import FileUploadHandler
+
+class ChecksumUploadHandler(FileUploadHandler):
+
+    """Computes the md5 of each uploaded file as its chunks are received.
+
+    The hex digests end up in request.upload_checksums, keyed by field name.
+
+    This handler never produces a file itself, so it must come before the
+    handlers that do.
+    """
+
+    def __init__(self, request=None):
+        super(ChecksumUploadHandler, self).__init__(request)
+        if not hasattr(request, 'upload_checksums'):
+            request.upload_checksums = {}
+
+    def new_file(self, field_name, file_name, content_type, content_length,
+                 charset=None):
+        super(ChecksumUploadHandler, self).new_file(
+                field_name, file_name, content_type, content_length, charset)
+        self.md5 = hashlib.md5()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.md5.update(raw_data)
+        # Pass the chunk on to the next handler.
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.request.upload_checksums[self.field_name] = self.md5.hexdigest()
+        # Returning None lets the next handler build the file object.
+        return None
+
+def hash_uploads(view):
+    """A view decorator that checksums uploads with ChecksumUploadHandler.
+
+    Upload handlers can only be changed before the request body is parsed, so
+    this has to go outside any decorator that looks at request.POST.
+    """
+    def func(request, *args, **kwargs):
+        request.upload_handlers.insert(0, ChecksumUploadHandler(request))
+        return view(request, *args, **kwargs)
+    func.func_name = view.func_name
+    return func
+
+def get_checksum(request, field_name):
+    """Return the md5 of an uploaded file, or None if it wasn't hashed."""
+    return getattr(request, 'upload_checksums', {}).get(field_name)
@@ -64,6 +64,10 @@ urlpatterns = patterns(
         'menclave.aenclave.browse.browse_index',
         name='aenclave-browse-index'),
 
+    url(r'^browse/hot/$',
+        'menclave.aenclave.browse.browse_hot',
+        name='aenclave-browse-hot'),
+
     (r'^browse/albums/(?P<letter>[a-zA-Z~#@])/$',
      'menclave.aenclave.browse.browse_albums'),
 
@@ -106,6 +110,10 @@ urlpatterns = patterns(
         'menclave.aenclave.channel.channel_reorder',
         name='aenclave-channel-reorder'),
 
+    url(r'^channels/(?P<channel_id>\d+)/metrics/$',
+        'menclave.aenclave.channel.player_metrics',
+        name='aenclave-player-metrics'),
+
     # Playlists
 
     url(r'^playlists/$',
@@ -140,6 +148,10 @@ urlpatterns = patterns(
         'menclave.aenclave.playlist.delete_playlist',
         name='aenclave-playlist-delete'),
 
+    url(r'^playlists/smart/create/$',
+        'menclave.aenclave.smartplaylist.create_smart_playlist',
+        name='aenclave-smart-playlist-create'),
+
     url(r'^playlists/edit/(?P<playlist_id>\d+)/$',
         'menclave.aenclave.playlist.edit_playlist',
         name='aenclave-playlist-edit'),
@@ -167,9 +179,17 @@ urlpatterns = patterns(
         'menclave.aenclave.upload.upload_youtube_receiver',
         name='aenclave-youtube-receiver'),
 
-    url(r'^upload/fancy/receive/$',
-        'menclave.aenclave.upload.upload_http_fancy_receiver',
-        name='aenclave-http-upload-fancy-receiver'),
+    url(r'^upload/chunked/start/$',
+        'menclave.aenclave.upload.json_upload_start',
+        name='aenclave-chunked-upload-start'),
+
+    url(r'^upload/chunked/(?P<token>[0-9a-f]{32})/(?P<number>\d+)/$',
+        'menclave.aenclave.upload.json_upload_chunk',
+        name='aenclave-chunked-upload-chunk'),
+
+    url(r'^upload/chunked/(?P<token>[0-9a-f]{32})/finish/$',
+        'menclave.aenclave.upload.json_upload_finish',
+        name='aenclave-chunked-upload-finish'),
 
 
     url(r'^upload/sftp/$',
@@ -186,6 +206,10 @@ urlpatterns = patterns(
         'menclave.aenclave.download.dl',
         name='aenclave-dl'),
 
+    url(r'^art/(?P<digest>[0-9a-f]{32})-(?P<size>\d+)\.jpg$',
+        'menclave.aenclave.artwork.art',
+        name='aenclave-art'),
+
     # Roulette
 
     url(r'^roulette/$',
@@ -235,6 +259,9 @@ urlpatterns = patterns(
     (r'^json/edit/$',
      'menclave.aenclave.edit.json_edit'),
 
+    (r'^json/bulk_edit/$',
+     'menclave.aenclave.edit.json_bulk_edit'),
+
     (r'^json/playlists/user/$',
      'menclave.aenclave.playlist.json_user_playlists'),
 
@@ -247,12 +274,23 @@ urlpatterns = patterns(
     (r'^json/controls_update/(?P<channel_id>\d+)/$',
      'menclave.aenclave.channel.json_control_update'),
 
+    (r'^json/player_metrics/(?P<channel_id>\d+)/$',
+     'menclave.aenclave.channel.json_player_metrics'),
+
     (r'^json/favorite_song/(?P<song_id>\d+)/$',
      'menclave.aenclave.views.favorite_song'),
 
     (r'^json/search/$',
      'menclave.aenclave.search.json_search'),
 
+    url(r'^json/hot/$',
+        'menclave.aenclave.browse.json_hot',
+        name='aenclave-json-hot'),
+
+    url(r'^json/jobs/$',
+        'menclave.aenclave.upload.json_job_status',
+        name='aenclave-json-jobs'),
+
     # Speech recognition parts
 
     (r'^speech_page/$',
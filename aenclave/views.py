@@ -85,16 +85,17 @@ def favorite_song(request, song_id):
     if favorited and not fav:
         pl.append_songs([song])
     elif not favorited and fav:
-        fav.delete()
+        pl.remove_songs([song])
     return json_response.json_success("%s favorited: %r" % (song_id, favorited))
 
 def speech_page(request):
-    grammar = wami_grammar.generate()
+    grammar = wami_grammar.grammar()
     return render_html_template(
         'aenclave/speech_page.html', request,
         {
             'WAMI_KEY' : settings.WAMI_API_KEY[request.META['HTTP_HOST']],
-            'grammar' : grammar
+            'grammar' : grammar['songs'],
+            'playlist_grammar' : grammar['playlists']
         },
         context_instance=RequestContext(request))
 
@@ -1,128 +1,149 @@
-#!/usr/bin/python
+# menclave/aenclave/wami_grammar.py
+
+"""The JSGF grammar of the WAMI speech page.
+
+Every visible song can be asked for as:
+
+    <title>
+    <title> by <artist>
+    <title> from [the album] <album>
+
+and every playlist as 'playlist <name>'.  That's too much to build on every
+page load, so the grammar is built by a background job and kept in the cache
+along with the library version it was built from.  Adding or deleting a song
+or playlist, or saving one whose name changed, bumps the version and queues a
+rebuild; until it finishes, the speech page gets the previous grammar.  A
+rebuild that hasn't started yet is reused rather than queued again.  Code that
+changes songs without save(), like bulk edits, must call library_changed()
+itself.
+
+Like the listening session in history.py, this needs a cache shared by the
+web processes and the job workers, such as memcached.
+"""
 
-from menclave.aenclave.models import Song
-from menclave.aenclave.json_response import render_json_response
 import re
-import json
+import time
+
+from django.core.cache import cache
+
+from menclave.aenclave.models import Playlist, Song
+from menclave.aenclave import jobs
+
+# The cache keys of the library version and of the grammar built from it.
+VERSION_KEY = 'aenclave-wami-grammar-version'
+GRAMMAR_KEY = 'aenclave-wami-grammar'
+
+# How long the cache may keep them.  A dropped grammar is rebuilt.
+CACHE_SECONDS = 30 * 24 * 60 * 60
+
+# What an empty rule expands to, since JSGF doesn't allow empty rules.
+EMPTY_RULE = '<VOID>'
 
-# start of grammar
+_APOSTROPHES = re.compile("'")
+_NON_LETTERS = re.compile('[^a-z ]+')
+_SPACES = re.compile(' +')
+_LEADING_ARTICLE = re.compile('^(a|the) ')
 
 # clean up a request:
 # - lowercase
 # - remove punctuation
-# - put a . after single letters
-# - let 'a' and 'the' be optional
+# - let a leading 'a' or 'the' be optional
 def cleanup(s):
-    s = s.lower()
-    s = re.sub("'", "", s)
-    s = re.sub("[^a-z ]+", ' ', s) 
-    s = re.sub('^a ', ' [a] ', s)
-    s = re.sub('^the ', ' [the] ', s)
-    return s
+    s = _APOSTROPHES.sub('', s.lower())
+    s = _SPACES.sub(' ', _NON_LETTERS.sub(' ', s)).strip()
+    return _LEADING_ARTICLE.sub(r'[\1] ', s)
 
+#--------------------------------- Building ---------------------------------#
+
+def _alternatives(alternatives):
+    if not alternatives:
+        return EMPTY_RULE
+    return ' |\n\t'.join(alternatives)
+
+def song_rule():
+    """Return the alternatives of the <songs> rule, one per visible song."""
+    # Artists and albums repeat a lot, so only clean each one up once.
+    cleaned = {}
+    def clean(s):
+        if s not in cleaned:
+            cleaned[s] = cleanup(s)
+        return cleaned[s]
+    alternatives = []
+    rows = Song.visibles.order_by().values_list('id', 'title', 'artist',
+                                                'album')
+    for (pk, title, artist, album) in rows.iterator():
+        title = cleanup(title)
+        if not title:
+            continue
+        qualifiers = []
+        artist = clean(artist)
+        if artist:
+            qualifiers.append('by ' + artist)
+        album = clean(album)
+        if album:
+            qualifiers.append('from [the album] ' + album)
+        if qualifiers:
+            title += ' [(' + ' | '.join(qualifiers) + ')]'
+        alternatives.append('%s {[id=%d]}' % (title, pk))
+    return _alternatives(alternatives)
+
+def playlist_rule():
+    """Return the alternatives of the <playlists> rule."""
+    alternatives = []
+    for (pk, name) in Playlist.objects.order_by().values_list('id', 'name'):
+        name = cleanup(name)
+        if name:
+            alternatives.append('%s {[pid=%d]}' % (name, pk))
+    return _alternatives(alternatives)
 
 def generate():
-    
-    # # load song info and print it as a grammar.
-    # ways you can queue a song:
-    # - songname
-    # - songname by artistname
-    # - songname from albumtitle
-    
-    ret = ''
-    i = 0
-    
-    ids = set()
-    
-    ids.update([x[0] for x in Song.objects.order_by("-play_count")[:400].values_list('id')])
-    ids.update([x[0] for x in Song.objects.order_by("-last_played")[:200].values_list('id')])
-    ids.update([x[0] for x in Song.objects.order_by("-date_added")[:200].values_list('id')])
-        
-    for pk,song in Song.objects.in_bulk(list(ids)).items():
-        
-        i += 1
-        
-        if i > 1 :
-            ret += ' | '
-        
-        title = cleanup(song.title)
-        artist = cleanup(song.artist)
-        album = cleanup(song.album)
-        
-        ret += title + ' [by '+artist+'] {[id='+str(pk)+']}'
-
-    return ret
-
-# print '''#JSGF V1.0;
-# grammar NiceRack;
-# 
-# public <top> = <msg> ;
-# 
-# <msg> = <queuecmd> {[command=queue]} | <dequeuecmd> {[command=dequeue]}  |
-#  <dequeueall> {[command=dequeueall]} | <pausecmd> {[command=pause]} | 
-#  <resumecmd> {[command=resume]} | <playlist> {[command=playlist]}  |
-#  <tellsongname> {[command=tellsongname]} ;
-# 
-# <dequeuecmd> = dequeue this song ;
-# 
-# <dequeueall> = dequeue everything ;
-# 
-# <queuecmd> = [computer] <queueword> [me] <request> ;
-# 
-# <queueword> = queue | play ;
-# 
-# <pausecmd> = pause | pause this song ;
-# 
-# <resumecmd> = resume this song | play this song | play | resume ; 
-# 
-# <playlist> = [computer] <queueword> [me] the playlist <playlistname> ;
-# 
-# <tellsongname> = what is the name of this song ;
-# 
-# <request> = '''
-# 
-# # TODO automate playlistname generation
-# 
-# 
-# 
-# # load song info and print it as a grammar.
-# # ways you can queue a song:
-# # - songname
-# # - songname by artistname
-# # - songname from albumtitle
-# i = 0
-# l = len(Song.objects.all())
-# for song in Song.objects.all():
-#     i += 1
-#     
-#     title = cleanup(song.title)
-#     artist = cleanup(song.artist)
-#     album = cleanup(song.album)
-#     id = str(song.id)
-# 
-#     title_only = title +  ' {[id=' + id + ']} | ' 
-#     title_by_artist = title + ' by ' + artist + ' {[id=' + id + ']} | '
-#     title_from_album = title + ' from [the album] ' + album + ' {[id=' + id + ']} '
-# 
-#     print title_only
-#     print title_by_artist
-#     if i != l:
-#         title_from_album += ' | '
-#     print title_from_album
-# 
-# print ' ; '
-# 
-# 
-# # load playlist info and add it to the grammar.
-# i = 0
-# l = len(Playlist.objects.all())
-# print '<playlistname> = '
-# for p in Playlist.objects.all():
-#     i += 1
-#     plname = cleanup(str(p))
-#     plname += ' {[pid=' + str(p.id) + ']}' 
-#     if i != l:
-#         plname += ' | '
-#     print plname
-# 
-# print ' ; '
+    """Build the grammar now.  Returns a dict of the song and playlist rules."""
+    return {'songs': song_rule(), 'playlists': playlist_rule()}
+
+#--------------------------------- Caching ----------------------------------#
+
+def library_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = 0
+        cache.add(VERSION_KEY, version, CACHE_SECONDS)
+    return version
+
+def library_changed():
+    """Note that songs or playlists changed, and queue a rebuild."""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # The version was dropped.  Start it somewhere no cached grammar
+        # could have been built from.
+        cache.set(VERSION_KEY, int(time.time()), CACHE_SECONDS)
+    jobs.enqueue('wami_grammar', key='all', coalesce=True,
+                 coalesce_running=False)
+
+def rebuild():
+    """Build the grammar and cache it with the version it was built from."""
+    version = library_version()
+    rules = generate()
+    cache.set(GRAMMAR_KEY, (version, rules), CACHE_SECONDS)
+    return rules
+
+@jobs.handler('wami_grammar')
+def rebuild_job(job):
+    """The job handler that runs rebuild()."""
+    rules = rebuild()
+    return {'bytes': sum(len(rule) for rule in rules.itervalues())}
+
+def grammar():
+    """Return the cached grammar, queuing a rebuild if it's out of date.
+
+    Only when nothing is cached at all, say after a restart with a local
+    memory cache, is the grammar built during the request.
+    """
+    cached = cache.get(GRAMMAR_KEY)
+    if cached is None:
+        return rebuild()
+    (version, rules) = cached
+    if version != library_version():
+        jobs.enqueue('wami_grammar', key='all', coalesce=True,
+                     coalesce_running=False)
+    return rules
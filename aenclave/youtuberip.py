@@ -4,8 +4,12 @@
 
 import logging
 import os
+import re
+import shutil
+import tempfile
 import time
 import threading
+import urllib
 import sys
 sys.path.append("/Users/reid/")  # TODO(rnk): Delete before committing.
 
@@ -14,7 +18,18 @@ gobject.threads_init()
 import pygst
 pygst.require("0.10")
 import gst
-
+try:
+    from gst import pbutils
+except ImportError:
+    # Discoverer needs gst-python 0.10.22 or later.  Without it we always
+    # reencode.
+    pbutils = None
+
+from django.conf import settings
+from django.core.files import File
+
+from menclave.aenclave import jobs
+from menclave.aenclave import processing
 from menclave.aenclave import youtubedl
 
 
@@ -42,52 +57,115 @@ def make_bin_pads(bin, input, output):
     bin.add_pad(binsink)
 
 
-def build_mp4_remux_bin():
-    """This bin will rip audio from video by demuxing an MP4.
-
-    This method is fast and high quality, but it only works on MP4s.
+# The demuxers for the containers whose audio we can copy out without
+# decoding it, by file extension.
+DEMUXERS = {
+    ".mp4": "qtdemux",
+    ".m4v": "qtdemux",
+    ".flv": "flvdemux",
+    ".webm": "matroskademux",
+    ".mkv": "matroskademux",
+}
+
+# How to store each audio codec without reencoding it: the parsers to try,
+# the muxers to try (none for a bare stream), and the file extension, which
+# must be one of SUPPORTED_AUDIO.
+REMUX_FORMATS = {
+    "mp3": (("mpegaudioparse", "mp3parse"), (), "mp3"),
+    "aac": (("aacparse",), ("mp4mux", "qtmux"), "m4a"),
+}
+
+
+def make_element(*names):
+    """Make the first of the named elements that is installed."""
+    for name in names:
+        element = gst.element_factory_find(name)
+        if element is not None:
+            return gst.element_factory_make(name)
+    raise youtubedl.PostProcessingError("No gstreamer element named %s." %
+                                        " or ".join(names))
+
+
+def audio_codec(caps):
+    """Name the codec of an audio stream from its caps, or return None."""
+    structure = caps[0]
+    if structure.get_name() != "audio/mpeg":
+        return None
+    version = structure["mpegversion"]
+    if version == 1:
+        if structure.has_field("layer") and structure["layer"] != 3:
+            return None
+        return "mp3"
+    if version in (2, 4):
+        return "aac"
+    return None
+
+
+def detect_audio_codec(video_file, timeout=30):
+    """Return the codec of a video's first audio stream, if we know it.
+
+    Returns None if the codec isn't one we can remux, or it can't be
+    detected, in which case the audio has to be reencoded.
     """
-    bin = gst.Bin("mp4_remux")
-
-    # Make elements.
-    demux = gst.element_factory_make("qtdemux")
-    queue = gst.element_factory_make("queue")
-    mux = gst.element_factory_make("qtmux")
-
-    # Link and add elements.
-    bin.add(demux, queue, mux)
-    def demux_callback(demux, new_pad):
-        if new_pad.get_name() == "audio_00":
-            demux.link(queue)
-    demux.connect("pad-added", demux_callback)
-    queue.link(mux)
-
-    make_bin_pads(bin, demux, mux)
-
-    return bin
-
-
-def build_flv_demux_bin():
-    """This bin will rip audio from video by demuxing an MP4.
-
-    This method is fast and high quality, but it only works on MP4s.
-    
-    TODO(rnk): This method is totally broken and needs work.
+    if pbutils is None:
+        return None
+    uri = "file://" + urllib.pathname2url(os.path.abspath(video_file))
+    try:
+        discoverer = pbutils.Discoverer(timeout * gst.SECOND)
+        info = discoverer.discover_uri(uri)
+    except gobject.GError, e:
+        logging.warning("Couldn't detect the codecs of %s: %s", video_file, e)
+        return None
+    streams = info.get_audio_streams()
+    if not streams:
+        return None
+    return audio_codec(streams[0].get_caps())
+
+
+def remux_format(video_file):
+    """Return the REMUX_FORMATS entry to copy a video's audio out with.
+
+    Returns None if the audio has to be reencoded.
+    """
+    ext = os.path.splitext(video_file)[1].lower()
+    if ext not in DEMUXERS:
+        return None
+    codec = detect_audio_codec(video_file)
+    if codec not in REMUX_FORMATS:
+        return None
+    if REMUX_FORMATS[codec][2] not in settings.SUPPORTED_AUDIO:
+        return None
+    return REMUX_FORMATS[codec]
+
+
+def build_remux_bin(demuxer, parsers, muxers):
+    """This bin will rip audio from video by copying it out of its container.
+
+    This method is fast and doesn't lose any quality, but it only works when
+    the audio is already in a format we can store.
     """
-    bin = gst.Bin("flv_demux")
+    bin = gst.Bin("remux")
 
     # Make elements.
-    demux = gst.element_factory_make("flvdemux")
-
-    # Link and add elements.
-    bin.add(demux)
+    demux = gst.element_factory_make(demuxer)
+    queue = gst.element_factory_make("queue")
+    parse = make_element(*parsers)
+    elements = [demux, queue, parse]
+    if muxers:
+        elements.append(make_element(*muxers))
+
+    # Link and add elements.  The demuxer only makes its pads once it has
+    # read the container, so we link the audio pad when it shows up and
+    # leave the video pad unlinked.
+    bin.add(*elements)
     def demux_callback(demux, new_pad):
-        print new_pad
-        if new_pad.get_name() in ("audio_00", "src"):
-            bin.add_pad(new_pad)
+        caps = new_pad.get_caps()
+        if caps and caps[0].get_name().startswith("audio/"):
+            new_pad.link(queue.get_pad("sink"))
     demux.connect("pad-added", demux_callback)
+    gst.element_link_many(*elements[1:])
 
-    bin.add_pad(gst.GhostPad("binsrc", demux.get_static_pad("sink")))
+    make_bin_pads(bin, demux, elements[-1])
 
     return bin
 
@@ -95,9 +173,9 @@ def build_flv_demux_bin():
 def build_reencode_bin():
     """This bin will rip audio from video by reencoding it to MP3.
 
-    This method is slow and low quality, but it will always work.  We keep it
-    around here in case we need it again eventually, because it's really tricky
-    to get right.
+    This method is slow and low quality, but it will always work, so we fall
+    back to it for audio that we can't remux.  It's really tricky to get
+    right.
     """
     bin = gst.Bin("reencode")
 
@@ -118,9 +196,36 @@ def build_reencode_bin():
     return bin
 
 
-def rip_video_audio(video_file):
+def rip_video_audio(video_file, progress=None):
+    """Rip the audio track out of a video file, and return the audio's path.
+
+    If the audio is already MP3 or AAC, it is copied out of the video as it
+    is.  Otherwise it is reencoded to MP3.  If progress is given, it is
+    called every second or so with the fraction of the video that has been
+    converted.
+    """
     init_gobject_mainloop()
 
+    (root, ext) = os.path.splitext(video_file)
+    format = remux_format(video_file)
+    if format is not None:
+        (parsers, muxers, audio_ext) = format
+        audio_file = root + "." + audio_ext
+        bin = build_remux_bin(DEMUXERS[ext.lower()], parsers, muxers)
+        try:
+            return run_pipeline(video_file, audio_file, bin, progress)
+        except youtubedl.PostProcessingError, e:
+            # The stream may not be what the container claimed.  Reencoding
+            # is slow, but it copes with anything.
+            logging.warning("Couldn't remux %s, reencoding it: %s",
+                            video_file, e)
+
+    audio_file = video_file + ".mp3"
+    return run_pipeline(video_file, audio_file, build_reencode_bin(), progress)
+
+
+def run_pipeline(video_file, audio_file, bin, progress=None):
+    """Run video_file through bin into audio_file, and return audio_file."""
     # Set up pipe.
     pipe = gst.Pipeline("sound")
 
@@ -128,16 +233,6 @@ def rip_video_audio(video_file):
     src = gst.element_factory_make("filesrc")
     src.set_property("location", video_file)
 
-    if video_file.endswith(".mp4"):
-        audio_file = video_file[:-4] + ".m4a"
-        bin = build_mp4_remux_bin()
-    # TODO(rnk): Make this work for FLVs.  For now we just reencode.
-    #elif video_file.endswith(".flv"):
-        #bin = build_flv_demux_bin()
-    else:
-        audio_file = video_file + ".mp3"
-        bin = build_reencode_bin()
-
     # Set up file sink.
     sink = gst.element_factory_make("filesink")
     sink.set_property("location", audio_file)
@@ -147,44 +242,64 @@ def rip_video_audio(video_file):
     src.link(bin)
     bin.link(sink)
 
-    # Register the finished callback and start the reencoding.
+    # Register the finished callback and start the conversion.
     finished_event = threading.Event()
     bus = pipe.get_bus()
     bus.add_signal_watch()
-    error_message = None
+    # A list so that the callback can set it.
+    error_messages = []
     def on_message(bus, message):
         t = message.type
         if t == gst.MESSAGE_EOS:
             finished_event.set()
         elif t == gst.MESSAGE_ERROR:
-            logging.exception(message)
-            error_message = str(message)
+            logging.error(message)
+            error_messages.append(str(message))
             finished_event.set()
     bus.connect("message", on_message)
 
     pipe.set_state(gst.STATE_PAUSED)
     pipe.set_state(gst.STATE_PLAYING)
 
-    # Wait until the reencoding is done, and then return.  We use the timeout
-    # plus the busy loop to be able to respond to KeyboardInterrupts.  Python
-    # threading sucks.
+    # Wait until the conversion is done, and then return.  We use the timeout
+    # plus the busy loop to be able to respond to KeyboardInterrupts, and to
+    # report how far along the pipeline is.  Python threading sucks.
     while not finished_event.is_set():
-        finished_event.wait(timeout=120)
+        finished_event.wait(timeout=1)
+        if progress is not None:
+            progress(pipeline_fraction(pipe))
     pipe.set_state(gst.STATE_NULL)
-    if error_message:
-        raise youtubedl.PostProcessingError(error_message)
+    bus.remove_signal_watch()
+    if error_messages:
+        if os.path.exists(audio_file):
+            os.remove(audio_file)
+        raise youtubedl.PostProcessingError(error_messages[0])
     return audio_file
 
 
+def pipeline_fraction(pipe):
+    """Return how far through its stream a pipeline is, between 0 and 1."""
+    try:
+        (position, format) = pipe.query_position(gst.FORMAT_TIME)
+        (duration, format) = pipe.query_duration(gst.FORMAT_TIME)
+    except gst.QueryError:
+        # The pipeline hasn't prerolled yet.
+        return 0.0
+    if duration <= 0:
+        return 0.0
+    return float(position) / duration
+
+
 class RipAudioPP(youtubedl.PostProcessor):
 
-    def __init__(self):
+    def __init__(self, progress=None):
         self.audio_file = None
         self.title = None
         self.uploader = None
+        self.progress = progress
 
     def run(self, info):
-        self.audio_file = rip_video_audio(info['filepath'])
+        self.audio_file = rip_video_audio(info['filepath'], self.progress)
         # Replace the pluses with spaces, the most common thing we want.  The
         # title will suck anyway, there's nothing we can do.
         self.title = info['title'].replace('+', ' ')
@@ -194,14 +309,29 @@ class RipAudioPP(youtubedl.PostProcessor):
 
 class MyFileDownloader(youtubedl.FileDownloader):
 
-    def report_progress(self, percent_str, data_len_str, speed_str, eta_str):
-        # TODO(rnk): If anyone ever wants to implement a progress bar, do so
-        # here.
-        pass
-
+    def __init__(self, params, progress=None):
+        youtubedl.FileDownloader.__init__(self, params)
+        self.progress = progress
 
-def rip_video(url, path="."):
-    """Download a video from a URL and convert it to an MP3."""
+    def report_progress(self, percent_str, data_len_str, speed_str, eta_str):
+        # percent_str looks like ' 42.1%', or '---.-%' if the length of the
+        # video is unknown.
+        if self.progress is None:
+            return
+        try:
+            fraction = float(percent_str.strip().rstrip('%')) / 100
+        except ValueError:
+            fraction = 0.0
+        self.progress(fraction, speed_str.strip(), eta_str.strip())
+
+
+def rip_video(url, path=".", download_progress=None, rip_progress=None):
+    """Download a video from a URL and convert it to an MP3.
+
+    download_progress is called with the fraction downloaded, the speed and
+    the ETA as the video downloads, and rip_progress with the fraction
+    converted as its audio is ripped.
+    """
     # Information extractors
     youtube_ie = youtubedl.YoutubeIE()
 
@@ -221,15 +351,77 @@ def rip_video(url, path="."):
         'ratelimit': None,
         'nooverwrites': False,
         'continuedl': False,
-        })
+        }, download_progress)
     fd.add_info_extractor(youtube_ie)
-    audio_pp = RipAudioPP()
+    audio_pp = RipAudioPP(rip_progress)
     fd.add_post_processor(audio_pp)
     retcode = fd.download([url])
     assert retcode == 0
     return audio_pp
 
 
+def video_key(url):
+    """Return the YouTube video id of a URL, so rips of it can be coalesced.
+
+    URLs that don't look like YouTube videos are returned as they are.
+    """
+    match = re.match(youtubedl.YoutubeIE._VALID_URL, url)
+    if match is None or not match.group(2):
+        return url[:255]
+    return match.group(2)
+
+
+@jobs.handler('youtube_rip')
+def rip_youtube(job, url):
+    """The job handler that rips a YouTube video into a new song.
+
+    Downloading is the first half of the progress, and ripping the audio is
+    most of the rest.
+    """
+    download = jobs.ProgressReporter(job, 0.0, 0.5)
+    rip = jobs.ProgressReporter(job, 0.5, 0.95)
+    def download_progress(fraction, speed, eta):
+        download.report(fraction, 'Downloading at %s, %s left' % (speed, eta))
+    def rip_progress(fraction):
+        rip.report(fraction, 'Ripping the audio')
+
+    path = tempfile.mkdtemp(prefix='youtube-')
+    try:
+        jobs.set_progress(job, 0.0, 'Fetching the video information')
+        audio_pp = rip_video(url, path, download_progress, rip_progress)
+        jobs.set_progress(job, 0.95, 'Adding the song')
+        audio_file = audio_pp.audio_file
+        # Ripping the same video again can give the same bytes, in which case
+        # process_song hands back the song already in the library.
+        checksum = processing.md5sum(audio_file)
+        created = processing.find_duplicate(checksum) is None
+        content = File(open(audio_file, 'rb'))
+        try:
+            song, audio = processing.process_song(
+                    os.path.basename(audio_file), content, checksum)
+        finally:
+            content.close()
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+    try:
+        sketchy = audio.info.sketchy
+    except AttributeError:
+        sketchy = True
+
+    # Fill in these defaults on the tags.  It would be better to tag the file
+    # as we rip it, but then we'd have to deal with teaching gstreamer to tag
+    # MP3 and M4As.  A song that was already in the library keeps its tags.
+    if created:
+        song.title = audio_pp.title
+        song.artist = audio_pp.uploader
+        song.album = 'YouTube'
+        song.save()
+    return {'song_id': song.pk,
+            'title': song.title,
+            'url': song.get_absolute_url(),
+            'sketchy': sketchy}
+
+
 if __name__ == "__main__":
     #rip_video(sys.argv[1])
     rip_video_audio(sys.argv[1])
@@ -0,0 +1,194 @@
+# menclave/aenclave/zipstream.py
+
+"""A ZIP_STORED archive writer that streams straight to the HTTP response.
+
+Songs are already compressed, so we never deflate them.  That means every
+header and the size of every member are known before we read a single byte of
+audio, so we can send an exact Content-Length up front and then emit the
+local headers, file data and central directory in order without ever touching
+a temp file.  Only the CRC-32 of each member has to be computed on the fly;
+it goes in a data descriptor after the member (general purpose flag bit 3)
+and in the central directory at the end.
+
+Archives whose offsets don't fit in 32 bits get ZIP64 central directory
+records, so multi-gigabyte selections work.  Individual members must still be
+smaller than 4 GB, which is not a problem for songs.
+"""
+
+import os
+import struct
+import time
+import zlib
+
+# Read song data in large chunks; small reads are slow on network storage.
+CHUNK_SIZE = 1024 * 1024
+
+_ZIP32_LIMIT = 0xFFFFFFFF
+_ZIP16_LIMIT = 0xFFFF
+
+# General purpose flags: bit 3 means a data descriptor follows the member,
+# bit 11 means the name is UTF-8.
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+
+_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+_DATA_DESCRIPTOR = struct.Struct('<IIII')
+_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+_ZIP64_OFFSET_EXTRA = struct.Struct('<HHQ')
+_END_RECORD = struct.Struct('<IHHHHIIH')
+_ZIP64_END_RECORD = struct.Struct('<IQHHIIQQQQ')
+_ZIP64_END_LOCATOR = struct.Struct('<IIQI')
+
+
+def _dos_datetime(mtime):
+    """Convert a Unix timestamp to the (time, date) pair that zip uses."""
+    tm = time.localtime(mtime)
+    if tm.tm_year < 1980:
+        return 0, (1 << 5) | 1  # 1980-01-01 00:00:00
+    dos_time = (tm.tm_hour << 11) | (tm.tm_min << 5) | (tm.tm_sec // 2)
+    dos_date = ((tm.tm_year - 1980) << 9) | (tm.tm_mon << 5) | tm.tm_mday
+    return dos_time, dos_date
+
+
+class _Member(object):
+
+    """The bookkeeping for one file in the archive."""
+
+    def __init__(self, path, arcname, offset):
+        self.path = path
+        if isinstance(arcname, unicode):
+            self.name = arcname.encode('utf-8')
+            self.flags = _FLAG_DATA_DESCRIPTOR | _FLAG_UTF8
+        else:
+            self.name = arcname
+            self.flags = _FLAG_DATA_DESCRIPTOR
+        stat = os.stat(path)
+        self.size = stat.st_size
+        if self.size >= _ZIP32_LIMIT:
+            raise ValueError('%r is too large to archive.' % path)
+        self.dos_time, self.dos_date = _dos_datetime(stat.st_mtime)
+        self.offset = offset
+        self.zip64 = offset >= _ZIP32_LIMIT
+        self.crc = 0
+
+    def local_size(self):
+        """The bytes this member takes up before the central directory."""
+        return (_LOCAL_HEADER.size + len(self.name) + self.size +
+                _DATA_DESCRIPTOR.size)
+
+    def central_size(self):
+        size = _CENTRAL_HEADER.size + len(self.name)
+        if self.zip64:
+            size += _ZIP64_OFFSET_EXTRA.size
+        return size
+
+    def version(self):
+        if self.zip64:
+            return 45
+        return 20
+
+    def local_header(self):
+        # The CRC isn't known yet; it goes in the data descriptor.  The sizes
+        # are known, so we fill them in for readers that stream the archive.
+        return _LOCAL_HEADER.pack(0x04034b50, 20, self.flags, 0,
+                                  self.dos_time, self.dos_date, 0,
+                                  self.size, self.size, len(self.name),
+                                  0) + self.name
+
+    def data_descriptor(self):
+        return _DATA_DESCRIPTOR.pack(0x08074b50, self.crc, self.size,
+                                     self.size)
+
+    def central_header(self):
+        if self.zip64:
+            extra = _ZIP64_OFFSET_EXTRA.pack(0x0001, 8, self.offset)
+            offset = _ZIP32_LIMIT
+        else:
+            extra = ''
+            offset = self.offset
+        version = self.version()
+        header = _CENTRAL_HEADER.pack(0x02014b50, version, version,
+                                      self.flags, 0, self.dos_time,
+                                      self.dos_date, self.crc, self.size,
+                                      self.size, len(self.name), len(extra),
+                                      0, 0, 0, 0644 << 16, offset)
+        return header + self.name + extra
+
+
+class ZipStream(object):
+
+    """An iterable that yields a ZIP_STORED archive of files on disk.
+
+    members -- A list of tuples of the form (path, arcname).
+
+    The files are stat'ed when the stream is created, so `size` is the exact
+    length of the archive and can be sent as the Content-Length.
+    """
+
+    def __init__(self, members, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.members = []
+        offset = 0
+        for (path, arcname) in members:
+            member = _Member(path, arcname, offset)
+            self.members.append(member)
+            offset += member.local_size()
+        self.cd_offset = offset
+        self.cd_size = sum(member.central_size() for member in self.members)
+        self.zip64 = (len(self.members) >= _ZIP16_LIMIT or
+                      self.cd_offset >= _ZIP32_LIMIT or
+                      self.cd_size >= _ZIP32_LIMIT)
+        self.size = self.cd_offset + self.cd_size + _END_RECORD.size
+        if self.zip64:
+            self.size += _ZIP64_END_RECORD.size + _ZIP64_END_LOCATOR.size
+
+    def __iter__(self):
+        for member in self.members:
+            yield member.local_header()
+            for chunk in self._read_member(member):
+                yield chunk
+            yield member.data_descriptor()
+        for member in self.members:
+            yield member.central_header()
+        yield self._end_records()
+
+    def _read_member(self, member):
+        """Yield the member's data and compute its CRC as we go.
+
+        We read exactly as many bytes as we promised in the headers.  If the
+        file shrank underneath us, there's no way to keep the archive valid,
+        so we give up on the response.
+        """
+        crc = 0
+        remaining = member.size
+        f = open(member.path, 'rb')
+        try:
+            while remaining > 0:
+                chunk = f.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    raise IOError('%r shrank while it was being archived.' %
+                                  member.path)
+                crc = zlib.crc32(chunk, crc)
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            f.close()
+        member.crc = crc & 0xFFFFFFFF
+
+    def _end_records(self):
+        count = len(self.members)
+        records = []
+        if self.zip64:
+            zip64_end_offset = self.cd_offset + self.cd_size
+            records.append(_ZIP64_END_RECORD.pack(
+                0x06064b50, _ZIP64_END_RECORD.size - 12, 45, 45, 0, 0, count,
+                count, self.cd_size, self.cd_offset))
+            records.append(_ZIP64_END_LOCATOR.pack(0x07064b50, 0,
+                                                   zip64_end_offset, 1))
+        records.append(_END_RECORD.pack(0x06054b50, 0, 0,
+                                        min(count, _ZIP16_LIMIT),
+                                        min(count, _ZIP16_LIMIT),
+                                        min(self.cd_size, _ZIP32_LIMIT),
+                                        min(self.cd_offset, _ZIP32_LIMIT),
+                                        0))
+        return ''.join(records)